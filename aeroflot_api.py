@@ -0,0 +1,204 @@
+import logging
+import re
+import config
+
+logger = logging.getLogger(__name__)
+
+# XHR, которым SPA запрашивает выдачу (наличие мест и цены в милях).
+# Только путь поиска премиальных билетов, а не любой /api/...search на странице
+SEARCH_API_RE = re.compile(config.SEARCH_API_PATTERN, re.IGNORECASE)
+
+# Возможные имена полей в ответе API. Формат ответа не документирован,
+# поэтому декодер перебирает варианты и честно сдается, если не нашел нужного.
+ITINERARY_KEYS = ("itineraries", "variants", "offers", "flights")
+SEGMENT_KEYS = ("segments", "legs", "flights")
+TARIFF_KEYS = ("prices", "tariffs", "fares", "brands")
+TARIFF_NAME_KEYS = ("brand_name", "tariff_group_name", "name", "title", "brand")
+CARRIER_KEYS = ("airline_code", "marketing_airline", "carrier", "airline")
+FLIGHT_NUMBER_KEYS = ("flight_number", "number", "flight_no")
+DEPARTURE_KEYS = ("departure_time", "departure_datetime", "departure", "dep_time")
+MILES_KEYS = ("miles", "amount_miles")
+TAXES_KEYS = ("taxes", "tax", "fees", "fee")
+SEATS_KEYS = ("seats", "seats_available", "available_seats", "avail")
+
+
+def is_search_request(request):
+    """Проверяет, что запрос - это XHR поиска"""
+    try:
+        return request.resource_type in ("xhr", "fetch") and bool(SEARCH_API_RE.search(request.url))
+    except Exception:
+        return False
+
+
+def is_search_response(response):
+    """Проверяет, что ответ - это успешный XHR поиска"""
+    try:
+        return response.status == 200 and is_search_request(response.request)
+    except Exception:
+        return False
+
+
+def _first(data, keys):
+    if not isinstance(data, dict):
+        return None
+    for key in keys:
+        if data.get(key) not in (None, "", []):
+            return data[key]
+    return None
+
+
+def _to_int(value):
+    """Приводит число/строку/объект вида {"amount": ...} к int"""
+    if isinstance(value, dict):
+        value = _first(value, ("amount", "value", "total"))
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    digits = re.sub(r'\D', '', str(value))
+    return int(digits) if digits else None
+
+
+def _find_list(data, keys, depth=0):
+    """Ищет в JSON первый непустой список словарей под одним из ключей"""
+    if depth > 6:
+        return None
+    if isinstance(data, dict):
+        for key in keys:
+            value = data.get(key)
+            flat = _flatten(value)
+            if flat:
+                return flat
+        for value in data.values():
+            found = _find_list(value, keys, depth + 1)
+            if found:
+                return found
+    elif isinstance(data, list):
+        for item in data:
+            found = _find_list(item, keys, depth + 1)
+            if found:
+                return found
+    return None
+
+
+def _flatten(value):
+    """Разворачивает список (или список списков по маршрутам) в список словарей"""
+    if not isinstance(value, list):
+        return None
+    result = []
+    for item in value:
+        if isinstance(item, dict):
+            result.append(item)
+        elif isinstance(item, list):
+            result.extend(x for x in item if isinstance(x, dict))
+    return result or None
+
+
+def _pick_standard_tariff(tariffs):
+    """Тариф 'Стандарт' по названию. Угадывать по позиции нельзя: лучше фолбэк на модалки, чем чужая цена"""
+    for tariff in tariffs:
+        name = str(_first(tariff, TARIFF_NAME_KEYS) or "")
+        if "стандарт" in name.lower() or "standard" in name.lower():
+            return tariff
+    return None
+
+
+def _parse_itinerary(itinerary):
+    segments = _flatten(_first(itinerary, SEGMENT_KEYS)) or []
+    if not segments:
+        return None
+
+    flight_numbers = []
+    for segment in segments:
+        carrier = _first(segment, CARRIER_KEYS)
+        number = _first(segment, FLIGHT_NUMBER_KEYS)
+        if isinstance(carrier, dict):
+            carrier = _first(carrier, ("code", "iata"))
+        if carrier and number:
+            flight_number = f"{carrier} {number}"
+            if flight_number not in flight_numbers:
+                flight_numbers.append(flight_number)
+
+    time_match = re.search(r'(\d{2}:\d{2})', str(_first(segments[0], DEPARTURE_KEYS) or ""))
+
+    tariffs = _flatten(_first(itinerary, TARIFF_KEYS)) or []
+    tariff = _pick_standard_tariff(tariffs)
+    if tariff is None:
+        raise ValueError(f"no Standard tariff among {len(tariffs)} tariffs")
+    miles = _to_int(_first(tariff, MILES_KEYS))
+    if not flight_numbers or miles is None:
+        raise ValueError("flight number or miles not found")
+
+    taxes = _to_int(_first(tariff, TAXES_KEYS)) or 0
+    seats = _to_int(_first(tariff, SEATS_KEYS))
+    if seats is None:
+        seats = _to_int(_first(itinerary, SEATS_KEYS))
+
+    flight_info = {
+        "time": time_match.group(1) if time_match else "??",
+        "flight_number": ", ".join(flight_numbers),
+        "seats": str(seats) if seats is not None else "Не указано",
+        "miles": miles,
+        "taxes": taxes
+    }
+    return flight_info, len(segments) > 1
+
+
+def parse_search_payload(payload):
+    """
+    Преобразует JSON ответа поиска в структуру {"direct": [...], "transfers": [...]},
+    совпадающую с результатом парсинга модалок.
+    Возвращает None, если разобрать ответ не удалось - тогда нужен DOM-фолбэк.
+    """
+    itineraries = _find_list(payload, ITINERARY_KEYS)
+    if not itineraries:
+        return None
+
+    flights_data = {
+        "direct": [],
+        "transfers": []
+    }
+    for itinerary in itineraries:
+        try:
+            parsed = _parse_itinerary(itinerary)
+        except Exception as e:
+            # Один неразобранный вариант - и выдача из API неполная или с неверными ценами
+            logger.info(f"Could not decode itinerary, using modals instead: {e}")
+            return None
+        if parsed is None:
+            continue
+        flight_info, is_transfer = parsed
+        if is_transfer:
+            flights_data["transfers"].append(flight_info)
+        else:
+            flights_data["direct"].append(flight_info)
+
+    if not flights_data["direct"] and not flights_data["transfers"]:
+        return None
+    return flights_data
+
+
+class SearchResponseCapture:
+    """Собирает ответы поискового API со страницы через page.on("response")"""
+
+    def __init__(self, page):
+        self.responses = []
+        page.on("response", self._on_response)
+
+    def _on_response(self, response):
+        if is_search_response(response):
+            logger.info(f"Captured search API response: {response.url}")
+            self.responses.append(response)
+
+    async def get_flights(self):
+        """Декодирует последний из пойманных ответов, который удалось разобрать"""
+        for response in reversed(self.responses):
+            try:
+                payload = await response.json()
+            except Exception as e:
+                logger.debug(f"Search API response is not JSON: {e}")
+                continue
+            flights_data = parse_search_payload(payload)
+            if flights_data is not None:
+                return flights_data
+        return None
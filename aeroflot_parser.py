@@ -1,15 +1,55 @@
 import asyncio
-from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
-from datetime import datetime
+from collections import deque
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from datetime import datetime, timedelta
 import logging
 import config
-import os
+from browser_pool import browser_pool
+from standby_pages import standby_pages
+import page_waits
+import storage_state
+from aeroflot_api import SearchResponseCapture
+from search_cache import search_cache
+from timings import timings
+from metrics import metrics, result_outcome
 import re
+import time
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Тексты всех карточек рейсов за один вызов
+CARDS_JS = "(cards) => cards.map(card => card.innerText)"
+
+# Клик по кнопке "ВЫБРАТЬ РЕЙС" карточки с заданным индексом
+OPEN_CARD_JS = """(index) => {
+    const card = document.querySelectorAll('.flight-search')[index];
+    const button = card && card.querySelector('button.button--outline');
+    if (!button) return false;
+    button.click();
+    return true;
+}"""
+
+# Текст модалки, заголовки тарифов и ячейки цен за один вызов
+MODAL_JS = """() => {
+    const modal = document.querySelector('.modal__frame');
+    if (!modal) return null;
+    const texts = (selector) => Array.from(modal.querySelectorAll(selector), el => el.innerText);
+    return {
+        text: modal.innerText,
+        headers: texts('.tariff__table-head .tariff__item-title, .tariff__table-head .text-bold'),
+        prices: texts('.tariff__table-cell.tariff__table-price')
+    };
+}"""
+
+CLOSE_MODAL_JS = """() => {
+    const button = document.querySelector('.modal__close');
+    if (!button) return false;
+    button.click();
+    return true;
+}"""
+
 class AeroflotParser:
     def __init__(self):
         self.base_url = "https://www.aeroflot.ru/sb/app/ru-ru#/search"
@@ -24,340 +64,730 @@ class AeroflotParser:
             return None
 
     async def _close_popups(self, page):
-        """Закрывает назойливые модальные окна и куки"""
-        logger.info("Attempting to close popups...")
-        selectors_to_click = [
-            ".notification--choice-country .button", 
-            "button:has-text('Да')",
-            ".cookie-block .button", 
-            "button:has-text('Понятно')",
-            "button:has-text('Принять')",
-            ".modal__close",
-            ".notification__close"
-        ]
-        
-        for selector in selectors_to_click:
+        """Закрывает назойливые модальные окна и куки, если они все же появились"""
+        with timings.span("popups"):
+            closed = await storage_state.close_popups(page)
+        if closed:
+            logger.info(f"Closed {closed} popups")
+
+    @staticmethod
+    def _clean_int(s):
+        return int(re.sub(r'\D', '', s))
+
+    @staticmethod
+    def _parse_card_text(text_content):
+        """Время вылета, номера рейсов и признак пересадки из текста карточки"""
+        # Время вылета (HH:MM)
+        time_match = re.search(r'(\d{2}:\d{2})', text_content)
+        departure_time = time_match.group(1) if time_match else "??"
+
+        # Номера рейсов
+        flight_numbers = re.findall(r'SU\s*\d{4}', text_content)
+        # Сохраняем порядок и уникальность
+        seen = set()
+        flight_numbers_clean = [x for x in flight_numbers if not (x in seen or seen.add(x))]
+
+        # Тип рейса
+        is_transfer = "Пересадка" in text_content or len(flight_numbers_clean) > 1
+        return departure_time, flight_numbers_clean, is_transfer
+
+    @staticmethod
+    def _parse_card_seats(text_content):
+        """Количество мест из текста карточки (или None)"""
+        seats_match = re.search(r'(?:Доступно|Свободных)\s+мест.*?:?\s*(\d+)', text_content, re.IGNORECASE)
+        return seats_match.group(1) if seats_match else None
+
+    @classmethod
+    def _parse_modal_data(cls, modal_data):
+        """
+        Разбирает данные модалки, собранные MODAL_JS.
+        Возвращает (miles, taxes, seats), seats = None если мест в модалке нет.
+        """
+        miles = 0
+        taxes = 0
+        seats = None
+
+        # Нормализуем текст модалки сразу для удобства
+        modal_text_norm = modal_data["text"].replace('\xa0', ' ')
+        price_cells = modal_data["prices"]
+        header_cells = modal_data["headers"]
+
+        found_price = False
+
+        if price_cells:
+            # Пытаемся определить индекс колонки "Стандарт"
+            std_index = -1
+            for i, h_text in enumerate(header_cells):
+                if "Стандарт" in h_text or "Standard" in h_text:
+                    std_index = i
+                    break
+
+            # Эвристика по количеству ячеек
+            if std_index == -1:
+                if len(price_cells) >= 3:
+                    std_index = 1
+                elif len(price_cells) == 1:
+                    std_index = 0
+
+            if std_index != -1 and std_index < len(price_cells):
+                # Нормализация текста: заменяем все виды пробелов (в т.ч. узкие)
+                cell_text_norm = re.sub(r'[\s\xa0\u202F]+', ' ', price_cells[std_index])
+
+                # Парсим цену: "от 60 000 ¥ и 11 369 a"
+                p_match = re.search(r'(\d[\d\s]*).*?и\s+(\d[\d\s]*)', cell_text_norm)
+                if p_match:
+                    try:
+                        miles = cls._clean_int(p_match.group(1))
+                        taxes = cls._clean_int(p_match.group(2))
+                        found_price = True
+                    except ValueError:
+                        logger.error(f"Failed to convert to int: {p_match.groups()}")
+
+        # Фолбэк по всему тексту
+        if not found_price:
+            # Ищем все пары (число... и число)
+            all_prices = re.findall(r'от\s+(\d[\d\s]+).*?и\s+(\d[\d\s]+)', modal_text_norm)
+            headers_text = re.findall(r'(Смарт|Лайт|Базовый|Стандарт|Гибкий|Максимум)', modal_text_norm)
+
+            if "Стандарт" in headers_text:
+                try:
+                    std_idx_txt = headers_text.index("Стандарт")
+                    if std_idx_txt < len(all_prices):
+                        miles = cls._clean_int(all_prices[std_idx_txt][0])
+                        taxes = cls._clean_int(all_prices[std_idx_txt][1])
+                        found_price = True
+                except ValueError:
+                    pass
+
+            if not found_price and all_prices:
+                idx = 1 if len(all_prices) >= 3 else 0
+                miles = cls._clean_int(all_prices[idx][0])
+                taxes = cls._clean_int(all_prices[idx][1])
+
+        # Парсинг мест
+        seats_match_modal = re.search(r'(?:Доступно|Свободных)\s+мест.*?:?\s*(\d+)', modal_text_norm, re.IGNORECASE)
+        if seats_match_modal:
+            seats = seats_match_modal.group(1)
+
+        return miles, taxes, seats
+
+    async def _read_card_modal(self, page, index):
+        """Открывает модалку карточки, забирает ее данные одним вызовом и закрывает"""
+        # Нажимаем кнопку "ВЫБРАТЬ РЕЙС"
+        try:
+            if await page.evaluate(OPEN_CARD_JS, index):
+                # Ждем модалку с уже подгруженной таблицей тарифов
+                await page_waits.wait_for_modal(page)
+        except Exception as e:
+            logger.warning(f"Flight {index}: Could not click expand button: {e}")
+
+        try:
+            modal_data = await page.evaluate(MODAL_JS)
+        except Exception as e:
+            logger.error(f"Error reading modal: {e}")
+            modal_data = None
+
+        if modal_data is not None:
             try:
-                elements = await page.query_selector_all(selector)
-                for el in elements:
-                    if await el.is_visible():
-                        logger.info(f"Closing popup: {selector}")
-                        await el.click(timeout=1000)
-                        await page.wait_for_timeout(500)
-            except Exception:
-                pass 
+                # Закрываем модальное окно
+                if not await page.evaluate(CLOSE_MODAL_JS):
+                    await page.keyboard.press("Escape")
+                await page_waits.wait_for_modal_closed(page)
+            except Exception as e:
+                logger.error(f"Error closing modal: {e}")
+                await page.keyboard.press("Escape")
 
-    async def get_tickets(self, origin_code, destination_code, date_str, direct_only=False):
+        return modal_data
+
+    async def _parse_card(self, page, index, text_content):
+        """
+        Разбирает одну карточку (с модалкой тарифов).
+        Возвращает ("direct"/"transfers", рейс) или None, если билетов на рейс нет.
+        """
+        if "Билетов класса Бизнес нет в наличии" in text_content:
+            return None
+
+        departure_time, flight_numbers_clean, is_transfer = self._parse_card_text(text_content)
+
+        seats = "Не указано"
+        miles = 0
+        taxes = 0
+
+        # Попытка раскрыть рейс для получения мест и цен
+        with timings.span("parse_flight"):
+            modal_data = await self._read_card_modal(page, index)
+        if modal_data is not None:
+            try:
+                miles, taxes, modal_seats = self._parse_modal_data(modal_data)
+                if modal_seats:
+                    seats = modal_seats
+            except Exception as e:
+                logger.error(f"Error parsing modal: {e}")
+
+        # Места (если не нашли в модалке, пробуем из карточки)
+        if seats == "Не указано":
+            seats = self._parse_card_seats(text_content) or seats
+
+        flight_info = {
+            "time": departure_time,
+            "flight_number": ", ".join(flight_numbers_clean),
+            "seats": seats,
+            "miles": miles,
+            "taxes": taxes
+        }
+        return ("transfers" if is_transfer else "direct"), flight_info
+
+    async def _iter_flights_from_dom(self, page, card_texts):
+        """Выдает ("direct"/"transfers", рейс) по мере разбора карточек"""
+        for index, text_content in enumerate(card_texts):
+            try:
+                parsed = await self._parse_card(page, index, text_content)
+            except Exception as e:
+                logger.error(f"Error parsing flight {index}: {e}")
+                continue
+            if parsed is not None:
+                yield parsed
+
+    async def _open_helper_page(self, context, url, direct_only, card_texts):
+        """
+        Дополнительная страница той же выдачи в том же контексте.
+        Используется, только если показывает те же карточки в том же порядке.
+        """
+        page = await context.new_page()
+        try:
+            with timings.span("helper_page_open"):
+                await self._open_search(page, url)
+                if direct_only:
+                    await self._apply_direct_filter(page)
+                helper_texts = await page.eval_on_selector_all(".flight-search", CARDS_JS)
+            if helper_texts == card_texts:
+                return page
+            logger.warning(f"Helper page shows {len(helper_texts)} cards instead of {len(card_texts)}, not using it")
+        except Exception as e:
+            logger.warning(f"Helper page failed to open: {e}")
+        await page.close()
+        return None
+
+    async def _iter_flights_parallel(self, page, url, card_texts, direct_only, pages):
+        """
+        Как _iter_flights_from_dom, но модалки открываются на pages страницах сразу.
+        Страницы берут следующий индекс карточки из общей очереди (основная начинает сразу,
+        дополнительные - как только загрузят ту же выдачу), а рейсы выдаются в исходном порядке.
+        """
+        loop = asyncio.get_running_loop()
+        results = [loop.create_future() for _ in card_texts]
+        pending = deque(range(len(card_texts)))
+        helpers = []
+
+        async def work(worker_page, is_helper):
+            while pending:
+                index = pending.popleft()
+                if is_helper and worker_page.is_closed():
+                    pending.appendleft(index)
+                    return
+                try:
+                    parsed = await self._parse_card(worker_page, index, card_texts[index])
+                except Exception as e:
+                    if is_helper:
+                        # Отдаем карточку другим страницам, эту больше не используем
+                        logger.warning(f"Helper page failed on flight {index}: {e}")
+                        pending.appendleft(index)
+                        return
+                    logger.error(f"Error parsing flight {index}: {e}")
+                    parsed = None
+                results[index].set_result(parsed)
+
+        async def helper_work():
+            helper = await self._open_helper_page(page.context, url, direct_only, card_texts)
+            if helper is not None:
+                helpers.append(helper)
+                await work(helper, is_helper=True)
+
+        workers = [asyncio.create_task(work(page, is_helper=False))]
+        workers.extend(asyncio.create_task(helper_work()) for _ in range(pages - 1))
+        try:
+            for future in results:
+                while not future.done():
+                    running = [worker for worker in workers if not worker.done()]
+                    if not running:
+                        # Все страницы закончили, а карточки упавшей дополнительной страницы остались
+                        await work(page, is_helper=False)
+                        if not future.done():
+                            future.set_result(None)
+                        break
+                    await asyncio.wait([future, *running], return_when=asyncio.FIRST_COMPLETED)
+                parsed = future.result()
+                if parsed is not None:
+                    yield parsed
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            for helper in helpers:
+                try:
+                    await helper.close()
+                except Exception:
+                    pass
+
+    @staticmethod
+    def _cheapest(flights):
+        """(мили, места) самого дешевого рейса с известной ценой"""
+        priced = [f for f in flights if f.get("miles")]
+        if not priced:
+            return None, None
+        best = min(priced, key=lambda f: f["miles"])
+        return best["miles"], best["seats"]
+
+    @classmethod
+    def summarize_day(cls, date_str, result):
+        """Краткая сводка по дню для матрицы гибких дат"""
+        flights = result.get("flights", {}) if result.get("status") == "success" else {}
+        direct_miles, direct_seats = cls._cheapest(flights.get("direct", []))
+        transfer_miles, transfer_seats = cls._cheapest(flights.get("transfers", []))
+        return {
+            "date": date_str,
+            "status": result.get("status", "error"),
+            "direct_miles": direct_miles,
+            "direct_seats": direct_seats,
+            "transfer_miles": transfer_miles,
+            "transfer_seats": transfer_seats,
+        }
+
+    async def get_tickets_batch(self, routes, direct_only=False):
+        """
+        Параллельный поиск по списку (откуда, куда, дата) в отдельных контекстах
+        общего браузера, не больше SEARCH_CONCURRENCY одновременно.
+        Дубликаты ищутся один раз. Возвращает {(откуда, куда, дата): результат get_tickets}.
+        """
+        return await self._run_batch(
+            routes,
+            lambda origin_code, destination_code, date_str: self.get_tickets(
+                origin_code, destination_code, date_str, direct_only=direct_only
+            )
+        )
+
+    async def get_flights_batch(self, lookups):
+        """Параллельный get_flight по списку (откуда, куда, дата, номер рейса)"""
+        return await self._run_batch(lookups, self.get_flight)
+
+    async def _run_batch(self, keys, search):
+        unique_keys = list(dict.fromkeys(keys))
+        semaphore = asyncio.Semaphore(config.SEARCH_CONCURRENCY)
+
+        async def run(key):
+            async with semaphore:
+                try:
+                    return await search(*key)
+                except Exception as e:
+                    logger.error(f"Search failed for {key}: {e}")
+                    return {"error": str(e)}
+
+        results = await asyncio.gather(*(run(key) for key in unique_keys))
+        return dict(zip(unique_keys, results))
+
+    async def get_tickets_range(self, origin_code, destination_code, date_str, days=None, direct_only=False):
+        """Поиск по окну дат ±days вокруг date_str, дни ищутся параллельно"""
+        days = config.FLEX_SEARCH_DAYS if days is None else days
+        try:
+            center = datetime.strptime(date_str, "%d.%m.%Y")
+        except ValueError:
+            return {"error": "Неверный формат даты"}
+
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        dates = [center + timedelta(days=delta) for delta in range(-days, days + 1)]
+        dates = [d.strftime("%d.%m.%Y") for d in dates if d >= today]
+
+        logger.info(f"Flexible search {origin_code}-{destination_code} over {len(dates)} days")
+        results = await self.get_tickets_batch(
+            [(origin_code, destination_code, day_str) for day_str in dates],
+            direct_only=direct_only
+        )
+        return {
+            "status": "success",
+            "days": [self.summarize_day(route[2], result) for route, result in results.items()]
+        }
+
+    @staticmethod
+    def _normalize_flight_number(flight_number):
+        return re.sub(r'\s', '', flight_number).upper()
+
+    @classmethod
+    def _find_direct_flight(cls, flights, flight_number):
+        """Ищет прямой рейс с данным номером в уже разобранной выдаче"""
+        target = cls._normalize_flight_number(flight_number)
+        for flight in flights.get("direct", []):
+            numbers = [cls._normalize_flight_number(n) for n in flight["flight_number"].split(",")]
+            if numbers == [target]:
+                return flight
+        return None
+
+    async def get_flight(self, origin_code, destination_code, date_str, flight_number):
+        """
+        Цена и места конкретного прямого рейса (например SU1459).
+        Не применяет фильтры и не открывает модалки остальных рейсов.
+        Возвращает {"status": "success", "flight": {...}} или {"status": "not_found"}.
+        """
+        # Если выдача по маршруту уже в кэше - берем рейс оттуда
+        for direct_only in (True, False):
+            cached = await search_cache.get(search_cache.make_key(origin_code, destination_code, date_str, direct_only))
+            if cached and cached.get("status") in ("success", "no_tickets"):
+                flight = self._find_direct_flight(cached.get("flights", {}), flight_number)
+                return {"status": "success", "flight": flight} if flight else {"status": "not_found"}
+
+        key = search_cache.make_key(origin_code, destination_code, date_str, True) + f"|{self._normalize_flight_number(flight_number)}"
+        return await search_cache.get_or_run(
+            key,
+            lambda: self._fetch_flight(origin_code, destination_code, date_str, flight_number)
+        )
+
+    async def _fetch_flight(self, origin_code, destination_code, date_str, flight_number):
         formatted_date = self.convert_date(date_str)
         if not formatted_date:
             return {"error": "Неверный формат даты"}
 
-        url = (
+        url = self._build_search_url(origin_code, destination_code, formatted_date)
+        target = self._normalize_flight_number(flight_number)
+        logger.info(f"Looking up flight {target}: {url}")
+
+        async with standby_pages.page() as (page, warm):
+            api_capture = SearchResponseCapture(page) if config.CAPTURE_SEARCH_API else None
+
+            try:
+                cards_count = await self._open_search(page, url, warm=warm)
+
+                # Сначала пробуем найти рейс в JSON поискового API
+                if api_capture is not None:
+                    with timings.span("api_decode"):
+                        flights_data = await api_capture.get_flights()
+                    if flights_data is not None:
+                        flight = self._find_direct_flight(flights_data, flight_number)
+                        if flight:
+                            return {"status": "success", "flight": flight}
+
+                # Иначе открываем модалку только у нужной карточки
+                card_texts = await page.eval_on_selector_all(".flight-search", CARDS_JS)
+                for index, text_content in enumerate(card_texts):
+                    if "Билетов класса Бизнес нет в наличии" in text_content:
+                        continue
+                    departure_time, flight_numbers, _ = self._parse_card_text(text_content)
+                    if [self._normalize_flight_number(n) for n in flight_numbers] != [target]:
+                        continue
+
+                    seats = "Не указано"
+                    miles = 0
+                    taxes = 0
+                    with timings.span("parse_flight"):
+                        modal_data = await self._read_card_modal(page, index)
+                    if modal_data is not None:
+                        miles, taxes, modal_seats = self._parse_modal_data(modal_data)
+                        if modal_seats:
+                            seats = modal_seats
+                    if seats == "Не указано":
+                        seats = self._parse_card_seats(text_content) or seats
+
+                    return {
+                        "status": "success",
+                        "flight": {
+                            "time": departure_time,
+                            "flight_number": flight_numbers[0],
+                            "seats": seats,
+                            "miles": miles,
+                            "taxes": taxes
+                        }
+                    }
+
+                # "Не найден" (кэшируется) - только по загруженной выдаче, иначе это таймаут
+                if not card_texts and cards_count is None and not await page_waits.has_no_tickets(page):
+                    return {"error": "Выдача не загрузилась, попробуйте позже"}
+                return {"status": "not_found"}
+
+            except Exception as e:
+                logger.error(f"Global error in get_flight: {e}")
+                browser_pool.report_error(page.context, e)
+                return {"error": str(e)}
+
+    async def get_tickets(self, origin_code, destination_code, date_str, direct_only=False):
+        """Поиск билетов через общий кэш результатов (одинаковые запросы не запускают браузер повторно)"""
+        key = search_cache.make_key(origin_code, destination_code, date_str, direct_only)
+        result = await search_cache.get_or_run(
+            key,
+            lambda: self._fetch_tickets(origin_code, destination_code, date_str, direct_only=direct_only)
+        )
+        metrics.inc("aeroflot_searches_total", outcome=result_outcome(result))
+        return result
+
+    @staticmethod
+    def _screenshot_options():
+        options = {"type": config.SCREENSHOT_FORMAT}
+        if config.SCREENSHOT_FORMAT == "jpeg":
+            options["quality"] = config.SCREENSHOT_QUALITY
+        return options
+
+    async def _take_screenshot(self, page):
+        """Скриншот панели результатов в памяти (bytes), без записи на диск"""
+        options = self._screenshot_options()
+        try:
+            frame_element = await page.query_selector(".frame.flight-searchs")
+            if frame_element:
+                screenshot = await frame_element.screenshot(**options)
+                logger.info("Screenshot of .frame.flight-searchs taken")
+                return screenshot
+
+            panel_info = await page.query_selector(".flight-search__panel-info")
+            if panel_info:
+                return await panel_info.screenshot(**options)
+
+            logger.info("Full page screenshot taken (frame not found)")
+            return await page.screenshot(**options)
+        except Exception as e:
+            logger.error(f"Error taking screenshot: {e}")
+            return await page.screenshot(**options)
+
+    def _build_search_url(self, origin_code, destination_code, formatted_date):
+        return (
             f"{self.base_url}?"
             f"adults=1&award=Y&cabin=business&children=0&childrenaward=0&childrenfrgn=0&infants=0&"
             f"routes={origin_code}.{formatted_date}.{destination_code}"
         )
-        
-        logger.info(f"Opening URL: {url}")
 
-        proxy_settings = None
-        if config.PROXY_URL and (config.PROXY_URL.startswith("http") or config.PROXY_URL.startswith("socks")):
-            proxy_settings = {"server": config.PROXY_URL}
+    async def _open_search(self, page, url, warm=False):
+        """
+        Открывает страницу поиска, запускает поиск и ждет выдачу.
+        Возвращает количество карточек или None, если выдача не загрузилась за таймаут
+        """
+        # Ответ XHR поиска - сигнал готовности выдачи (в том числе пустой)
+        search_requests = page_waits.SearchRequestWatcher(page)
+        try:
+            return await self._run_search(page, url, warm, search_requests)
+        finally:
+            search_requests.close()
 
-        async with async_playwright() as p:
-            if proxy_settings:
-                browser = await p.chromium.launch(headless=config.HEADLESS, proxy=proxy_settings)
-            else:
-                browser = await p.chromium.launch(headless=config.HEADLESS)
-            
-            context = await browser.new_context(
-                viewport={'width': 1920, 'height': 1080},
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            )
-            
-            page = await context.new_page()
+    async def _run_search(self, page, url, warm, search_requests):
+        if warm:
+            # SPA уже загружено и попапы закрыты - достаточно сменить hash-маршрут
+            logger.info("Switching warm page to search route")
+            with timings.span("route_change"):
+                await page.evaluate("(url) => { window.location.href = url; }", url)
+        else:
+            started = time.monotonic()
+            with timings.span("navigation"):
+                response = await page.goto(url, wait_until="networkidle", timeout=60000)
+            browser_pool.report_navigation(page.context, time.monotonic() - started, response)
 
-            try:
-                await page.goto(url, wait_until="networkidle", timeout=60000)
-                
-                await self._close_popups(page)
+            await self._close_popups(page)
 
-                try:
-                    search_button = await page.wait_for_selector("a.button--wide.button--lg:has-text('Найти'), button:has-text('Найти')", timeout=5000)
-                    if search_button:
-                        logger.info("Clicking 'Find' button")
-                        await search_button.click(force=True)
-                        await page.wait_for_timeout(2000)
-                except Exception as e:
-                    logger.warning(f"Search button not found or click failed: {e}")
+        try:
+            search_button = await page.wait_for_selector("a.button--wide.button--lg:has-text('Найти'), button:has-text('Найти')", timeout=5000)
+            if search_button:
+                logger.info("Clicking 'Find' button")
+                await search_button.click(force=True)
+        except Exception as e:
+            logger.warning(f"Search button not found or click failed: {e}")
 
-                logger.info("Waiting 2 seconds for results to load...")
-                await page.wait_for_timeout(2000)
-                
-                await self._close_popups(page)
+        logger.info("Waiting for results to load...")
+        with timings.span("results_wait"):
+            cards_count = await page_waits.wait_for_results(page, search=search_requests)
+        if cards_count is None:
+            logger.warning("Results did not load before timeout")
+        else:
+            logger.info(f"Results ready: {cards_count} cards")
+        
+        await self._close_popups(page)
+        return cards_count
 
-                if direct_only:
-                    logger.info("Filtering direct flights only...")
-                    try:
-                        # Логика: найти блок фильтров "Количество пересадок"
-                        # Внутри него найти все чекбоксы.
-                        # Оставить включенным только "Прямой рейс".
-                        # Остальные (1, 2, 3...) выключить.
-                        
-                        # Находим лейбл "Прямой рейс"
-                        direct_label = await page.query_selector("label:has-text('Прямой рейс')")
+    async def _apply_direct_filter(self, page):
+        """Оставляет в выдаче только прямые рейсы (снимает фильтры 1, 2, 3... пересадки)"""
+        logger.info("Filtering direct flights only...")
+        try:
+            # Логика: найти блок фильтров "Количество пересадок"
+            # Внутри него найти все чекбоксы.
+            # Оставить включенным только "Прямой рейс".
+            # Остальные (1, 2, 3...) выключить.
+            
+            # Находим лейбл "Прямой рейс"
+            direct_label = await page.query_selector("label:has-text('Прямой рейс')")
+            
+            if direct_label:
+                logger.info("Found 'Direct flight' label. Searching for filter container...")
+                
+                # Ищем родительский контейнер с role='region' или классом wrapper
+                # Используем evaluate_handle для навигации по DOM вверх
+                container = await direct_label.evaluate_handle("""(element) => {
+                    return element.closest("div[role='region']") || element.closest(".wrapper") || element.closest(".accordion__content");
+                }""")
+                
+                if container:
+                    container_element = container.as_element()
+                    if container_element:
+                        # Ищем внутри контейнера label
+                        digit_labels = await container_element.query_selector_all("label")
                         
-                        if direct_label:
-                            logger.info("Found 'Direct flight' label. Searching for filter container...")
+                        found_filters = False
+                        for label in digit_labels:
+                            text = await label.inner_text()
+                            text = text.strip()
                             
-                            # Ищем родительский контейнер с role='region' или классом wrapper
-                            # Используем evaluate_handle для навигации по DOM вверх
-                            container = await direct_label.evaluate_handle("""(element) => {
-                                return element.closest("div[role='region']") || element.closest(".wrapper") || element.closest(".accordion__content");
-                            }""")
-                            
-                            if container:
-                                container_element = container.as_element()
-                                if container_element:
-                                    # Ищем внутри контейнера label
-                                    digit_labels = await container_element.query_selector_all("label")
-                                    
-                                    found_filters = False
-                                    for label in digit_labels:
-                                        text = await label.inner_text()
-                                        text = text.strip()
-                                        
-                                        if text in ['1', '2', '3', '4']:
-                                            logger.info(f"Clicking transfer filter: {text}")
-                                            await label.click()
-                                            found_filters = True
-                                            await page.wait_for_timeout(500)
-                                    
-                                    if found_filters:
-                                        logger.info("Filters clicked. Waiting for update...")
-                                        await page.wait_for_timeout(2000)
-                                    else:
-                                        logger.warning("No digit labels found in the container")
-                                else:
-                                    logger.warning("Container handle could not be converted to element")
-                            else:
-                                logger.warning("Could not find filter container (ancestor of direct label)")
-                                
+                            if text in ['1', '2', '3', '4']:
+                                logger.info(f"Clicking transfer filter: {text}")
+                                await label.click()
+                                found_filters = True
+                        
+                        if found_filters:
+                            logger.info("Filters clicked. Waiting for update...")
+                            # Фильтр работает на уже полученной выдаче: пустой список после него окончателен
+                            await page_waits.wait_for_stable_count(page, ".flight-search", settled=True)
                         else:
-                             logger.warning("Direct flight label not found")
-                             
-                    except Exception as e:
-                        logger.warning(f"Could not apply direct filter: {e}")
-
-                screenshot_path = "results_screenshot.png"
-                try:
-                    frame_element = await page.query_selector(".frame.flight-searchs")
-                    if frame_element:
-                        await frame_element.screenshot(path=screenshot_path)
-                        logger.info("Screenshot of .frame.flight-searchs saved")
+                            logger.warning("No digit labels found in the container")
                     else:
-                        panel_info = await page.query_selector(".flight-search__panel-info")
-                        if panel_info:
-                             await panel_info.screenshot(path=screenshot_path)
-                        else:
-                             await page.screenshot(path=screenshot_path)
-                             logger.info("Full page screenshot saved (frame not found)")
-                except Exception as e:
-                    logger.error(f"Error taking screenshot: {e}")
-                    await page.screenshot(path=screenshot_path)
+                        logger.warning("Container handle could not be converted to element")
+                else:
+                    logger.warning("Could not find filter container (ancestor of direct label)")
+                    
+            else:
+                 logger.warning("Direct flight label not found")
+                 
+        except Exception as e:
+            logger.warning(f"Could not apply direct filter: {e}")
 
-                # Парсинг данных
-                flights_data = {
-                    "direct": [],
-                    "transfers": []
-                }
+    async def _fetch_tickets(self, origin_code, destination_code, date_str, direct_only=False):
+        """Полный результат поиска: последнее событие потока _stream_tickets"""
+        result = {"error": "Поиск завершился без результата"}
+        async for event in self._stream_tickets(origin_code, destination_code, date_str, direct_only=direct_only):
+            if event["type"] == "result":
+                result = event["result"]
+        return result
+
+    @staticmethod
+    def _flight_events(flights_data):
+        for group in ("direct", "transfers"):
+            for flight_info in flights_data.get(group, []):
+                yield {"type": "flight", "group": group, "flight": flight_info}
+
+    @classmethod
+    def _result_events(cls, result):
+        """События потока для уже готового результата (например, из кэша)"""
+        if result.get("screenshot"):
+            yield {"type": "screenshot", "screenshot": result["screenshot"]}
+        yield from cls._flight_events(result.get("flights", {}))
+        yield {"type": "result", "result": result}
+
+    async def stream_tickets(self, origin_code, destination_code, date_str, direct_only=False):
+        """
+        Поиск билетов с выдачей по ходу работы. Асинхронный генератор событий:
+        {"type": "screenshot"} сразу после отрисовки выдачи, {"type": "flight"} на каждый
+        разобранный рейс и в конце {"type": "result"} с тем же результатом, что у get_tickets.
+        """
+        key = search_cache.make_key(origin_code, destination_code, date_str, direct_only)
+        # Одинаковые поиски объединяются, как в get_tickets: браузер запускает только первый
+        events = search_cache.stream_or_join(
+            key,
+            lambda: self._stream_tickets(origin_code, destination_code, date_str, direct_only=direct_only),
+            self._result_events,
+        )
+        async for event in events:
+            if event["type"] == "result":
+                metrics.inc("aeroflot_searches_total", outcome=result_outcome(event["result"]))
+            yield event
+
+    async def _stream_tickets(self, origin_code, destination_code, date_str, direct_only=False):
+        formatted_date = self.convert_date(date_str)
+        if not formatted_date:
+            yield {"type": "result", "result": {"error": "Неверный формат даты"}}
+            return
+
+        url = self._build_search_url(origin_code, destination_code, formatted_date)
+        
+        logger.info(f"Opening URL: {url}")
+
+        async with standby_pages.page() as (page, warm):
+            screenshot = None
+            # Слушаем XHR поиска с самого начала, чтобы не пропустить ответ
+            api_capture = SearchResponseCapture(page) if config.CAPTURE_SEARCH_API else None
+
+            try:
+                cards_count = await self._open_search(page, url, warm=warm)
+
+                if direct_only:
+                    with timings.span("direct_filter"):
+                        await self._apply_direct_filter(page)
+
+                with timings.span("screenshot"):
+                    screenshot = await self._take_screenshot(page)
+                yield {"type": "screenshot", "screenshot": screenshot}
 
-                flight_elements = await page.query_selector_all(".flight-search")
-                if not flight_elements:
+                # Быстрый путь: данные из JSON поискового API без открытия модалок
+                if api_capture is not None:
+                    with timings.span("api_decode"):
+                        flights_data = await api_capture.get_flights()
+                    if flights_data is not None:
+                        logger.info("Flights decoded from search API response")
+                        if direct_only:
+                            flights_data["transfers"] = []
+                        if flights_data["direct"] or flights_data["transfers"]:
+                            for event in self._flight_events(flights_data):
+                                yield event
+                            yield {"type": "result", "result": {
+                                "status": "success",
+                                "screenshot": screenshot,
+                                "flights": flights_data
+                            }}
+                            return
+                    else:
+                        logger.info("Search API response not decoded, falling back to modals")
+
+                card_texts = await page.eval_on_selector_all(".flight-search", CARDS_JS)
+                if not card_texts:
                      # Проверка на отсутствие билетов по тексту на странице
                      content = await page.content()
                      if "Билетов класса Бизнес нет в наличии" in content or "Рейсы не найдены" in content:
-                         await browser.close()
-                         return {
+                         yield {"type": "result", "result": {
                             "status": "no_tickets",
-                            "screenshot": screenshot_path
-                        }
+                            "screenshot": screenshot
+                        }}
+                         return
+                     # Пустая страница без ответа поиска - это таймаут, а не "нет билетов":
+                     # такой результат не кэшируется, следующий запрос поищет заново
+                     if cards_count is None:
+                         yield {"type": "result", "result": {
+                            "status": "timeout",
+                            "screenshot": screenshot,
+                            "error": "Выдача не загрузилась, попробуйте позже"
+                        }}
+                         return
                 
-                logger.info(f"Found {len(flight_elements)} flight elements")
-
-                for index, flight in enumerate(flight_elements):
-                    try:
-                        text_content = await flight.inner_text()
-                        if "Билетов класса Бизнес нет в наличии" in text_content:
-                            continue
-
-                        # Время вылета (HH:MM)
-                        time_match = re.search(r'(\d{2}:\d{2})', text_content)
-                        departure_time = time_match.group(1) if time_match else "??"
-
-                        # Номера рейсов
-                        flight_numbers = re.findall(r'SU\s*\d{4}', text_content)
-                        # Сохраняем порядок и уникальность
-                        seen = set()
-                        flight_numbers_clean = [x for x in flight_numbers if not (x in seen or seen.add(x))]
-                        flight_numbers_str = ", ".join(flight_numbers_clean)
-
-                        # Тип рейса
-                        is_transfer = "Пересадка" in text_content or len(flight_numbers_clean) > 1
-
-                        # Попытка раскрыть рейс для получения мест и цен
-                        # Нажимаем кнопку "ВЫБРАТЬ РЕЙС"
-                        try:
-                            # Ищем кнопку раскрытия
-                            expand_btn = await flight.query_selector("button.button--outline")
-                            if expand_btn:
-                                await expand_btn.click(force=True)
-                                await page.wait_for_timeout(1000) # Ждем анимацию открытия модалки
-                        except Exception as e:
-                            logger.warning(f"Flight {index}: Could not click expand button: {e}")
-
-                        # ТЕПЕРЬ РАБОТАЕМ С МОДАЛЬНЫМ ОКНОМ
-                        # Ищем открытое модальное окно .modal__frame
-                        modal = await page.query_selector(".modal__frame")
-                        
-                        # Инициализация переменных перед блоком try-except
-                        seats = "Не указано" 
-                        miles = 0
-                        taxes = 0
-
-                        if modal:
-                            try:
-                                # Ждем контент
-                                await page.wait_for_timeout(1000)
-                                modal_text = await modal.inner_text()
-                                # Нормализуем текст модалки сразу для удобства
-                                modal_text_norm = modal_text.replace('\xa0', ' ')
-                                
-                                # Попробуем найти конкретные элементы ячеек с ценами
-                                price_cells = await modal.query_selector_all(".tariff__table-cell.tariff__table-price")
-                                
-                                found_price = False
-                                
-                                if price_cells:
-                                    # Пытаемся определить индекс колонки "Стандарт"
-                                    header_cells = await modal.query_selector_all(".tariff__table-head .tariff__item-title, .tariff__table-head .text-bold")
-                                    
-                                    std_index = -1
-                                    if header_cells:
-                                        for i, h_cell in enumerate(header_cells):
-                                            h_text = await h_cell.inner_text()
-                                            if "Стандарт" in h_text or "Standard" in h_text:
-                                                std_index = i
-                                                break
-                                    
-                                    # Эвристика по количеству ячеек
-                                    if std_index == -1:
-                                        if len(price_cells) >= 3:
-                                            std_index = 1
-                                        elif len(price_cells) == 1:
-                                            std_index = 0
-                                    
-                                    if std_index != -1 and std_index < len(price_cells):
-                                        cell_text = await price_cells[std_index].inner_text()
-                                        # Нормализация текста: заменяем все виды пробелов (в т.ч. узкие)
-                                        cell_text_norm = re.sub(r'[\s\xa0\u202F]+', ' ', cell_text)
-                                        
-                                        # Парсим цену: "от 60 000 ¥ и 11 369 a"
-                                        p_match = re.search(r'(\d[\d\s]*).*?и\s+(\d[\d\s]*)', cell_text_norm)
-                                        if p_match:
-                                            def clean_int(s):
-                                                return int(re.sub(r'\D', '', s))
-                                            
-                                            try:
-                                                miles = clean_int(p_match.group(1))
-                                                taxes = clean_int(p_match.group(2))
-                                                found_price = True
-                                            except ValueError:
-                                                logger.error(f"Failed to convert to int: {p_match.groups()}")
-                                
-                                # Фолбэк по всему тексту
-                                if not found_price:
-                                    # Ищем все пары (число... и число)
-                                    all_prices = re.findall(r'от\s+(\d[\d\s]+).*?и\s+(\d[\d\s]+)', modal_text_norm)
-                                    headers_text = re.findall(r'(Смарт|Лайт|Базовый|Стандарт|Гибкий|Максимум)', modal_text_norm)
-                                    
-                                    if "Стандарт" in headers_text:
-                                        try:
-                                            std_idx_txt = headers_text.index("Стандарт")
-                                            if std_idx_txt < len(all_prices):
-                                                 def clean_int(s):
-                                                     return int(re.sub(r'\D', '', s))
-                                                 miles = clean_int(all_prices[std_idx_txt][0])
-                                                 taxes = clean_int(all_prices[std_idx_txt][1])
-                                                 found_price = True
-                                        except:
-                                            pass
-                                    
-                                    if not found_price and all_prices:
-                                        idx = 1 if len(all_prices) >= 3 else 0
-                                        def clean_int(s):
-                                            return int(re.sub(r'\D', '', s))
-                                        miles = clean_int(all_prices[idx][0])
-                                        taxes = clean_int(all_prices[idx][1])
-                                
-                                # Парсинг мест
-                                seats_match_modal = re.search(r'(?:Доступно|Свободных)\s+мест.*?:?\s*(\d+)', modal_text_norm, re.IGNORECASE)
-                                if seats_match_modal:
-                                     seats = seats_match_modal.group(1)
-                                
-                                # Закрываем модальное окно
-                                close_btn = await page.query_selector(".modal__close")
-                                if close_btn:
-                                    await close_btn.click()
-                                    await page.wait_for_timeout(500)
-                                else:
-                                    await page.keyboard.press("Escape")
-                                    await page.wait_for_timeout(500)
-                                    
-                            except Exception as e:
-                                logger.error(f"Error parsing modal: {e}")
-                                await page.keyboard.press("Escape")
-
-                        # Места (если не нашли в модалке, пробуем из карточки)
-                        if seats == "Не указано":
-                            seats_match = re.search(r'(?:Доступно|Свободных)\s+мест.*?:?\s*(\d+)', text_content, re.IGNORECASE)
-                            if seats_match:
-                                 seats = seats_match.group(1)
-                        
-                        flight_info = {
-                            "time": departure_time,
-                            "flight_number": flight_numbers_str,
-                            "seats": seats,
-                            "miles": miles,
-                            "taxes": taxes
-                        }
+                logger.info(f"Found {len(card_texts)} flight elements")
 
-                        if is_transfer:
-                            flights_data["transfers"].append(flight_info)
-                        else:
-                            flights_data["direct"].append(flight_info)
-
-                    except Exception as e:
-                        logger.error(f"Error parsing flight {index}: {e}")
+                flights_data = {
+                    "direct": [],
+                    "transfers": []
+                }
+                if config.MODAL_PAGES > 1 and len(card_texts) >= config.MODAL_PARALLEL_MIN_CARDS:
+                    logger.info(f"Reading modals on {config.MODAL_PAGES} pages")
+                    flights_iter = self._iter_flights_parallel(page, url, card_texts, direct_only, config.MODAL_PAGES)
+                else:
+                    flights_iter = self._iter_flights_from_dom(page, card_texts)
+                async for group, flight_info in flights_iter:
+                    flights_data[group].append(flight_info)
+                    yield {"type": "flight", "group": group, "flight": flight_info}
 
-                await browser.close()
-                
                 # Если после парсинга списки пусты, значит билетов нет (или отфильтрованы)
                 if not flights_data["direct"] and not flights_data["transfers"]:
-                    return {
+                    yield {"type": "result", "result": {
                         "status": "no_tickets",
-                        "screenshot": screenshot_path
-                    }
+                        "screenshot": screenshot
+                    }}
+                    return
 
-                return {
+                yield {"type": "result", "result": {
                     "status": "success",
-                    "screenshot": screenshot_path,
+                    "screenshot": screenshot,
                     "flights": flights_data
-                }
+                }}
 
             except Exception as e:
                 logger.error(f"Global error in get_tickets: {e}")
-                await browser.close()
-                if os.path.exists("results_screenshot.png"):
-                    return {"status": "timeout", "screenshot": "results_screenshot.png", "error": str(e)}
-                return {"error": str(e)}
+                browser_pool.report_error(page.context, e)
+                if screenshot:
+                    yield {"type": "result", "result": {"status": "timeout", "screenshot": screenshot, "error": str(e)}}
+                else:
+                    yield {"type": "result", "result": {"error": str(e)}}
@@ -1,9 +1,14 @@
 import asyncio
 import logging
 import re
+import time
 from datetime import datetime
-from playwright.async_api import async_playwright
 import config
+from browser_pool import browser_pool
+import storage_state
+from search_cache import upgrade_cache
+from timings import timings
+from metrics import metrics, result_outcome
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
@@ -13,24 +18,9 @@ class AeroflotUpgradeParser:
         self.url = "https://www.aeroflot.ru/sb/pnr/app/ru-ru#/search"
 
     async def _close_popups(self, page):
-        """Закрывает назойливые модальные окна (копия из основного парсера)"""
-        selectors_to_click = [
-            ".notification--choice-country .button", 
-            "button:has-text('Да')",
-            ".cookie-block .button", 
-            "button:has-text('Понятно')",
-            "button:has-text('Принять')",
-            ".modal__close",
-            ".notification__close"
-        ]
-        
-        for selector in selectors_to_click:
-            try:
-                if await page.locator(selector).is_visible():
-                    await page.locator(selector).click()
-                    await page.wait_for_timeout(500)
-            except Exception:
-                pass
+        """Закрывает назойливые модальные окна (общая логика с основным парсером)"""
+        with timings.span("popups"):
+            await storage_state.close_popups(page)
 
     def _check_fare_eligibility(self, fare_code: str, is_kaliningrad: bool) -> dict:
         """
@@ -115,28 +105,24 @@ class AeroflotUpgradeParser:
         return details
 
     async def check_upgrade(self, pnr_code: str, last_name: str) -> dict:
+        """Проверка бронирования через кэш (ключ - хэш PNR и фамилии)"""
+        key = upgrade_cache.make_pnr_key(pnr_code, last_name)
+        result = await upgrade_cache.get_or_run(key, lambda: self._check_upgrade(pnr_code, last_name))
+        metrics.inc("aeroflot_upgrade_checks_total", outcome=result_outcome(result))
+        return result
+
+    async def _check_upgrade(self, pnr_code: str, last_name: str) -> dict:
         logger.info(f"Checking upgrade for PNR: {pnr_code}, Last Name: {last_name}")
         
-        proxy_settings = None
-        if config.PROXY_URL and (config.PROXY_URL.startswith("http") or config.PROXY_URL.startswith("socks")):
-            proxy_settings = {"server": config.PROXY_URL}
-
-        async with async_playwright() as p:
-            if proxy_settings:
-                browser = await p.chromium.launch(headless=config.HEADLESS, proxy=proxy_settings)
-            else:
-                browser = await p.chromium.launch(headless=config.HEADLESS)
-            
-            context = await browser.new_context(
-                viewport={'width': 1920, 'height': 1080},
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            )
-            
+        async with browser_pool.context() as context:
             page = await context.new_page()
 
             try:
                 # 1. Переход на страницу
-                await page.goto(self.url, wait_until="networkidle", timeout=60000)
+                started = time.monotonic()
+                with timings.span("navigation"):
+                    response = await page.goto(self.url, wait_until="networkidle", timeout=60000)
+                browser_pool.report_navigation(context, time.monotonic() - started, response)
                 await self._close_popups(page)
 
                 # 2. Ввод данных
@@ -160,12 +146,12 @@ class AeroflotUpgradeParser:
                 # 3. Нажатие кнопки Найти
                 find_button = page.locator("button:has-text('Найти')")
                 
-                # Ждем пока кнопка станет активной (уберется класс disabled если есть)
-                # Иногда нужно кликнуть вне полей, чтобы сработала валидация
+                # Иногда нужно кликнуть вне полей, чтобы сработала валидация.
+                # click() сам дождется, пока кнопка станет активной (уберется disabled)
                 await page.click("body") 
-                await page.wait_for_timeout(500)
                 
-                await find_button.click()
+                with timings.span("pnr_submit"):
+                    await find_button.click(timeout=config.READY_TIMEOUT_MS)
 
                 # 4. Ожидание загрузки бронирования (Успех ИЛИ Ошибка)
                 try:
@@ -179,10 +165,11 @@ class AeroflotUpgradeParser:
                     # h1:has-text('не найдено') (ошибка)
                     
                     # Создаем общий локатор для ожидания
-                    await page.wait_for_selector(
-                        ".flight-booking__class_name, .alert--error, h1:has-text('не найдено'), .message-error", 
-                        timeout=20000
-                    )
+                    with timings.span("pnr_results"):
+                        await page.wait_for_selector(
+                            ".flight-booking__class_name, .alert--error, h1:has-text('не найдено'), .message-error", 
+                            timeout=20000
+                        )
                 except Exception:
                     # Если ничего не появилось, возможно долгая загрузка, делаем скриншот
                     await page.screenshot(path="upgrade_debug.png")
@@ -317,7 +304,5 @@ class AeroflotUpgradeParser:
 
             except Exception as e:
                 logger.error(f"Error in check_upgrade: {e}")
+                browser_pool.report_error(context, e)
                 return {"status": "error", "message": str(e)}
-                
-            finally:
-                await browser.close()
@@ -0,0 +1,203 @@
+"""
+Пакетный поиск билетов без Telegram.
+
+Читает CSV или JSONL со строками origin,destination,date,direct_only,
+выполняет поиски на общем браузере не больше --workers одновременно
+и пишет результаты в JSONL по мере готовности.
+
+Пример:
+    python batch_search.py routes.csv -o results.jsonl --workers 3
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import sys
+import time
+
+# Лог в stderr, чтобы stdout оставался чистым JSONL
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    stream=sys.stderr
+)
+
+import config
+import city_codes
+from aeroflot_parser import AeroflotParser
+from browser_pool import browser_pool
+from standby_pages import standby_pages
+from search_cache import close_caches
+
+logger = logging.getLogger(__name__)
+
+TRUE_VALUES = ("1", "true", "yes", "y", "да", "прямые")
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or "").strip().lower() in TRUE_VALUES
+
+
+def read_rows(path, fmt=None):
+    """Строки входного файла как словари (CSV с заголовком или JSONL)"""
+    fmt = fmt or ("jsonl" if path.endswith((".jsonl", ".json")) else "csv")
+    with open(path, encoding="utf-8") as f:
+        if fmt == "jsonl":
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def resolve_city(name):
+    """
+    (город, код) по точному названию или IATA-коду, иначе ValueError.
+    Нечеткие совпадения не подставляем молча: в ошибке перечисляем варианты
+    """
+    query = str(name or "").strip()
+    match = city_codes.exact_city(query)
+    if match is not None:
+        return match
+    suggestions = city_codes.find_city(query)
+    if not suggestions:
+        raise ValueError(f"Город не найден: {name}")
+    options = ", ".join(f"{city} ({code})" for city, code in suggestions)
+    raise ValueError(f"Город не найден точно: {name}. Возможно: {options}")
+
+
+def build_task(number, row):
+    """Задание поиска из строки файла. Ошибки разбора попадают в результат, а не прерывают запуск"""
+    task = {
+        "row": number,
+        "origin": row.get("origin"),
+        "destination": row.get("destination"),
+        "date": str(row.get("date") or "").strip(),
+        "direct_only": parse_bool(row.get("direct_only")),
+    }
+    try:
+        task["origin_name"], task["origin_code"] = resolve_city(task["origin"])
+        task["destination_name"], task["destination_code"] = resolve_city(task["destination"])
+        if not AeroflotParser.convert_date(task["date"]):
+            raise ValueError(f"Неверная дата: {task['date']} (нужно ДД.ММ.ГГГГ)")
+    except ValueError as e:
+        task["error"] = str(e)
+    return task
+
+
+def save_screenshot(task, screenshot, directory):
+    os.makedirs(directory, exist_ok=True)
+    filename = (
+        f"{task['row']:05d}_{task['origin_code']}_{task['destination_code']}_"
+        f"{task['date'].replace('.', '')}.{config.SCREENSHOT_FORMAT}"
+    )
+    path = os.path.join(directory, filename)
+    with open(path, "wb") as f:
+        f.write(screenshot)
+    return path
+
+
+async def run_task(parser, task, screenshots_dir=None):
+    if "error" in task:
+        return dict(task, status="invalid")
+
+    started = time.monotonic()
+    try:
+        result = await parser.get_tickets(
+            task["origin_code"], task["destination_code"], task["date"], direct_only=task["direct_only"]
+        )
+    except Exception as e:
+        logger.error(f"Row {task['row']} failed: {e}")
+        result = {"error": str(e)}
+
+    output = dict(task)
+    output["status"] = result.get("status", "error")
+    output["elapsed"] = round(time.monotonic() - started, 2)
+    if "flights" in result:
+        output["flights"] = result["flights"]
+    if "error" in result:
+        output["error"] = result["error"]
+
+    screenshot = result.get("screenshot")
+    if screenshot and screenshots_dir:
+        output["screenshot"] = save_screenshot(task, screenshot, screenshots_dir)
+    return output
+
+
+async def run_batch(rows, out, workers, screenshots_dir=None):
+    """Пул воркеров: входные строки читаются по мере освобождения воркеров, результаты пишутся сразу"""
+    parser = AeroflotParser()
+    queue = asyncio.Queue(maxsize=workers * 2)
+    counts = {"total": 0}
+
+    async def worker():
+        while True:
+            task = await queue.get()
+            try:
+                if task is None:
+                    return
+                output = await run_task(parser, task, screenshots_dir)
+                out.write(json.dumps(output, ensure_ascii=False) + "\n")
+                out.flush()
+                counts["total"] += 1
+                counts[output["status"]] = counts.get(output["status"], 0) + 1
+            finally:
+                queue.task_done()
+
+    async def produce():
+        for number, row in enumerate(rows, start=1):
+            await queue.put(build_task(number, row))
+        for _ in range(workers):
+            await queue.put(None)
+
+    # Упавший воркер отменяет остальные и поставщика, а не оставляет его висеть на полной очереди
+    async with asyncio.TaskGroup() as group:
+        for _ in range(workers):
+            group.create_task(worker())
+        group.create_task(produce())
+    return counts
+
+
+async def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Пакетный поиск билетов за мили (CSV/JSONL -> JSONL)")
+    arg_parser.add_argument("input", help="файл со столбцами origin,destination,date,direct_only")
+    arg_parser.add_argument("-o", "--output", help="куда писать JSONL (по умолчанию stdout)")
+    arg_parser.add_argument("-f", "--format", choices=("csv", "jsonl"), help="формат входа (по умолчанию по расширению)")
+    arg_parser.add_argument("-w", "--workers", type=int, default=config.SEARCH_CONCURRENCY,
+                            help="сколько поисков выполнять одновременно")
+    arg_parser.add_argument("--screenshots", metavar="DIR", help="сохранять скриншоты выдачи в папку")
+    args = arg_parser.parse_args(argv)
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    started = time.monotonic()
+    await browser_pool.start()
+    standby_pages.start()
+    try:
+        counts = await run_batch(
+            read_rows(args.input, args.format), out, max(1, args.workers), args.screenshots
+        )
+    finally:
+        await standby_pages.stop()
+        await browser_pool.stop()
+        await close_caches()
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.monotonic() - started
+    logger.info(
+        f"Done: {counts['total']} searches in {elapsed:.1f}s "
+        f"({counts['total'] / elapsed * 60 if elapsed else 0:.1f}/min), by status: "
+        + ", ".join(f"{k}={v}" for k, v in counts.items() if k != "total")
+    )
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Batch search interrupted", file=sys.stderr)
@@ -0,0 +1,109 @@
+"""
+Микро-бенчмарк поиска городов (city_codes.find_city) по всему словарю.
+
+Для каждого города гоняет запросы: полное название, префикс, латиница,
+опечатка (замена одной буквы) и IATA-код. Печатает время одного запроса
+(p50/p95/max, мкс), время построения индекса и долю запросов, где нужный
+город оказался первым.
+
+Пример:
+    python bench_cities.py --repeat 20
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+import city_codes
+
+# Буква для опечатки: соседняя по алфавиту, чтобы замена была правдоподобной
+_CYRILLIC = "абвгдежзийклмнопрстуфхцчшщыэюя"
+
+
+def typo(name, rng):
+    """Название с одной замененной буквой (не первой, чтобы префикс оставался узнаваемым)"""
+    positions = [i for i, ch in enumerate(name) if i > 0 and ch in _CYRILLIC]
+    if not positions:
+        return name
+    i = rng.choice(positions)
+    replacement = _CYRILLIC[(_CYRILLIC.index(name[i]) + 1) % len(_CYRILLIC)]
+    return name[:i] + replacement + name[i + 1:]
+
+
+def latin(name):
+    return name.translate(city_codes._TRANSLIT)
+
+
+def build_queries(seed):
+    """[(вид запроса, запрос, ожидаемый код)] по всем городам словаря"""
+    rng = random.Random(seed)
+    queries = []
+    for name, code in city_codes.CITY_TO_IATA.items():
+        queries.append(("exact", name, code))
+        queries.append(("prefix", name[:max(3, len(name) // 2)], code))
+        queries.append(("latin", latin(name), code))
+        if len(name) >= 5:
+            queries.append(("typo", typo(name, rng), code))
+        queries.append(("iata", code, code))
+    for airport, code in city_codes.AIRPORT_TO_CITY.items():
+        queries.append(("iata", airport, code))
+    return queries
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Микро-бенчмарк city_codes.find_city")
+    arg_parser.add_argument("--repeat", type=int, default=10, help="повторов каждого запроса")
+    arg_parser.add_argument("--seed", type=int, default=1, help="seed для опечаток")
+    arg_parser.add_argument("--json", action="store_true", help="вывести результат в JSON")
+    args = arg_parser.parse_args(argv)
+
+    started = time.perf_counter()
+    city_codes.CityIndex(city_codes.CITY_TO_IATA, city_codes.ALIASES, city_codes.AIRPORT_TO_CITY)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    queries = build_queries(args.seed)
+    report = {"cities": len(city_codes.CITY_TO_IATA), "build_ms": round(build_ms, 2), "kinds": {}}
+    for kind in ("exact", "prefix", "latin", "typo", "iata"):
+        selected = [(query, code) for k, query, code in queries if k == kind]
+        latencies = []
+        top1 = 0
+        found = 0
+        for query, code in selected:
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                results = city_codes.find_city(query)
+                latencies.append((time.perf_counter() - started) * 1_000_000)
+            codes = [c for _, c in results]
+            top1 += bool(codes) and codes[0] == code
+            found += code in codes
+        report["kinds"][kind] = {
+            "queries": len(selected),
+            "p50_us": round(percentile(latencies, 50), 1),
+            "p95_us": round(percentile(latencies, 95), 1),
+            "max_us": round(max(latencies), 1),
+            "top1": round(top1 / len(selected), 3),
+            "in_results": round(found / len(selected), 3),
+        }
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+
+    print(f"{report['cities']} cities, index built in {report['build_ms']} ms")
+    header = f"{'kind':<7} {'queries':>7} {'p50 us':>7} {'p95 us':>7} {'max us':>7} {'top1':>6} {'found':>6}"
+    print(header)
+    print("-" * len(header))
+    for kind, r in report["kinds"].items():
+        print(
+            f"{kind:<7} {r['queries']:>7} {r['p50_us']:>7.1f} {r['p95_us']:>7.1f} {r['max_us']:>7.1f} "
+            f"{r['top1']:>6.1%} {r['in_results']:>6.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Локальная заглушка сайта Аэрофлота для офлайн-бенчмарка (см. benchmark.py).
+
+Отдает страницы поиска и PNR с той же разметкой, на которую опираются парсеры:
+карточки .flight-search, модалки тарифов .modal__frame, фильтр пересадок,
+баннер cookies и XHR поиска /api/.../search. Число рейсов и задержки
+задаются атрибутами StubSite, чтобы гонять разные сценарии на одном сервере.
+"""
+import json
+import logging
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PATH = "/sb/app/ru-ru"
+PNR_PATH = "/sb/pnr/app/ru-ru"
+SEARCH_API_PATH = "/api/v1/award/search"
+
+SEARCH_PAGE = """<!DOCTYPE html>
+<html lang="ru"><head><meta charset="utf-8"><title>Поиск (stub)</title>
+<style>
+  .hidden { display: none; }
+  .modal__frame { position: fixed; top: 10%; left: 30%; background: #fff; border: 1px solid #000; }
+</style></head>
+<body>
+<div class="cookie-block">Мы используем cookies <a class="button" onclick="this.parentNode.remove()">Принять</a></div>
+<a class="button--wide button--lg" id="find">Найти</a>
+<div role="region" class="filters">
+  <label id="direct">Прямой рейс</label>
+  <label class="transfers">1</label><label class="transfers">2</label>
+</div>
+<div class="frame flight-searchs"><div class="flight-search__panel-info">Выдача</div><div id="cards"></div></div>
+<script>
+const CONFIG = __CONFIG__;
+let flights = [];
+
+function price(miles, taxes) {
+  return 'от ' + miles.toLocaleString('ru-RU') + ' ¥ и ' + taxes.toLocaleString('ru-RU') + ' a';
+}
+
+function renderCards() {
+  const root = document.getElementById('cards');
+  root.innerHTML = '';
+  flights.forEach((f, index) => {
+    if (f.hidden) return;
+    const card = document.createElement('div');
+    card.className = 'flight-search';
+    card.innerText = f.time + ' ' + f.numbers.join(' ') + (f.numbers.length > 1 ? ' Пересадка' : '') +
+      '\\nДоступно мест: ' + f.seats;
+    const button = document.createElement('button');
+    button.className = 'button--outline';
+    button.innerText = 'ВЫБРАТЬ РЕЙС';
+    button.onclick = () => setTimeout(() => openModal(f), CONFIG.modal_delay_ms);
+    card.appendChild(button);
+    root.appendChild(card);
+  });
+}
+
+function openModal(f) {
+  const modal = document.createElement('div');
+  modal.className = 'modal__frame';
+  const names = ['Лайт', 'Стандарт', 'Максимум'];
+  modal.innerHTML =
+    '<div class="tariff__table-head">' + names.map(n => '<span class="tariff__item-title">' + n + '</span>').join('') + '</div>' +
+    '<div>' + names.map((n, i) => '<div class="tariff__table-cell tariff__table-price">' +
+      price(f.miles + i * 15000, f.taxes) + '</div>').join('') + '</div>' +
+    '<div>Доступно мест: ' + f.seats + '</div>' +
+    '<button class="modal__close">×</button>';
+  modal.querySelector('.modal__close').onclick = () => modal.remove();
+  document.body.appendChild(modal);
+}
+
+async function search() {
+  if (CONFIG.api) {
+    await fetch(CONFIG.api_path, {method: 'POST', body: location.hash});
+  }
+  setTimeout(() => { flights = CONFIG.flights.map(f => Object.assign({}, f)); renderCards(); }, CONFIG.results_delay_ms);
+}
+
+document.getElementById('find').onclick = search;
+document.querySelectorAll('.transfers').forEach(label => label.onclick = () => {
+  flights.forEach(f => { if (f.numbers.length > 1) f.hidden = true; });
+  setTimeout(renderCards, CONFIG.modal_delay_ms);
+});
+</script>
+</body></html>
+"""
+
+PNR_PAGE = """<!DOCTYPE html>
+<html lang="ru"><head><meta charset="utf-8"><title>PNR (stub)</title></head>
+<body>
+<div class="cookie-block">Мы используем cookies <a class="button" onclick="this.parentNode.remove()">Принять</a></div>
+<input placeholder="Код бронирования"><input placeholder="Фамилия">
+<button id="find">Найти</button>
+<div id="booking"></div>
+<script>
+const CONFIG = __CONFIG__;
+document.getElementById('find').onclick = () => setTimeout(() => {
+  document.getElementById('booking').innerHTML = CONFIG.segments.map(s =>
+    '<div class="flight-booking__group">' + s.route + '<br>' + s.date + '<br>' +
+    s.departure + s.origin + 'B ' + s.destination + s.arrival + '<br>' + s.flight_number +
+    '<div class="flight-booking__col--class">Эконом</div>' +
+    '<div class="flight-booking__class_name">' + s.fare_code + '</div></div>'
+  ).join('');
+}, CONFIG.results_delay_ms);
+</script>
+</body></html>
+"""
+
+
+def make_flights(count):
+    """Синтетическая выдача: каждый третий рейс - с пересадкой"""
+    flights = []
+    for i in range(count):
+        numbers = [f"SU {1000 + i:04d}"]
+        if i % 3 == 2:
+            numbers.append(f"SU {2000 + i:04d}")
+        flights.append({
+            "time": f"{6 + i % 18:02d}:{(i * 5) % 60:02d}",
+            "numbers": numbers,
+            "miles": 40000 + 1000 * i,
+            "taxes": 2000 + 10 * i,
+            "seats": 1 + i % 9,
+        })
+    return flights
+
+
+def make_segments(count):
+    return [
+        {
+            "route": f"Москва — Город {i + 1}",
+            "date": "20 февраля 2026 г.",
+            "departure": "10:00",
+            "arrival": "12:00",
+            "origin": "SVO",
+            "destination": "AER",
+            "flight_number": f"SU {1400 + i}",
+            "fare_code": "FMOW" if i % 2 == 0 else "YCLR",
+        }
+        for i in range(count)
+    ]
+
+
+def api_payload(flights):
+    """Ответ поискового API в формате, который понимает aeroflot_api.parse_search_payload"""
+    itineraries = []
+    for f in flights:
+        segments = []
+        for number in f["numbers"]:
+            carrier, flight_number = number.split()
+            segments.append({"airline_code": carrier, "flight_number": flight_number, "departure_time": f["time"]})
+        itineraries.append({
+            "segments": segments,
+            "prices": [{"brand_name": "Стандарт", "miles": f["miles"] + 15000, "taxes": f["taxes"], "seats": f["seats"]}],
+        })
+    return {"data": {"itineraries": itineraries}}
+
+
+class StubSite:
+    """HTTP-сервер заглушки. Параметры можно менять между сценариями"""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.flights = 10
+        self.segments = 2
+        self.api = False
+        self.results_delay_ms = 300
+        self.modal_delay_ms = 50
+        self.requests = 0
+        self._runner = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def search_url(self):
+        return f"{self.base_url}{SEARCH_PATH}#/search"
+
+    @property
+    def pnr_url(self):
+        return f"{self.base_url}{PNR_PATH}#/search"
+
+    def _page(self, template, config):
+        body = template.replace("__CONFIG__", json.dumps(config, ensure_ascii=False))
+        return web.Response(text=body, content_type="text/html")
+
+    async def _search_page(self, request):
+        self.requests += 1
+        return self._page(SEARCH_PAGE, {
+            "api": self.api,
+            "api_path": SEARCH_API_PATH,
+            "flights": make_flights(self.flights),
+            "results_delay_ms": self.results_delay_ms,
+            "modal_delay_ms": self.modal_delay_ms,
+        })
+
+    async def _search_api(self, request):
+        return web.json_response(api_payload(make_flights(self.flights)))
+
+    async def _pnr_page(self, request):
+        self.requests += 1
+        return self._page(PNR_PAGE, {
+            "segments": make_segments(self.segments),
+            "results_delay_ms": self.results_delay_ms,
+        })
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get(SEARCH_PATH, self._search_page)
+        app.router.add_post(SEARCH_API_PATH, self._search_api)
+        app.router.add_get(PNR_PATH, self._pnr_page)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # Порт 0 - свободный порт, выбранный системой
+        self.port = self._runner.addresses[0][1]
+        logger.info(f"Stub site listening on {self.base_url}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,266 @@
+"""
+Офлайн-бенчмарк парсеров без обращения к aeroflot.ru.
+
+Поднимает локальную заглушку сайта (bench_stub.py) или проигрывает записанный
+HAR-файл, прогоняет AeroflotParser.get_tickets и AeroflotUpgradeParser.check_upgrade
+при разном числе рейсов и уровне параллельности и сохраняет p50/p95, пропускную
+способность и пиковый RSS (вместе с Chromium) в JSON для сравнения запусков.
+
+Примеры:
+    python benchmark.py --flights 5,15,30 --concurrency 1,2,4 --requests 8
+    python benchmark.py --har recorded/search.har --kinds search --date 20.02.2026
+HAR записывается обычным Playwright: browser.new_context(record_har_path=...);
+--date должна совпадать с датой поиска в записи.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+# Бенчмарк не должен ходить через прокси, брать результаты из кэша
+# и перезаписывать сохраненные куки рабочего бота
+os.environ.update({
+    "PROXY_URL": "",
+    "PROXY_URLS": "",
+    "PROXY_LIST_FILE": "",
+    "CACHE_BACKEND": "memory",
+    "SEARCH_CACHE_TTL": "0",
+    "UPGRADE_CACHE_TTL": "0",
+    "STORAGE_STATE_PATH": "",
+    "STANDBY_PAGES": "0",
+})
+os.environ.setdefault("HEADLESS", "True")
+
+logging.basicConfig(
+    level=logging.WARNING,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    stream=sys.stderr
+)
+
+import config
+from aeroflot_parser import AeroflotParser
+from aeroflot_upgrade import AeroflotUpgradeParser
+from browser_pool import browser_pool
+from bench_stub import StubSite
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+# Дата поиска по умолчанию всегда в будущем: прошедшая дата на настоящем сайте дает страницу ошибки
+SEARCH_DAYS_AHEAD = 30
+SEARCH_ROUTE = ("MOW", "AER")
+UPGRADE_ARGS = ("ABC123", "IVANOV")
+
+
+def default_search_date():
+    return (date.today() + timedelta(days=SEARCH_DAYS_AHEAD)).strftime("%d.%m.%Y")
+
+
+class RssSampler:
+    """
+    Пиковый RSS процесса вместе с дочерними (Chromium).
+    Без psutil доступен только максимум самого Python-процесса.
+    """
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.peak = 0
+        self._task = None
+
+    def _current(self):
+        if psutil is None:
+            # ru_maxrss в Linux - в килобайтах
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        process = psutil.Process()
+        total = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    async def _run(self):
+        while True:
+            self.peak = max(self.peak, self._current())
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.peak = self._current()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self.peak = max(self.peak, self._current())
+        return self.peak
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def is_success(kind, result):
+    if kind == "search":
+        return result.get("status") in ("success", "no_tickets")
+    return result.get("status") == "success"
+
+
+async def run_scenario(kind, call, requests, concurrency):
+    """Выполняет requests вызовов не больше concurrency одновременно"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one():
+        nonlocal failures
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                result = await call()
+            except Exception as e:
+                logger.error(f"{kind} call failed: {e}")
+                result = {"error": str(e)}
+            latencies.append(time.monotonic() - started)
+            if not is_success(kind, result):
+                failures += 1
+                logger.warning(f"{kind} call returned {result.get('status')}: {result.get('error') or result.get('message')}")
+
+    sampler = RssSampler()
+    sampler.start()
+    started = time.monotonic()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    wall = time.monotonic() - started
+    peak_rss = await sampler.stop()
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "failures": failures,
+        "wall_seconds": round(wall, 3),
+        "throughput_per_min": round(requests / wall * 60, 2) if wall else None,
+        "p50_seconds": round(percentile(latencies, 50), 3),
+        "p95_seconds": round(percentile(latencies, 95), 3),
+        "max_seconds": round(max(latencies), 3),
+        "peak_rss_mb": round(peak_rss / 1024 / 1024, 1),
+    }
+
+
+def print_table(results):
+    header = f"{'kind':<8} {'flights':>7} {'conc':>4} {'p50':>7} {'p95':>7} {'per min':>8} {'rss MB':>7} {'fail':>4}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['kind']:<8} {r.get('flights', '-')!s:>7} {r['concurrency']:>4} "
+            f"{r['p50_seconds']:>7.2f} {r['p95_seconds']:>7.2f} {r['throughput_per_min']:>8.1f} "
+            f"{r['peak_rss_mb']:>7.1f} {r['failures']:>4}"
+        )
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+async def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Офлайн-бенчмарк парсеров на локальной заглушке сайта")
+    arg_parser.add_argument("--kinds", default="search,upgrade", help="что мерить: search, upgrade")
+    arg_parser.add_argument("--flights", type=int_list, default=[5, 15, 30], help="число рейсов в выдаче")
+    arg_parser.add_argument("--concurrency", type=int_list, default=[1, 2, 4], help="уровни параллельности")
+    arg_parser.add_argument("--requests", type=int, default=8, help="вызовов на сценарий")
+    arg_parser.add_argument("--api", action="store_true", help="заглушка отдает XHR поиска (быстрый путь без модалок)")
+    arg_parser.add_argument("--direct-only", action="store_true", help="поиск только прямых (с кликами по фильтру)")
+    arg_parser.add_argument("--results-delay-ms", type=int, default=300, help="задержка отрисовки выдачи в заглушке")
+    arg_parser.add_argument("--modal-delay-ms", type=int, default=50, help="задержка открытия модалки в заглушке")
+    arg_parser.add_argument("--har", help="вместо заглушки проигрывать записанный HAR-файл")
+    arg_parser.add_argument("--date", default=default_search_date(),
+                            help="дата поиска ДД.ММ.ГГГГ (по умолчанию через 30 дней; для --har - дата записи)")
+    arg_parser.add_argument("-o", "--output", help="JSON с результатами (по умолчанию bench_results/<время>.json)")
+    args = arg_parser.parse_args(argv)
+
+    kinds = [k.strip() for k in args.kinds.split(",") if k.strip()]
+    search_args = (*SEARCH_ROUTE, args.date)
+    # Быстрый путь через API по умолчанию выключен, для --api включаем явно
+    config.CAPTURE_SEARCH_API = args.api
+    stub = StubSite()
+    stub.api = args.api
+    stub.results_delay_ms = args.results_delay_ms
+    stub.modal_delay_ms = args.modal_delay_ms
+
+    search_parser = AeroflotParser()
+    upgrade_parser = AeroflotUpgradeParser()
+    if args.har:
+        # Реальные URL, ответы берутся из HAR; число рейсов задано записью
+        browser_pool.replay_har = args.har
+        flight_counts = [None]
+    else:
+        await stub.start()
+        search_parser.base_url = stub.search_url
+        upgrade_parser.url = stub.pnr_url
+        flight_counts = args.flights
+
+    await browser_pool.start()
+    results = []
+    try:
+        # Прогрев: первый запуск браузера не должен попадать в замеры
+        await search_parser.get_tickets(*search_args, direct_only=args.direct_only)
+
+        for kind in kinds:
+            counts = flight_counts if kind == "search" else [None]
+            for flights in counts:
+                if flights is not None:
+                    stub.flights = flights
+                for concurrency in args.concurrency:
+                    if kind == "search":
+                        call = lambda: search_parser.get_tickets(*search_args, direct_only=args.direct_only)
+                    else:
+                        call = lambda: upgrade_parser.check_upgrade(*UPGRADE_ARGS)
+                    print(f"Running {kind}: flights={flights}, concurrency={concurrency}...", file=sys.stderr)
+                    result = await run_scenario(kind, call, args.requests, concurrency)
+                    result.update(kind=kind, flights=flights)
+                    results.append(result)
+    finally:
+        await browser_pool.stop()
+        await stub.stop()
+
+    report = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "settings": {
+            "api": args.api,
+            "direct_only": args.direct_only,
+            "har": args.har,
+            "date": args.date,
+            "results_delay_ms": args.results_delay_ms,
+            "modal_delay_ms": args.modal_delay_ms,
+            "rss_includes_browser": psutil is not None,
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join("bench_results", datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print_table(results)
+    print(f"\nSaved to {output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -2,8 +2,10 @@ import asyncio
 import logging
 import sys
 import re
+import time
+from datetime import datetime
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, CallbackQuery
@@ -12,19 +14,34 @@ import config
 import city_codes
 from aeroflot_parser import AeroflotParser
 from aeroflot_upgrade import AeroflotUpgradeParser
+from browser_pool import browser_pool
+from standby_pages import standby_pages
+from search_cache import sweep_caches_forever, close_caches
+from job_scheduler import scheduler, JobLimitError, JobCancelled
+from proxy_pool import proxy_pool
+from timings import timings
+from metrics import metrics
+from watchlist import Watch, WatchMonitor, watch_store
 from simple_calendar import SimpleCalendar, CalendarCallback
+from webhook import InflightUpdates, make_session, run_webhook
+from fsm_storage import create_fsm_storage
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 logger = logging.getLogger(__name__)
 
 # Инициализация бота и диспетчера
-bot = Bot(token=config.BOT_TOKEN)
-dp = Dispatcher()
+bot = Bot(token=config.BOT_TOKEN, session=make_session())
+# Состояния диалогов хранятся вне памяти процесса (см. FSM_STORAGE)
+fsm_storage = create_fsm_storage()
+dp = Dispatcher(storage=fsm_storage)
 
-# Семафор для ограничения количества одновременных браузеров
-# Устанавливаем значение 2, чтобы не перегрузить сервер
-browser_semaphore = asyncio.Semaphore(2)
+# Апдейты в обработке: при остановке дожидаемся начатых поисков
+inflight = InflightUpdates()
+dp.update.outer_middleware(inflight)
+
+# Все браузерные задачи идут через общий планировщик (см. job_scheduler),
+# емкость задается SCHEDULER_CAPACITY, чтобы не перегрузить сервер
 
 # Определение состояний
 class SearchStates(StatesGroup):
@@ -55,19 +72,49 @@ def get_new_search_kb(add_buttons=None):
     buttons.append([KeyboardButton(text="🔄 Новый поиск")])
     return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
 
+# Кнопка поиска по соседним датам
+FLEX_DATES_BUTTON = "📅 Гибкие даты"
+
 # Клавиатура выбора типа рейсов
 flight_type_kb = ReplyKeyboardMarkup(
     keyboard=[
         [KeyboardButton(text="Только прямые")],
         [KeyboardButton(text="Любые")],
+        [KeyboardButton(text=FLEX_DATES_BUTTON)],
         [KeyboardButton(text="🔄 Новый поиск")]
     ],
     resize_keyboard=True,
     one_time_keyboard=True
 )
 
+async def run_browser_job(message: types.Message, state: FSMContext, factory, kind="search", cost=1):
+    """
+    Выполняет браузерную задачу через очередь планировщика.
+    Возвращает None, если задача не выполнена (превышен лимит или пользователь ее отменил).
+    """
+    async def notify_queued(position):
+        await message.answer(
+            f"⚠️ Все потоки поиска заняты. Вы в очереди, позиция: {position}. "
+            "Поиск начнется автоматически, как только освободится место..."
+        )
+
+    try:
+        # Трасса замеров охватывает ожидание в очереди и все этапы парсера
+        with timings.trace(kind, user_id=message.from_user.id):
+            return await scheduler.run(message.from_user.id, factory, kind=kind, cost=cost, on_queued=notify_queued)
+    except JobLimitError:
+        await message.answer(
+            "⚠️ У вас уже выполняется поиск. Дождитесь результата или начните новый поиск.",
+            reply_markup=search_kb
+        )
+        await state.clear()
+    except JobCancelled:
+        logger.info(f"{kind} job of user {message.from_user.id} cancelled")
+    return None
+
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message, state: FSMContext):
+    scheduler.cancel_user(message.from_user.id)
     await state.clear()
     await message.answer(
         "Добро пожаловать в проект Milestrade. Я проверю наличие билетов за бонусные мили на нужную дату. "
@@ -75,6 +122,44 @@ async def cmd_start(message: types.Message, state: FSMContext):
         reply_markup=search_kb
     )
 
+@dp.message(Command("proxies"), F.from_user.id.in_(config.ADMIN_IDS))
+async def cmd_proxies(message: types.Message):
+    """Служебная команда: здоровье прокси"""
+    stats = proxy_pool.stats()
+    if not stats:
+        await message.answer("Прокси не настроены.")
+        return
+
+    lines = ["🛰 <b>Прокси</b> (от лучшего к худшему):"]
+    for p in stats:
+        latency = f"{p['latency']} с" if p['latency'] is not None else "нет данных"
+        outcomes = p['outcomes']
+        line = (
+            f"\n<code>{p['proxy']}</code>\n"
+            f"Задержка: {latency} | Запросов: {p['uses']} (сейчас {p['active']})\n"
+            f"ok {outcomes['ok']} / таймаут {outcomes['timeout']} / блок {outcomes['blocked']} / ошибка {outcomes['error']}"
+        )
+        if p['evicted_for']:
+            line += f"\n⛔ Исключен еще на {p['evicted_for']} с"
+        lines.append(line)
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+@dp.message(Command("timings"), F.from_user.id.in_(config.ADMIN_IDS))
+async def cmd_timings(message: types.Message):
+    """Служебная команда: длительности этапов поиска"""
+    if not timings.enabled:
+        await message.answer("Замеры выключены (TIMINGS_ENABLED=False).")
+        return
+    snapshot = timings.snapshot()
+    if not snapshot:
+        await message.answer("Замеров еще нет.")
+        return
+
+    lines = ["⏱ <b>Этапы</b> (количество, среднее / p50 / p95, с):"]
+    for name, stat in snapshot.items():
+        lines.append(f"<code>{name}</code>: {stat['count']}, {stat['avg']} / {stat['p50']} / {stat['p95']}")
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
 @dp.message(F.text == "💬 Менеджер")
 async def cmd_manager(message: types.Message):
     await message.answer(
@@ -82,8 +167,155 @@ async def cmd_manager(message: types.Message):
         reply_markup=search_kb
     )
 
+# --- Подписки на маршруты ---
+
+WATCH_USAGE = (
+    "Формат: <code>/watch Откуда - Куда ДД.ММ.ГГГГ[-ДД.ММ.ГГГГ] [прямые] [до 60000]</code>\n"
+    "Например: <code>/watch Москва - Сочи 10.04.2026 прямые до 60000</code>"
+)
+
+def parse_watch_args(text):
+    """
+    Разбирает аргументы /watch. Возвращает (origin, destination, date_from, date_to, direct_only, max_miles)
+    или бросает ValueError с сообщением для пользователя.
+    """
+    match = re.match(
+        r'^(?P<route>.+?)\s+(?P<date_from>\d{2}\.\d{2}\.\d{4})(?:\s*-\s*(?P<date_to>\d{2}\.\d{2}\.\d{4}))?(?P<rest>.*)$',
+        (text or "").strip()
+    )
+    if not match:
+        raise ValueError("Не удалось разобрать подписку.")
+
+    route = match.group("route").strip()
+    for separator in ("→", "->", " - "):
+        if separator in route:
+            cities = [c.strip() for c in route.split(separator, 1)]
+            break
+    else:
+        cities = route.split()
+    if len(cities) != 2:
+        raise ValueError("Укажите города через дефис: Откуда - Куда.")
+
+    codes = []
+    for city_name in cities:
+        results = city_codes.find_city(city_name)
+        if not results:
+            raise ValueError(f"Город «{city_name}» не найден.")
+        codes.append(results[0])
+
+    try:
+        date_from = datetime.strptime(match.group("date_from"), "%d.%m.%Y").date()
+        date_to = datetime.strptime(match.group("date_to") or match.group("date_from"), "%d.%m.%Y").date()
+    except ValueError:
+        raise ValueError("Неверная дата.")
+    if date_to < date_from:
+        raise ValueError("Конец диапазона раньше начала.")
+    if date_to < datetime.now().date():
+        raise ValueError("Эти даты уже прошли.")
+    if (date_to - date_from).days + 1 > config.WATCH_MAX_RANGE_DAYS:
+        raise ValueError(f"Диапазон не длиннее {config.WATCH_MAX_RANGE_DAYS} дней.")
+
+    rest = match.group("rest").lower()
+    direct_only = "прям" in rest
+    miles_match = re.search(r'(\d[\d\s]*\d|\d)', rest)
+    max_miles = int(re.sub(r'\s', '', miles_match.group(1))) if miles_match else None
+
+    return codes[0], codes[1], date_from.strftime("%d.%m.%Y"), date_to.strftime("%d.%m.%Y"), direct_only, max_miles
+
+def format_watch(watch):
+    dates = watch.date_from if watch.date_from == watch.date_to else f"{watch.date_from}–{watch.date_to}"
+    options = ["только прямые" if watch.direct_only else "любые"]
+    if watch.max_miles:
+        options.append("до {:,} миль".format(watch.max_miles).replace(",", " "))
+    return f"#{watch.id} {watch.origin} ➡️ {watch.destination}, {dates} ({', '.join(options)})"
+
+def format_watch_flight(f):
+    miles_fmt = "{:,}".format(f.get('miles', 0)).replace(",", " ")
+    icon = "🔄" if f.get("transfer") else "✈️"
+    return f"🕒 {f['time']} | {icon} {f['flight_number']} | 💺 {f['seats']} | 💰 {miles_fmt} миль"
+
+async def notify_watch_changes(watch, date_str, changes):
+    """Сообщение подписчику об изменениях выдачи"""
+    msg_lines = [f"🔔 <b>{watch.origin} ➡️ {watch.destination}, {date_str}</b> (подписка #{watch.id})"]
+    if changes["appeared"]:
+        msg_lines.append("\n<b>Появились места:</b>")
+        msg_lines.extend(format_watch_flight(f) for f in changes["appeared"])
+    if changes["changed"]:
+        msg_lines.append("\n<b>Изменилась цена:</b>")
+        for old, new in changes["changed"]:
+            old_fmt = "{:,}".format(old.get('miles', 0)).replace(",", " ")
+            msg_lines.append(f"{format_watch_flight(new)} (было {old_fmt})")
+    if changes["over_budget"]:
+        limit_fmt = "{:,}".format(watch.max_miles or 0).replace(",", " ")
+        msg_lines.append(f"\n<b>Дороже лимита {limit_fmt} миль:</b>")
+        for old, new in changes["over_budget"]:
+            old_fmt = "{:,}".format(old.get('miles', 0)).replace(",", " ")
+            msg_lines.append(f"{format_watch_flight(new)} (было {old_fmt})")
+    if changes["disappeared"]:
+        msg_lines.append("\n<b>Больше нет мест:</b>")
+        msg_lines.extend(format_watch_flight(f) for f in changes["disappeared"])
+    msg_lines.append("\n✍️ Оформить билет через менеджера: @milestrade")
+    await bot.send_message(watch.user_id, "\n".join(msg_lines), parse_mode="HTML")
+
+watch_monitor = WatchMonitor(watch_store, notify_watch_changes)
+
+@dp.message(Command("watch"))
+async def cmd_watch(message: types.Message, command: CommandObject):
+    if not command.args:
+        await message.answer(f"Подписка на появление мест за мили.\n{WATCH_USAGE}", parse_mode="HTML")
+        return
+
+    existing = await watch_store.for_user(message.from_user.id)
+    if len(existing) >= config.WATCH_MAX_PER_USER:
+        await message.answer(
+            f"⚠️ Не больше {config.WATCH_MAX_PER_USER} подписок. Удалите лишние: /watches",
+            reply_markup=search_kb
+        )
+        return
+
+    try:
+        origin, destination, date_from, date_to, direct_only, max_miles = parse_watch_args(command.args)
+    except ValueError as e:
+        await message.answer(f"❌ {e}\n{WATCH_USAGE}", parse_mode="HTML")
+        return
+
+    (origin_name, origin_code), (destination_name, destination_code) = origin, destination
+    watch = await watch_store.add(Watch(
+        None, message.from_user.id, origin_code, destination_code,
+        date_from, date_to, direct_only=direct_only, max_miles=max_miles
+    ))
+    await message.answer(
+        f"✅ Подписка оформлена: {origin_name} ➡️ {destination_name}\n{format_watch(watch)}\n"
+        "Я запомню текущую выдачу и напишу, когда появятся новые места или изменится цена.",
+        reply_markup=search_kb
+    )
+
+@dp.message(Command("watches"))
+async def cmd_watches(message: types.Message):
+    watches = await watch_store.for_user(message.from_user.id)
+    if not watches:
+        await message.answer(f"У вас нет подписок.\n{WATCH_USAGE}", parse_mode="HTML")
+        return
+    msg_lines = ["🔔 <b>Ваши подписки:</b>"]
+    msg_lines.extend(format_watch(w) for w in watches)
+    msg_lines.append("\nУдалить: <code>/unwatch номер</code>")
+    await message.answer("\n".join(msg_lines), parse_mode="HTML")
+
+@dp.message(Command("unwatch"))
+async def cmd_unwatch(message: types.Message, command: CommandObject):
+    watch_id = (command.args or "").strip().lstrip("#")
+    if not watch_id.isdigit():
+        await message.answer("Укажите номер подписки: <code>/unwatch 3</code>", parse_mode="HTML")
+        return
+    if await watch_store.remove(int(watch_id), user_id=message.from_user.id):
+        await message.answer(f"Подписка #{watch_id} удалена.")
+    else:
+        await message.answer(f"Подписка #{watch_id} не найдена.")
+
 @dp.message(F.text.in_({"Поиск", "🔄 Новый поиск"}))
 async def start_search(message: types.Message, state: FSMContext):
+    # Новый поиск отменяет незавершенные задачи пользователя
+    scheduler.cancel_user(message.from_user.id)
     await state.clear()
     await message.answer("Введите направление откуда летим", reply_markup=get_new_search_kb())
     await state.set_state(SearchStates.waiting_origin)
@@ -199,6 +431,9 @@ async def process_flight_type(message: types.Message, state: FSMContext):
     if message.text == "💬 Менеджер":
         return await cmd_manager(message)
 
+    if message.text == FLEX_DATES_BUTTON:
+        return await process_flexible_search(message, state)
+
     if message.text not in ["Только прямые", "Любые"]:
         await message.answer("Пожалуйста, выберите вариант используя кнопки.", reply_markup=flight_type_kb)
         return
@@ -211,78 +446,35 @@ async def process_flight_type(message: types.Message, state: FSMContext):
     date_text = data['date']
     
     await message.answer("Начинаю поиск билетов... Это может занять около минуты.", reply_markup=ReplyKeyboardRemove())
+
+    if config.STREAM_RESULTS:
+        return await process_search_streaming(message, state, origin_code, destination_code, date_text, direct_only)
     
-    # Проверяем, есть ли свободные слоты в семафоре
-    if browser_semaphore.locked():
-        await message.answer("⚠️ Все потоки поиска заняты. Вы поставлены в очередь, поиск начнется автоматически, как только освободится место...")
-
-    async with browser_semaphore:
-        # Запуск парсера
-        parser = AeroflotParser()
-        result = await parser.get_tickets(origin_code, destination_code, date_text, direct_only=direct_only)
+    # Запуск парсера через очередь
+    parser = AeroflotParser()
+    result = await run_browser_job(
+        message, state,
+        lambda: parser.get_tickets(origin_code, destination_code, date_text, direct_only=direct_only)
+    )
+    if result is None:
+        return
     
     # Отправка скриншота, если он есть
-    screenshot_path = result.get("screenshot")
-    if screenshot_path:
-        try:
-            photo = types.FSInputFile(screenshot_path)
-            await message.answer_photo(photo)
-        except Exception as e:
-            logger.error(f"Error sending photo: {e}")
-            await message.answer("Не удалось отправить скриншот.")
+    screenshot = result.get("screenshot")
+    if screenshot:
+        await send_screenshot(message, screenshot)
 
     if result.get("status") == "success":
-        flights = result.get("flights", {})
-        direct = flights.get("direct", [])
-        transfers = flights.get("transfers", [])
-        
-        msg_lines = []
-        
-        if direct:
-            msg_lines.append("✈️ <b>Прямые рейсы:</b>")
-            for f in direct:
-                miles = f.get('miles', 0)
-                taxes = f.get('taxes', 0)
-                total_cost = int(miles * config.MILE_RATE + taxes)
-                
-                # Форматируем числа с пробелами
-                miles_fmt = "{:,}".format(miles).replace(",", " ")
-                taxes_fmt = "{:,}".format(taxes).replace(",", " ")
-                total_fmt = "{:,}".format(total_cost).replace(",", " ")
-                
-                msg_lines.append(
-                    f"🕒 {f['time']} | ✈️ {f['flight_number']}\n"
-                    f"💺 Мест: {f['seats']}\n"
-                    f"💰 {miles_fmt} миль + {taxes_fmt} руб = <b>{total_fmt} руб</b>\n"
-                )
-            msg_lines.append("")
-            
-        if transfers:
-            msg_lines.append("🔄 <b>Рейсы с пересадкой:</b>")
-            for f in transfers:
-                miles = f.get('miles', 0)
-                taxes = f.get('taxes', 0)
-                total_cost = int(miles * config.MILE_RATE + taxes)
-                
-                # Форматируем числа с пробелами
-                miles_fmt = "{:,}".format(miles).replace(",", " ")
-                taxes_fmt = "{:,}".format(taxes).replace(",", " ")
-                total_fmt = "{:,}".format(total_cost).replace(",", " ")
-
-                msg_lines.append(
-                    f"🕒 {f['time']} | ✈️ {f['flight_number']}\n"
-                    f"💺 Мест: {f['seats']}\n"
-                    f"💰 {miles_fmt} миль + {taxes_fmt} руб = <b>{total_fmt} руб</b>\n"
-                )
+        msg_lines = format_results(result.get("flights", {}))
         
         if not msg_lines:
             await message.answer("Рейсы найдены, но не удалось извлечь детали.", reply_markup=search_kb)
         else:
             # Добавляем подпись в конце сообщения
-            msg_lines.append("\n📌 Цена указана за 1 пассажира в одну сторону")
-            msg_lines.append("✍️ Оформить билет через менеджера: @milestrade")
+            msg_lines.append(RESULTS_FOOTER)
             
-            await message.answer("\n".join(msg_lines), parse_mode="HTML", reply_markup=search_kb)
+            with timings.span("telegram_send"):
+                await message.answer("\n".join(msg_lines), parse_mode="HTML", reply_markup=search_kb)
             
     elif result.get("status") == "no_tickets":
         await message.answer("Билетов класса Бизнес за мили нет в наличии на эту дату.", reply_markup=search_kb)
@@ -292,8 +484,211 @@ async def process_flight_type(message: types.Message, state: FSMContext):
     
     await state.clear()
 
+# Подпись под выдачей
+RESULTS_FOOTER = "\n📌 Цена указана за 1 пассажира в одну сторону\n✍️ Оформить билет через менеджера: @milestrade"
+
+def format_flight(f):
+    miles = f.get('miles', 0)
+    taxes = f.get('taxes', 0)
+    total_cost = int(miles * config.MILE_RATE + taxes)
+    
+    # Форматируем числа с пробелами
+    miles_fmt = "{:,}".format(miles).replace(",", " ")
+    taxes_fmt = "{:,}".format(taxes).replace(",", " ")
+    total_fmt = "{:,}".format(total_cost).replace(",", " ")
+    
+    return (
+        f"🕒 {f['time']} | ✈️ {f['flight_number']}\n"
+        f"💺 Мест: {f['seats']}\n"
+        f"💰 {miles_fmt} миль + {taxes_fmt} руб = <b>{total_fmt} руб</b>\n"
+    )
+
+def format_results(flights):
+    """Строки выдачи: прямые рейсы, затем с пересадкой"""
+    direct = flights.get("direct", [])
+    transfers = flights.get("transfers", [])
+    msg_lines = []
+    if direct:
+        msg_lines.append("✈️ <b>Прямые рейсы:</b>")
+        msg_lines.extend(format_flight(f) for f in direct)
+        msg_lines.append("")
+    if transfers:
+        msg_lines.append("🔄 <b>Рейсы с пересадкой:</b>")
+        msg_lines.extend(format_flight(f) for f in transfers)
+    return msg_lines
+
+async def send_screenshot(message: types.Message, screenshot):
+    try:
+        photo = types.BufferedInputFile(screenshot, filename=f"results_screenshot.{config.SCREENSHOT_FORMAT}")
+        with timings.span("telegram_send"):
+            await message.answer_photo(photo)
+    except Exception as e:
+        logger.error(f"Error sending photo: {e}")
+        await message.answer("Не удалось отправить скриншот.")
+
+class ResultsMessage:
+    """
+    Одно сообщение с выдачей, которое дописывается по мере разбора рейсов.
+    Правки не чаще STREAM_EDIT_INTERVAL, чтобы не упереться в лимиты Telegram.
+    """
+
+    def __init__(self, message: types.Message):
+        self.message = message
+        self.sent = None
+        self.shown = None
+        self.last_edit = 0.0
+        self.flights = {"direct": [], "transfers": []}
+
+    @property
+    def has_flights(self):
+        return bool(self.flights["direct"] or self.flights["transfers"])
+
+    async def add(self, group, flight):
+        self.flights[group].append(flight)
+        if time.monotonic() - self.last_edit >= config.STREAM_EDIT_INTERVAL:
+            await self._show(format_results(self.flights) + ["⏳ Ищу остальные рейсы..."])
+
+    async def finish(self):
+        """Итоговый вид сообщения: все рейсы без строки ожидания"""
+        if self.has_flights:
+            await self._show(format_results(self.flights))
+
+    async def _show(self, msg_lines):
+        text = "\n".join(msg_lines)
+        if text == self.shown:
+            return
+        try:
+            with timings.span("telegram_send"):
+                if self.sent is None:
+                    self.sent = await self.message.answer(text, parse_mode="HTML")
+                else:
+                    await self.sent.edit_text(text, parse_mode="HTML")
+            self.shown = text
+        except Exception as e:
+            logger.warning(f"Could not update results message: {e}")
+        self.last_edit = time.monotonic()
+
+async def process_search_streaming(message: types.Message, state: FSMContext, origin_code, destination_code, date_text, direct_only):
+    """Поиск с выдачей по ходу работы: сначала скриншот, затем рейсы в одном сообщении"""
+    parser = AeroflotParser()
+    results = ResultsMessage(message)
+    events = asyncio.Queue()
+
+    async def search():
+        # Задача браузера только складывает события, отправкой в Telegram занимается consume()
+        result = {"error": "Поиск завершился без результата"}
+        async for event in parser.stream_tickets(origin_code, destination_code, date_text, direct_only=direct_only):
+            if event["type"] == "result":
+                result = event["result"]
+            else:
+                events.put_nowait(event)
+        return result
+
+    async def consume():
+        while True:
+            event = await events.get()
+            if event is None:
+                return
+            if event["type"] == "screenshot" and event["screenshot"]:
+                await send_screenshot(message, event["screenshot"])
+            elif event["type"] == "flight":
+                await results.add(event["group"], event["flight"])
+
+    consumer = asyncio.create_task(consume())
+    try:
+        result = await run_browser_job(message, state, search)
+    finally:
+        events.put_nowait(None)
+        await consumer
+    if result is None:
+        return
+
+    if result.get("status") == "success":
+        await results.finish()
+        if results.has_flights:
+            await message.answer(RESULTS_FOOTER.strip(), reply_markup=search_kb)
+        else:
+            await message.answer("Рейсы найдены, но не удалось извлечь детали.", reply_markup=search_kb)
+    elif result.get("status") == "no_tickets":
+        await message.answer("Билетов класса Бизнес за мили нет в наличии на эту дату.", reply_markup=search_kb)
+
+    if "error" in result and result.get("status") != "no_tickets":
+        await results.finish()
+        await message.answer(f"Ошибка: {result['error']}", reply_markup=search_kb)
+
+    await state.clear()
+
+def format_flex_day(day):
+    """Строка матрицы гибких дат для одного дня"""
+    weekday = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"][datetime.strptime(day["date"], "%d.%m.%Y").weekday()]
+    prefix = f"<b>{day['date'][:5]}</b> {weekday}"
+
+    if day["status"] not in ("success", "no_tickets"):
+        return f"{prefix} | ⚠️ ошибка поиска"
+    if day["direct_miles"] is None and day["transfer_miles"] is None:
+        return f"{prefix} | —"
+
+    parts = []
+    if day["direct_miles"] is not None:
+        miles_fmt = "{:,}".format(day["direct_miles"]).replace(",", " ")
+        parts.append(f"✈️ {miles_fmt} ({day['direct_seats']} м.)")
+    if day["transfer_miles"] is not None:
+        miles_fmt = "{:,}".format(day["transfer_miles"]).replace(",", " ")
+        parts.append(f"🔄 {miles_fmt} ({day['transfer_seats']} м.)")
+    return f"{prefix} | " + " | ".join(parts)
+
+async def process_flexible_search(message: types.Message, state: FSMContext):
+    """Поиск по окну соседних дат с ответом одной таблицей"""
+    data = await state.get_data()
+    origin_code = data['origin_code']
+    destination_code = data['destination_code']
+    date_text = data['date']
+    days = config.FLEX_SEARCH_DAYS
+
+    await message.answer(
+        f"Ищу билеты на {date_text} ±{days} дн. Это может занять пару минут.",
+        reply_markup=ReplyKeyboardRemove()
+    )
+
+    # Длинная задача: в очереди уступает одиночным поискам
+    parser = AeroflotParser()
+    result = await run_browser_job(
+        message, state,
+        lambda: parser.get_tickets_range(origin_code, destination_code, date_text, days=days),
+        kind="flex_search",
+        cost=2 * days + 1
+    )
+    if result is None:
+        return
+
+    if result.get("status") != "success":
+        await message.answer(f"Ошибка: {result.get('error', 'Неизвестная ошибка')}", reply_markup=search_kb)
+        await state.clear()
+        return
+
+    msg_lines = [
+        f"📅 <b>{data['origin_name']} ➡️ {data['destination_name']}</b>",
+        "Минимум миль за рейс (тариф Стандарт), ✈️ прямые, 🔄 с пересадкой:",
+        ""
+    ]
+    msg_lines.extend(format_flex_day(day) for day in result["days"])
+    msg_lines.append("\n📌 Для подробностей по дню запустите обычный поиск на эту дату")
+    msg_lines.append("✍️ Оформить билет через менеджера: @milestrade")
+
+    with timings.span("telegram_send"):
+        await message.answer("\n".join(msg_lines), parse_mode="HTML", reply_markup=search_kb)
+    await state.clear()
+
 # --- Логика проверки апгрейда ---
 
+def get_seat_lookup_key(segment):
+    """(откуда, куда, дата, рейс) сегмента для поиска мест, если все известно"""
+    details = segment.get('details', {})
+    keys = ('origin_code', 'destination_code', 'date', 'flight_number')
+    if all(details.get(k) for k in keys):
+        return tuple(details[k] for k in keys)
+    return None
+
 @dp.message(F.text == "💎 Проверить апгрейд")
 async def start_upgrade_check(message: types.Message, state: FSMContext):
     await state.clear()
@@ -358,14 +753,15 @@ async def process_booking_lastname(message: types.Message, state: FSMContext):
     
     await message.answer("Проверяю возможность апгрейда... Это может занять минуту.", reply_markup=ReplyKeyboardRemove())
     
-    # Используем тот же семафор или новый?
-    # Лучше использовать общий семафор, чтобы не открывать слишком много браузеров сразу
-    if browser_semaphore.locked():
-        await message.answer("⚠️ Очередь запросов. Поиск начнется автоматически, как только освободится место...")
-
-    async with browser_semaphore:
-        parser = AeroflotUpgradeParser()
-        result = await parser.check_upgrade(booking_code, last_name)
+    # Общая очередь, чтобы не открывать слишком много браузеров сразу
+    parser = AeroflotUpgradeParser()
+    result = await run_browser_job(
+        message, state,
+        lambda: parser.check_upgrade(booking_code, last_name),
+        kind="upgrade"
+    )
+    if result is None:
+        return
 
     if result.get("status") == "success":
         segments = result.get("segments", [])
@@ -379,6 +775,28 @@ async def process_booking_lastname(message: types.Message, state: FSMContext):
         # Проходим по сегментам и проверяем наличие билетов для апгрейда
         # Для этого нужно запустить поиск, если тариф подходит
         
+        # Собираем уникальные (откуда, куда, дата, рейс) подходящих сегментов
+        # и проверяем места по ним параллельно одной задачей
+        seat_lookups = []
+        for seg in segments:
+            lookup_key = get_seat_lookup_key(seg)
+            if seg['eligible'] and lookup_key and lookup_key not in seat_lookups:
+                seat_lookups.append(lookup_key)
+
+        seat_results = {}
+        if seat_lookups:
+            await message.answer(f"🔎 Проверяю наличие мест для апгрейда (рейсов: {len(seat_lookups)})...")
+            search_parser = AeroflotParser()
+            # Ищем только нужные рейсы, без полного поиска по маршруту
+            seat_results = await run_browser_job(
+                message, state,
+                lambda: search_parser.get_flights_batch(seat_lookups),
+                kind="upgrade_seats",
+                cost=len(seat_lookups)
+            )
+            if seat_results is None:
+                return
+
         processed_segments = []
         all_seats_found = True
         any_seats_found = False
@@ -411,39 +829,18 @@ async def process_booking_lastname(message: types.Message, state: FSMContext):
                 found_upgrade = False
                 checked_seats = False
 
-                if details.get('origin_code') and details.get('destination_code') and details.get('date'):
-                    await message.answer(f"🔎 Проверяю наличие мест для апгрейда на сегменте {idx}...")
-                    
+                lookup_key = get_seat_lookup_key(seg)
+                if lookup_key:
                     checked_seats = True
-                    # Используем семафор для поиска
-                    async with browser_semaphore:
-                        parser = AeroflotParser()
-                        # Ищем прямой рейс (так как проверяем конкретный сегмент)
-                        ticket_res = await parser.get_tickets(
-                            details['origin_code'], 
-                            details['destination_code'], 
-                            details['date'],
-                            direct_only=True 
-                        )
+                    flight_res = seat_results.get(lookup_key, {})
                     
                     upgrade_cost = 0
                     
-                    if ticket_res.get("status") == "success":
-                        # Ищем наш рейс в списке
-                        flights_direct = ticket_res.get("flights", {}).get("direct", [])
-                        target_flight = details.get('flight_number') # Например SU1459
-                        
-                        for f in flights_direct:
-                            # Сравниваем номер рейса (очищенный от пробелов)
-                            f_num = f['flight_number'].replace(" ", "").replace(",", "")
-                            # В парсере flight_number может быть списком "SU 1459" или "SU 1459, SU ..."
-                            # Проверяем вхождение
-                            if target_flight and target_flight in f_num:
-                                # Нашли!
-                                found_upgrade = True
-                                # Стоимость апгрейда = мили / 2
-                                upgrade_cost = int(f['miles'] / 2)
-                                break
+                    if flight_res.get("status") == "success":
+                        # Нашли наш рейс в выдаче за мили
+                        found_upgrade = True
+                        # Стоимость апгрейда = мили / 2
+                        upgrade_cost = int(flight_res["flight"]['miles'] / 2)
                     
                     if found_upgrade:
                         cost_rub = int(upgrade_cost * config.MILE_RATE)
@@ -478,7 +875,8 @@ async def process_booking_lastname(message: types.Message, state: FSMContext):
         # Добавляем контакт менеджера
         msg += "\n\n✍️ Оформить апгрейд через менеджера: @milestrade"
 
-        await message.answer(msg, parse_mode="HTML", reply_markup=search_kb)
+        with timings.span("telegram_send"):
+            await message.answer(msg, parse_mode="HTML", reply_markup=search_kb)
         
     else:
         # Ошибка
@@ -492,9 +890,33 @@ async def process_booking_lastname(message: types.Message, state: FSMContext):
     await state.clear()
 
 async def main():
-    print("Bot polling started")
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    # Браузеры запускаются один раз на весь процесс
+    await browser_pool.start()
+    standby_pages.start()
+    if config.METRICS_PORT:
+        await metrics.start()
+    sweeper = asyncio.create_task(sweep_caches_forever())
+    watcher = asyncio.create_task(watch_monitor.run_forever())
+    try:
+        if config.BOT_MODE == "webhook":
+            print("Bot webhook started")
+            await run_webhook(bot, dp, inflight)
+        else:
+            print("Bot polling started")
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
+            # Polling остановлен, но поиски из уже полученных апдейтов еще идут
+            await inflight.drain(config.SHUTDOWN_DRAIN_TIMEOUT)
+    finally:
+        sweeper.cancel()
+        watcher.cancel()
+        await metrics.stop()
+        await standby_pages.stop()
+        await browser_pool.stop()
+        await close_caches()
+        await watch_store.close()
+        # Повторно после дожидания апдейтов: сохраняет изменения, сделанные после shutdown диспетчера
+        await fsm_storage.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
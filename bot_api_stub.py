@@ -0,0 +1,196 @@
+"""
+Локальная заглушка Telegram Bot API для проверки бота без Telegram.
+
+Отвечает на методы бота (getMe, sendMessage, sendPhoto, editMessageText,
+setWebhook, getUpdates...) правдоподобными объектами и запоминает вызовы.
+Апдейты от "пользователя" отправляются на вебхук бота с секретом из setWebhook
+или, если вебхук не установлен, отдаются через getUpdates (polling).
+
+Пример (вебхук):
+    python bot_api_stub.py --port 8081 --text /start --text "Поиск"
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_MODE=webhook \\
+        WEBHOOK_URL=http://127.0.0.1:8080 python main.py
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+STUB_BOT = {"id": 1000, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}
+STUB_USER = {"id": 42, "is_bot": False, "first_name": "Тест", "language_code": "ru"}
+
+# Методы, которые возвращают отправленное/измененное сообщение
+MESSAGE_METHODS = {
+    "sendmessage", "sendphoto", "senddocument", "editmessagetext",
+    "editmessagecaption", "editmessagemedia", "editmessagereplymarkup",
+}
+
+
+class StubBotAPI:
+    """HTTP-сервер заглушки. calls - список (метод, параметры) в порядке вызова"""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.calls = []
+        self.webhook_url = ""
+        self.webhook_secret = ""
+        self.webhook_set = asyncio.Event()
+        self._updates = asyncio.Queue()
+        self._update_id = 0
+        self._message_id = 0
+        self._runner = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def _message(self, params):
+        self._message_id += 1
+        chat_id = int(params.get("chat_id") or STUB_USER["id"])
+        message = {
+            "message_id": int(params.get("message_id") or self._message_id),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": STUB_BOT,
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        if "photo" in params:
+            message["photo"] = [{"file_id": "stub", "file_unique_id": "stub", "width": 1, "height": 1}]
+        if "caption" in params:
+            message["caption"] = params["caption"]
+        return message
+
+    async def _get_updates(self, params):
+        timeout = float(params.get("timeout") or 0)
+        updates = []
+        try:
+            updates.append(await asyncio.wait_for(self._updates.get(), timeout or 0.1))
+        except asyncio.TimeoutError:
+            return []
+        while not self._updates.empty():
+            updates.append(self._updates.get_nowait())
+        return updates
+
+    async def _result(self, method, params):
+        name = method.lower()
+        if name == "getme":
+            return STUB_BOT
+        if name in MESSAGE_METHODS:
+            return self._message(params)
+        if name == "setwebhook":
+            self.webhook_url = params.get("url", "")
+            self.webhook_secret = params.get("secret_token", "")
+            self.webhook_set.set()
+            return True
+        if name == "deletewebhook":
+            self.webhook_url = ""
+            self.webhook_set.clear()
+            return True
+        if name == "getwebhookinfo":
+            return {"url": self.webhook_url, "has_custom_certificate": False, "pending_update_count": 0}
+        if name == "getupdates":
+            return await self._get_updates(params)
+        return True
+
+    async def _handle(self, request):
+        method = request.match_info["method"]
+        params = {}
+        if request.can_read_body:
+            if request.content_type == "application/json":
+                params = await request.json()
+            else:
+                # Файлы (скриншоты) только отмечаем, содержимое не нужно
+                for key, value in (await request.post()).items():
+                    params[key] = value if isinstance(value, str) else f"<file {value.filename}>"
+        if method.lower() != "getupdates":
+            self.calls.append((method, params))
+            logger.info(f"{method} {json.dumps(params, ensure_ascii=False)[:300]}")
+        return web.json_response({"ok": True, "result": await self._result(method, params)})
+
+    def make_update(self, text):
+        """Апдейт с текстовым сообщением от тестового пользователя"""
+        self._update_id += 1
+        return {
+            "update_id": self._update_id,
+            "message": {
+                "message_id": 10_000 + self._update_id,
+                "date": int(time.time()),
+                "chat": {"id": STUB_USER["id"], "type": "private"},
+                "from": STUB_USER,
+                "text": text,
+            },
+        }
+
+    async def send_update(self, text):
+        """
+        Отправляет сообщение боту: на вебхук (с секретом) или в очередь getUpdates.
+        Возвращает HTTP-статус ответа вебхука или None для polling
+        """
+        update = self.make_update(text)
+        if not self.webhook_url:
+            await self._updates.put(update)
+            return None
+        headers = {}
+        if self.webhook_secret:
+            headers["X-Telegram-Bot-Api-Secret-Token"] = self.webhook_secret
+        async with aiohttp.ClientSession() as session:
+            async with session.post(self.webhook_url, json=update, headers=headers) as response:
+                return response.status
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        # Порт 0 - свободный порт, выбранный системой
+        self.port = self._runner.addresses[0][1]
+        logger.info(f"Stub Bot API listening on {self.base_url}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Заглушка Telegram Bot API")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8081)
+    arg_parser.add_argument("--text", action="append", default=[], help="сообщения боту по порядку")
+    arg_parser.add_argument("--interval", type=float, default=2.0, help="пауза между сообщениями, сек")
+    arg_parser.add_argument("--polling", action="store_true", help="не ждать setWebhook, отдавать через getUpdates")
+    args = arg_parser.parse_args(argv)
+
+    stub = StubBotAPI(args.host, args.port)
+    await stub.start()
+    print(f"TELEGRAM_API_URL={stub.base_url}", file=sys.stderr)
+    try:
+        if args.text:
+            if not args.polling:
+                print("Waiting for setWebhook...", file=sys.stderr)
+                await stub.webhook_set.wait()
+            for text in args.text:
+                status = await stub.send_update(text)
+                print(f"Sent {text!r}: {status or 'queued'}", file=sys.stderr)
+                await asyncio.sleep(args.interval)
+        await asyncio.Event().wait()
+    finally:
+        await stub.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
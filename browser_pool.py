@@ -0,0 +1,236 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+import config
+from request_blocking import RequestBlocker
+from storage_state import storage_state
+from timings import timings
+from proxy_pool import proxy_pool, OUTCOME_OK, OUTCOME_BLOCKED, OUTCOME_TIMEOUT, OUTCOME_ERROR
+
+logger = logging.getLogger(__name__)
+
+# Общие параметры контекста для обоих парсеров
+VIEWPORT = {'width': 1920, 'height': 1080}
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+# Прокси назначается каждому контексту отдельно (см. proxy_pool), но Chromium
+# требует глобальный прокси при запуске, чтобы разрешить прокси на уровне контекста
+PER_CONTEXT_PROXY = {"server": "http://per-context"}
+
+# HTTP-статусы, которыми сайт отвечает заблокированному прокси
+BLOCKED_STATUSES = (403, 429)
+
+
+class _PooledBrowser:
+    """Запущенный браузер и счетчики его использования"""
+
+    def __init__(self, browser):
+        self.browser = browser
+        self.uses = 0
+        self.active = 0
+        self.retired = False
+
+
+class ContextHandle:
+    """Открытый контекст вместе с браузером и прокси, которые за ним закреплены"""
+
+    def __init__(self, pooled, lease):
+        self.pooled = pooled
+        self.lease = lease
+        self.context = None
+        self.request_stats = None
+        self.page = None
+        self.created_at = None
+
+
+class BrowserPool:
+    """
+    Пул долгоживущих браузеров Chromium.
+
+    Браузеры запускаются один раз и раздают свежие BrowserContext на каждый запрос.
+    После BROWSER_MAX_USES контекстов или при падении браузер выводится из пула
+    и закрывается, как только с ним закончат работать текущие запросы.
+    """
+
+    def __init__(self, size=None, max_uses=None):
+        self.size = size or config.BROWSER_POOL_SIZE
+        self.max_uses = max_uses or config.BROWSER_MAX_USES
+        self.blocker = RequestBlocker() if config.BLOCK_REQUESTS else None
+        # Путь к HAR-файлу: ответы сайта берутся из записи (офлайн-бенчмарк)
+        self.replay_har = None
+        self._playwright = None
+        self._browsers = []
+        self._leases = {}
+        self._open_contexts = 0
+        self._lock = asyncio.Lock()
+
+    @property
+    def active_browsers(self):
+        return len(self._browsers)
+
+    @property
+    def active_contexts(self):
+        return self._open_contexts
+
+    async def start(self):
+        """Запускает Playwright (браузеры поднимаются лениво при первом запросе)"""
+        async with self._lock:
+            if self._playwright is None:
+                logger.info("Starting browser pool")
+                self._playwright = await async_playwright().start()
+
+    async def stop(self):
+        """Закрывает все браузеры и останавливает Playwright"""
+        async with self._lock:
+            browsers, self._browsers = self._browsers, []
+            for pooled in browsers:
+                await self._close_browser(pooled)
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+            logger.info("Browser pool stopped")
+
+    async def _launch(self):
+        launch_kwargs = {"headless": config.HEADLESS}
+        if proxy_pool.enabled:
+            launch_kwargs["proxy"] = PER_CONTEXT_PROXY
+
+        with timings.span("browser_launch"):
+            browser = await self._playwright.chromium.launch(**launch_kwargs)
+        pooled = _PooledBrowser(browser)
+
+        def on_disconnected(_):
+            # Браузер упал или был закрыт - больше его не выдаем
+            if not pooled.retired:
+                logger.warning("Pooled browser disconnected, it will be replaced")
+            self._retire(pooled)
+
+        browser.on("disconnected", on_disconnected)
+        logger.info(f"Launched pooled browser ({len(self._browsers) + 1}/{self.size})")
+        return pooled
+
+    def _retire(self, pooled):
+        pooled.retired = True
+        if pooled in self._browsers:
+            self._browsers.remove(pooled)
+
+    async def _close_browser(self, pooled):
+        pooled.retired = True
+        try:
+            await pooled.browser.close()
+        except Exception as e:
+            logger.debug(f"Error closing pooled browser: {e}")
+
+    async def _acquire(self):
+        if self._playwright is None:
+            await self.start()
+
+        async with self._lock:
+            # Убираем отключившиеся браузеры
+            for pooled in list(self._browsers):
+                if not pooled.browser.is_connected():
+                    self._retire(pooled)
+
+            if len(self._browsers) < self.size:
+                pooled = await self._launch()
+                self._browsers.append(pooled)
+            else:
+                pooled = min(self._browsers, key=lambda b: b.active)
+
+            pooled.uses += 1
+            pooled.active += 1
+            if pooled.uses >= self.max_uses:
+                # Исчерпал лимит - новые запросы получат свежий браузер
+                logger.info(f"Pooled browser reached {pooled.uses} uses, recycling")
+                self._retire(pooled)
+            return pooled
+
+    async def _release(self, pooled):
+        pooled.active -= 1
+        if pooled.retired and pooled.active <= 0:
+            await self._close_browser(pooled)
+
+    def report_navigation(self, context, seconds, response=None):
+        """Парсер сообщает время загрузки страницы (и ответ) через прокси контекста"""
+        lease = self._leases.get(context)
+        if lease is None:
+            return
+        lease.latency = seconds
+        if response is not None and response.status in BLOCKED_STATUSES:
+            logger.warning(f"Navigation returned {response.status}, proxy looks blocked")
+            lease.outcome = OUTCOME_BLOCKED
+
+    def report_error(self, context, error):
+        """Парсер сообщает об ошибке поиска - она идет в статистику прокси"""
+        lease = self._leases.get(context)
+        if lease is None or lease.outcome != OUTCOME_OK:
+            return
+        lease.outcome = OUTCOME_TIMEOUT if isinstance(error, PlaywrightTimeoutError) else OUTCOME_ERROR
+
+    async def open_context(self, **context_kwargs):
+        """
+        Открывает новый контекст вне блока with (например, для дежурных страниц).
+        Обязательно закрывать через close_context().
+        """
+        pooled = await self._acquire()
+        lease = proxy_pool.acquire()
+        if lease is not None:
+            context_kwargs["proxy"] = lease.settings
+        if "storage_state" not in context_kwargs and storage_state.state is not None:
+            # Куки согласия и выбранной страны - баннеры не появятся
+            context_kwargs["storage_state"] = storage_state.state
+        handle = ContextHandle(pooled, lease)
+        try:
+            try:
+                with timings.span("context_open"):
+                    handle.context = await pooled.browser.new_context(
+                        viewport=VIEWPORT,
+                        user_agent=USER_AGENT,
+                        **context_kwargs
+                    )
+            except Exception:
+                # Скорее всего браузер упал - выводим его из пула
+                self._retire(pooled)
+                raise
+            self._open_contexts += 1
+            if lease is not None:
+                self._leases[handle.context] = lease
+            if self.blocker is not None:
+                handle.request_stats = await self.blocker.attach(handle.context)
+            if self.replay_har:
+                await handle.context.route_from_har(self.replay_har, not_found="abort")
+        except BaseException:
+            await self.close_context(handle)
+            raise
+        return handle
+
+    async def close_context(self, handle):
+        if handle.request_stats is not None:
+            logger.info(f"Context requests: {handle.request_stats.summary()}")
+        if handle.context is not None:
+            self._open_contexts -= 1
+            self._leases.pop(handle.context, None)
+            try:
+                await handle.context.close()
+            except Exception as e:
+                logger.debug(f"Error closing context: {e}")
+        if handle.lease is not None:
+            proxy_pool.release(handle.lease)
+        await self._release(handle.pooled)
+
+    @asynccontextmanager
+    async def context(self, **context_kwargs):
+        """Выдает новый BrowserContext из пула и закрывает его по выходу"""
+        handle = await self.open_context(**context_kwargs)
+        try:
+            yield handle.context
+        except Exception as e:
+            self.report_error(handle.context, e)
+            raise
+        finally:
+            await self.close_context(handle)
+
+
+# Общий пул для всего процесса
+browser_pool = BrowserPool()
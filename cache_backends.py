@@ -0,0 +1,182 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import config
+
+logger = logging.getLogger(__name__)
+
+# Поле результата с байтами скриншота - в SQLite хранится отдельной BLOB-колонкой
+BLOB_FIELD = "screenshot"
+
+
+def entry_size(value):
+    """Примерный размер записи в байтах: скриншот плюс остальной результат в JSON"""
+    value = dict(value)
+    blob = value.pop(BLOB_FIELD, None) or b""
+    return len(blob) + len(json.dumps(value, ensure_ascii=False, default=str).encode())
+
+
+class MemoryBackend:
+    """
+    Хранилище в памяти процесса с LRU-вытеснением.
+    Лимит и по числу записей, и по суммарному размеру (max_bytes, None - без лимита):
+    записи со скриншотами весят сотни КБ, и одного лимита записей мало
+    """
+
+    def __init__(self, max_entries, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self.total_bytes = 0
+
+    def _remove(self, key):
+        del self._entries[key]
+        self.total_bytes -= self._sizes.pop(key)
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key, value, ttl):
+        if key in self._entries:
+            self._remove(key)
+        size = entry_size(value)
+        self._entries[key] = (time.time() + ttl, value)
+        self._sizes[key] = size
+        self.total_bytes += size
+        # Самая свежая запись остается, даже если одна превышает лимит
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes and self.total_bytes > self.max_bytes)
+        ):
+            self._remove(next(iter(self._entries)))
+
+    async def sweep(self):
+        now = time.time()
+        expired = [key for key, (expires_at, _) in self._entries.items() if expires_at < now]
+        for key in expired:
+            self._remove(key)
+        return len(expired)
+
+    async def clear(self):
+        self._entries.clear()
+        self._sizes.clear()
+        self.total_bytes = 0
+
+    async def count(self):
+        return len(self._entries)
+
+    async def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """
+    Хранилище в локальном SQLite-файле (WAL), переживает перезапуск контейнера.
+    Ключ - первичный ключ таблицы, поэтому поиск по маршруту/дате или хэшу PNR индексирован.
+    Запросы выполняются в отдельном потоке, чтобы не блокировать event loop.
+    """
+
+    def __init__(self, path, table, max_entries):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, "
+                "expires_at REAL NOT NULL, "
+                "accessed_at REAL NOT NULL, "
+                "value TEXT NOT NULL, "
+                "blob BLOB)"
+            )
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_expires_at ON {table} (expires_at)")
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed_at ON {table} (accessed_at)")
+            self._conn.commit()
+
+    def _execute(self, sql, params=(), fetch=False):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            rows = cursor.fetchall() if fetch else cursor.rowcount
+            self._conn.commit()
+            return rows
+
+    async def get(self, key):
+        now = time.time()
+        rows = await asyncio.to_thread(
+            self._execute,
+            f"SELECT value, blob FROM {self.table} WHERE key = ? AND expires_at >= ?",
+            (key, now),
+            True
+        )
+        if not rows:
+            return None
+        await asyncio.to_thread(
+            self._execute, f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key)
+        )
+        value_json, blob = rows[0]
+        value = json.loads(value_json)
+        if blob is not None:
+            value[BLOB_FIELD] = bytes(blob)
+        return value
+
+    async def set(self, key, value, ttl):
+        value = dict(value)
+        blob = value.pop(BLOB_FIELD, None)
+        now = time.time()
+        await asyncio.to_thread(
+            self._execute,
+            f"INSERT OR REPLACE INTO {self.table} (key, expires_at, accessed_at, value, blob) VALUES (?, ?, ?, ?, ?)",
+            (key, now + ttl, now, json.dumps(value, ensure_ascii=False), blob)
+        )
+
+    def _sweep(self):
+        removed = self._execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (time.time(),))
+        # Лишние записи сверх лимита - самые давно запрошенные
+        removed += self._execute(
+            f"DELETE FROM {self.table} WHERE key IN ("
+            f"SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        return removed
+
+    async def sweep(self):
+        return await asyncio.to_thread(self._sweep)
+
+    async def clear(self):
+        await asyncio.to_thread(self._execute, f"DELETE FROM {self.table}")
+
+    async def count(self):
+        rows = await asyncio.to_thread(self._execute, f"SELECT COUNT(*) FROM {self.table}", (), True)
+        return rows[0][0]
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_backend(table, max_entries, max_bytes=None):
+    """
+    Создает хранилище кэша согласно config.CACHE_BACKEND.
+    max_bytes ограничивает только память: SQLite хранит записи на диске
+    """
+    if config.CACHE_BACKEND == "sqlite":
+        logger.info(f"Using SQLite cache backend {config.CACHE_DB_PATH} ({table})")
+        return SQLiteBackend(config.CACHE_DB_PATH, table, max_entries)
+    return MemoryBackend(max_entries, max_bytes)
@@ -1,9 +1,7 @@
 # city_codes.py - словарь соответствия IATA-кодов и городов
+from collections import Counter
 
 CITY_TO_IATA = {
-    "спб": "LED",
-    "санкт-петербурга": "LED", 
-    "санкт-петербург": "LED", 
     "анадырь": "DYR",
     "сочи": "AER",
     "актау": "SCO",
@@ -322,50 +320,241 @@ CITY_TO_IATA = {
     "южно-курильск": "DEE",
 }
 
+
+# Другие написания и аэропорты: ищутся наравне с городами, но в ответе всегда
+# основное название из CITY_TO_IATA для того же кода
+ALIASES = {
+    "спб": "LED",
+    "питер": "LED",
+    "санкт-петербурга": "LED",
+    "пулково": "LED",
+    "мск": "MOW",
+    "шереметьево": "MOW",
+    "домодедово": "MOW",
+    "внуково": "MOW",
+    "жуковский": "MOW",
+}
+
+# Коды аэропортов городов с несколькими аэропортами: ищем по коду города,
+# чтобы SVO и MOW давали один и тот же город
+AIRPORT_TO_CITY = {
+    "SVO": "MOW", "DME": "MOW", "VKO": "MOW", "ZIA": "MOW",
+    "LHR": "LON", "LGW": "LON", "STN": "LON", "LTN": "LON",
+    "CDG": "PAR", "ORY": "PAR",
+    "FCO": "ROM", "CIA": "ROM",
+    "MXP": "MIL", "LIN": "MIL", "BGY": "MIL",
+    "JFK": "NYC", "LGA": "NYC",
+    "PEK": "BJS", "PKX": "BJS",
+    "PVG": "SHA",
+    "NRT": "TYO", "HND": "TYO",
+    "ICN": "SEL", "GMP": "SEL",
+    "KIX": "OSA", "ITM": "OSA",
+    "SAW": "IST",
+    "DWC": "DXB",
+    "DMK": "BKK",
+    "GYD": "BAK",
+    "ESB": "ANK",
+    "OTP": "BUH",
+    "IAD": "WAS", "DCA": "WAS",
+    "CGK": "JKT",
+    "EZE": "BUE",
+    "ARN": "STO",
+    "ORD": "CHI",
+    "GIG": "RIO",
+    "YYZ": "YTO",
+    "TFS": "TCI",
+}
+
+# Транслитерация для сравнения латиницы с кириллицей: названия и запросы
+# приводятся к одной латинской записи
+_TRANSLIT = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh",
+    "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "sch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya",
+})
+
+# Разные латинские написания одного звука (moskva/moscva, yekaterinburg/ekaterinburg,
+# jakarta/dzhakarta) сводятся к одному. Применяются и к названиям, и к запросам
+_LATIN_VARIANTS = (
+    ("dzh", "j"), ("zh", "j"), ("kh", "h"), ("yo", "e"), ("ye", "e"),
+    ("iy", "y"), ("yy", "y"), ("ck", "k"), ("c", "k"), ("w", "v"), ("x", "ks"),
+)
+
+# Минимальная похожесть по триграммам, чтобы предложить город с опечаткой
+FUZZY_THRESHOLD = 0.3
+
+
+def normalize(text):
+    """Ключ для поиска: латиница в нижнем регистре, дефисы и прочие знаки - пробелы"""
+    text = str(text or "").lower().translate(_TRANSLIT)
+    text = "".join(ch if ch.isalpha() else " " for ch in text)
+    text = " ".join(text.split())
+    for variant, replacement in _LATIN_VARIANTS:
+        text = text.replace(variant, replacement)
+    return text
+
+
+def trigrams(key):
+    """Триграммы ключа с краями слова (как в pg_trgm), чтобы короткие названия тоже сравнивались"""
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _TrieNode:
+    __slots__ = ("children", "ids")
+
+    def __init__(self):
+        self.children = {}
+        # Названия с этим префиксом, уже в порядке ранжирования
+        self.ids = []
+
+
+class CityIndex:
+    """
+    Индекс городов, строится один раз при импорте:
+    обратный словарь кодов, префиксное дерево и триграммы для поиска с опечатками.
+    Названия хранятся в латинской записи (normalize), поэтому "moskva" находит Москву.
+    """
+
+    def __init__(self, cities, aliases=None, airports=None):
+        # Основное название города для каждого кода
+        self.code_to_city = {}
+        for city, code in cities.items():
+            self.code_to_city.setdefault(code, city)
+        self.airports = dict(airports or {})
+
+        # Все написания: (ключ, код), сначала города, потом синонимы
+        entries = {}
+        for name, code in list(cities.items()) + list((aliases or {}).items()):
+            key = normalize(name)
+            if key:
+                entries.setdefault(key, code)
+        # Короткие названия выше: "рим" раньше "римини" при одинаковом префиксе
+        self.keys = sorted(entries, key=len)
+        self.codes = [entries[key] for key in self.keys]
+        self.exact = {key: i for i, key in enumerate(self.keys)}
+
+        self.trie = _TrieNode()
+        for i, key in enumerate(self.keys):
+            node = self.trie
+            for ch in key:
+                node = node.children.setdefault(ch, _TrieNode())
+                node.ids.append(i)
+
+        self.grams = [trigrams(key) for key in self.keys]
+        self.postings = {}
+        for i, grams in enumerate(self.grams):
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(i)
+
+    def resolve_code(self, code):
+        """Код города по коду города или аэропорта, иначе None"""
+        code = code.upper()
+        code = self.airports.get(code, code)
+        return code if code in self.code_to_city else None
+
+    def match_exact(self, query):
+        """(город, код) только при точном совпадении кода или названия (с учетом синонимов), иначе None"""
+        query = str(query or "").strip()
+        code = None
+        if len(query) == 3 and query.isascii() and query.isalpha():
+            code = self.resolve_code(query)
+        if code is None:
+            index = self.exact.get(normalize(query))
+            code = self.codes[index] if index is not None else None
+        return (self.code_to_city[code].capitalize(), code) if code else None
+
+    def _prefix(self, key):
+        node = self.trie
+        for ch in key:
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        return node.ids
+
+    def _substring(self, key):
+        """Названия, содержащие key: кандидаты по общим триграммам, затем проверка"""
+        inner = [key[i:i + 3] for i in range(len(key) - 2)]
+        if not inner:
+            return []
+        postings = sorted((self.postings.get(gram, ()) for gram in inner), key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        return sorted(i for i in candidates if key in self.keys[i])
+
+    def _fuzzy(self, key):
+        """[(похожесть, id)] по коэффициенту Жаккара триграмм, лучшие первыми"""
+        grams = trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        scored = []
+        for i, common in shared.items():
+            similarity = common / (len(grams) + len(self.grams[i]) - common)
+            if similarity >= FUZZY_THRESHOLD:
+                scored.append((-similarity, i))
+        scored.sort()
+        return [i for _, i in scored]
+
+    def find(self, query, max_results=5):
+        """Ранжированный список [(город, код)]: код, точное название, префикс, подстрока, опечатки"""
+        query = str(query or "").strip()
+        codes = []
+
+        # Три латинские буквы - сначала как IATA-код города или аэропорта
+        if len(query) == 3 and query.isascii() and query.isalpha():
+            code = self.resolve_code(query)
+            if code:
+                codes.append(code)
+
+        key = normalize(query)
+        if key:
+            ranked = []
+            if key in self.exact:
+                ranked.append(self.exact[key])
+            ranked.extend(self._prefix(key))
+            if len(key) >= 3:
+                ranked.extend(self._substring(key))
+                # Опечатки - только если точных совпадений не хватило
+                if len(set(self.codes[i] for i in ranked)) < max_results:
+                    ranked.extend(self._fuzzy(key))
+            codes.extend(self.codes[i] for i in ranked)
+
+        # Один результат на код: синонимы и аэропорты дают основное название города
+        results = []
+        seen = set()
+        for code in codes:
+            if code in seen:
+                continue
+            seen.add(code)
+            results.append((self.code_to_city[code].capitalize(), code))
+            if len(results) >= max_results:
+                break
+        return results
+
+
+city_index = CityIndex(CITY_TO_IATA, ALIASES, AIRPORT_TO_CITY)
+
+
 def find_city(query, max_results=5):
     """
-    Поиск города по части названия или коду IATA
-    
+    Поиск города по части названия или коду IATA (город или аэропорт).
+    Понимает латиницу ("moskva") и опечатки ("сочм").
+
     Args:
         query (str): Часть названия города или код IATA
         max_results (int): Максимальное количество результатов
-        
+
     Returns:
-        list: Список подходящих городов [(город, код), ...]
+        list: Список подходящих городов [(город, код), ...], лучшие первыми
+    """
+    return city_index.find(query, max_results)
+
+
+def exact_city(query):
+    """
+    Город только по точному названию, синониму или IATA-коду, без префиксов и опечаток.
+    Для пакетных запусков, где переспросить пользователя нельзя. Возвращает (город, код) или None
     """
-    query = query.lower()
-    matches = []
-    
-    # Если это похоже на IATA-код (3 буквы), ищем обратное соответствие
-    if len(query) == 3 and query.isalpha():
-        query_upper = query.upper()
-        
-        # 1. Сначала ищем точное совпадение
-        for city, code in CITY_TO_IATA.items():
-            if code == query_upper:
-                return [(city.capitalize(), code)]
-        
-        # 2. Если точного совпадения не найдено, ищем по первым буквам кода
-        for city, code in CITY_TO_IATA.items():
-            if code.startswith(query_upper[0]):
-                matches.append((city.capitalize(), code))
-                if len(matches) >= max_results:
-                    break
-    
-    # Иначе ищем совпадения по названию города
-    else:
-        for city, code in CITY_TO_IATA.items():
-            if query in city:
-                matches.append((city.capitalize(), code))
-                if len(matches) >= max_results:
-                    break
-    
-    # Если ничего не нашлось по названию, пробуем найти по первым буквам
-    if not matches and len(query) >= 2:
-        for city, code in CITY_TO_IATA.items():
-            if city.startswith(query):
-                matches.append((city.capitalize(), code))
-                if len(matches) >= max_results:
-                    break
-    
-    return matches
+    return city_index.match_exact(query)
@@ -1,3 +1,4 @@
+import logging
 import os
 from dotenv import load_dotenv
 
@@ -12,6 +13,18 @@ PROXY_URL = os.getenv("PROXY_URL")
 if PROXY_URL and not PROXY_URL.strip():
     PROXY_URL = None
 
+# Пул прокси: список через запятую и/или файл (по одному URL в строке)
+PROXY_URLS = os.getenv("PROXY_URLS", "")
+PROXY_LIST_FILE = os.getenv("PROXY_LIST_FILE", "")
+# Сколько неудач подряд исключают прокси и на сколько секунд
+PROXY_MAX_FAILURES = int(os.getenv("PROXY_MAX_FAILURES", "3"))
+PROXY_EVICT_SECONDS = int(os.getenv("PROXY_EVICT_SECONDS", "600"))
+# Задержка (сек), которую считаем у еще не проверенного прокси
+PROXY_DEFAULT_LATENCY = float(os.getenv("PROXY_DEFAULT_LATENCY", "5"))
+
+# Telegram ID администраторов (через запятую) для служебных команд
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x}
+
 # Стоимость 1 мили в рублях
 # Парсим безопасно, удаляя возможные комментарии (например, "1.0 # коммент")
 raw_mile_rate = os.getenv("MILE_RATE", "1.0")
@@ -21,3 +34,129 @@ MILE_RATE = float(raw_mile_rate.strip())
 
 # Headless mode for browser
 HEADLESS = os.getenv("HEADLESS", "False").lower() == "true"
+
+# Пул браузеров: сколько держать запущенными и через сколько контекстов перезапускать
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "1"))
+BROWSER_MAX_USES = int(os.getenv("BROWSER_MAX_USES", "50"))
+
+# Верхняя граница ожидания готовности страницы (выдача, модалки), мс
+READY_TIMEOUT_MS = int(os.getenv("READY_TIMEOUT_MS", "15000"))
+
+# Брать выдачу из JSON поискового API (с фолбэком на открытие модалок).
+# Выключено, пока формат ответа не сверен с записанным ответом сайта.
+# SEARCH_API_PATTERN - регулярное выражение URL этого XHR (он же сигнал готовности выдачи)
+CAPTURE_SEARCH_API = os.getenv("CAPTURE_SEARCH_API", "False").lower() == "true"
+SEARCH_API_PATTERN = os.getenv("SEARCH_API_PATTERN", r"/api/(?:[^/?#]+/)*award/search(?:[/?#]|$)")
+
+# Кэш результатов поиска: время жизни (сек, 0 - выключен) и максимум записей
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "600"))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "500"))
+# Предел памяти под кэши в памяти процесса, МБ на каждый кэш (записи со скриншотами тяжелые)
+SEARCH_CACHE_MAX_MB = int(os.getenv("SEARCH_CACHE_MAX_MB", "64"))
+
+# Хранилище кэшей: memory (по умолчанию) или sqlite (переживает перезапуск)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "cache.sqlite3")
+CACHE_SWEEP_INTERVAL = int(os.getenv("CACHE_SWEEP_INTERVAL", "300"))
+
+# Время жизни результатов проверки PNR, сек (0 - не кэшировать)
+UPGRADE_CACHE_TTL = int(os.getenv("UPGRADE_CACHE_TTL", "1800"))
+# Секрет для ключей кэша PNR (HMAC от PNR и фамилии). Пусто - выводится из BOT_TOKEN
+CACHE_KEY_SECRET = os.getenv("CACHE_KEY_SECRET", "")
+
+# Формат скриншота выдачи: png или jpeg/jpg (jpeg заметно легче для отправки)
+SCREENSHOT_FORMAT = os.getenv("SCREENSHOT_FORMAT", "png").lower()
+if SCREENSHOT_FORMAT == "jpg":
+    SCREENSHOT_FORMAT = "jpeg"
+elif SCREENSHOT_FORMAT not in ("png", "jpeg"):
+    # Playwright знает только png/jpeg, а batch_search берет формат как расширение файла
+    logging.getLogger(__name__).warning(f"Unknown SCREENSHOT_FORMAT {SCREENSHOT_FORMAT!r}, using png")
+    SCREENSHOT_FORMAT = "png"
+SCREENSHOT_QUALITY = int(os.getenv("SCREENSHOT_QUALITY", "80"))
+
+# Гибкие даты: ширина окна (±дней)
+FLEX_SEARCH_DAYS = int(os.getenv("FLEX_SEARCH_DAYS", "3"))
+
+# Сколько поисков одной задачи (гибкие даты, сегменты апгрейда) выполнять одновременно
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", "3"))
+
+# Очередь браузерных задач: сколько выполнять одновременно, лимит задач на пользователя
+# и за сколько секунд ожидания приоритет задачи растет на единицу стоимости
+SCHEDULER_CAPACITY = int(os.getenv("SCHEDULER_CAPACITY", "2"))
+SCHEDULER_MAX_JOBS_PER_USER = int(os.getenv("SCHEDULER_MAX_JOBS_PER_USER", "1"))
+SCHEDULER_AGING_SECONDS = float(os.getenv("SCHEDULER_AGING_SECONDS", "30"))
+
+# Блокировка лишних запросов в контекстах парсеров (картинки, счетчики, реклама).
+# Шрифты по умолчанию не блокируем: цены в выдаче рисуются иконочным шрифтом
+BLOCK_REQUESTS = os.getenv("BLOCK_REQUESTS", "True").lower() == "true"
+BLOCKED_RESOURCE_TYPES = [t.strip() for t in os.getenv("BLOCKED_RESOURCE_TYPES", "image,media").split(",") if t.strip()]
+
+# Дежурные страницы: сколько держать с уже загруженным приложением поиска,
+# через сколько секунд заменять их свежими и как часто проверять запас
+STANDBY_PAGES = int(os.getenv("STANDBY_PAGES", "1"))
+STANDBY_MAX_AGE = int(os.getenv("STANDBY_MAX_AGE", "300"))
+STANDBY_CHECK_INTERVAL = int(os.getenv("STANDBY_CHECK_INTERVAL", "30"))
+
+# Файл с куками и localStorage сайта (согласие с cookies, выбор страны).
+# Новые контексты загружают его, и баннеры не появляются. Пустое значение - отключить
+STORAGE_STATE_PATH = os.getenv("STORAGE_STATE_PATH", "storage_state.json")
+
+# Подписки на маршруты: файл базы, как часто проверять, не пора ли опросить,
+# и границы интервала опроса (чаще - ближе к вылету и для популярных запросов), сек
+WATCH_DB_PATH = os.getenv("WATCH_DB_PATH", "watches.sqlite3")
+WATCH_TICK_SECONDS = int(os.getenv("WATCH_TICK_SECONDS", "60"))
+WATCH_MIN_INTERVAL = int(os.getenv("WATCH_MIN_INTERVAL", "900"))
+WATCH_MAX_INTERVAL = int(os.getenv("WATCH_MAX_INTERVAL", "21600"))
+# Лимиты: подписок на пользователя и дней в одной подписке
+WATCH_MAX_PER_USER = int(os.getenv("WATCH_MAX_PER_USER", "5"))
+WATCH_MAX_RANGE_DAYS = int(os.getenv("WATCH_MAX_RANGE_DAYS", "7"))
+
+# Замеры этапов поиска (очередь, запуск браузера, навигация, модалки, скриншот, отправка).
+# TIMINGS_LOG - писать в лог строку с этапами каждого запроса
+TIMINGS_ENABLED = os.getenv("TIMINGS_ENABLED", "False").lower() == "true"
+TIMINGS_LOG = os.getenv("TIMINGS_LOG", "True").lower() == "true"
+
+# HTTP-эндпоинт метрик в формате Prometheus (/metrics). 0 - выключен.
+# Включенные метрики включают и замеры этапов (TIMINGS_ENABLED)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Выдача по ходу поиска: сначала скриншот, затем рейсы в одном обновляемом сообщении.
+# STREAM_EDIT_INTERVAL - не чаще раза в столько секунд правим сообщение (лимиты Telegram)
+STREAM_RESULTS = os.getenv("STREAM_RESULTS", "True").lower() == "true"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+
+# Параллельное чтение модалок тарифов: сколько страниц одной выдачи открывать в контексте
+# (1 - по очереди на одной странице) и с какого числа карточек это имеет смысл
+MODAL_PAGES = int(os.getenv("MODAL_PAGES", "1"))
+MODAL_PARALLEL_MIN_CARDS = int(os.getenv("MODAL_PARALLEL_MIN_CARDS", "8"))
+
+# Как получать апдейты: polling (по умолчанию) или webhook.
+# Вебхук: локальный адрес сервера, путь, публичный URL (за прокси/балансировщиком)
+# и секрет заголовка X-Telegram-Bot-Api-Secret-Token (пусто - выводится из токена)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_DROP_PENDING = os.getenv("WEBHOOK_DROP_PENDING", "False").lower() == "true"
+
+# Сколько секунд при остановке ждать начатые поиски, прежде чем закрыть браузеры
+SHUTDOWN_DRAIN_TIMEOUT = int(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "90"))
+
+# Адрес Bot API (пусто - api.telegram.org): локальный telegram-bot-api или заглушка bot_api_stub.py
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+# Состояния диалогов (шаги поиска и проверки апгрейда): sqlite - переживают перезапуск, memory - как раньше.
+# FSM_TTL - через сколько секунд без действий диалог считается брошенным и удаляется,
+# изменения пишутся в базу пачкой раз в FSM_FLUSH_INTERVAL сек (или когда их FSM_FLUSH_BATCH).
+# sqlite - только для одного экземпляра бота: файл локальный, с кэшем чтения и отложенной записью,
+# поэтому за балансировщиком (BOT_MODE=webhook) шаги диалогов разъедутся по экземплярам
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite").lower()
+FSM_DB_PATH = os.getenv("FSM_DB_PATH", "fsm.sqlite3")
+FSM_TTL = int(os.getenv("FSM_TTL", "86400"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "1000"))
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1"))
+FSM_FLUSH_BATCH = int(os.getenv("FSM_FLUSH_BATCH", "100"))
+FSM_SWEEP_INTERVAL = int(os.getenv("FSM_SWEEP_INTERVAL", "3600"))
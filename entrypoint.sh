@@ -9,7 +9,8 @@ rm -f /tmp/.X99-lock
 
 if [ "$HEADLESS" = "True" ]; then
     echo "Starting bot in HEADLESS mode..."
-    python main.py
+    # exec: SIGTERM от docker stop получает сам бот и успевает дождаться начатых поисков
+    exec python main.py
 else
     echo "Starting Xvfb manually..."
     # Запускаем Xvfb в фоне
@@ -22,8 +23,13 @@ else
     export DISPLAY=:99
     
     echo "Starting python main.py..."
-    # Запускаем python напрямую
-    python main.py
+    # Запускаем python в фоне и передаем ему SIGTERM/SIGINT, чтобы остановка была плавной
+    python main.py &
+    PY_PID=$!
+    trap 'kill -TERM $PY_PID' TERM INT
+    wait $PY_PID || true
+    # wait прерывается сигналом - ждем, пока бот завершится сам
+    wait $PY_PID || true
     
     # Если python упадет, убиваем Xvfb
     kill $XVFB_PID
@@ -0,0 +1,214 @@
+import asyncio
+import copy
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def storage_key(key):
+    """Строковый ключ записи из StorageKey aiogram"""
+    parts = (
+        key.bot_id, key.chat_id, key.user_id,
+        getattr(key, "thread_id", None) or "",
+        getattr(key, "business_connection_id", None) or "",
+        key.destiny,
+    )
+    return ":".join(str(part) for part in parts)
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Состояния диалогов (SearchStates, UpgradeStates) и их данные в SQLite (WAL),
+    чтобы перезапуск бота не сбрасывал пользователей посреди поиска.
+
+    Записи копятся в памяти и пишутся одной транзакцией раз в flush_interval сек
+    (или сразу, когда набралось flush_batch). Последние прочитанные записи лежат
+    в небольшом LRU-кэше. Состояния, не менявшиеся дольше ttl сек, считаются
+    брошенными: не читаются и периодически удаляются из базы.
+    """
+
+    def __init__(self, path=None, ttl=None, cache_size=None, flush_interval=None, flush_batch=None):
+        self.path = path or config.FSM_DB_PATH
+        self.ttl = config.FSM_TTL if ttl is None else ttl
+        self.cache_size = cache_size or config.FSM_CACHE_SIZE
+        self.flush_interval = flush_interval or config.FSM_FLUSH_INTERVAL
+        self.flush_batch = flush_batch or config.FSM_FLUSH_BATCH
+        # ключ -> (state, data, updated_at)
+        self._cache = OrderedDict()
+        self._dirty = {}
+        # Пачка, которая сейчас пишется в базу (ее уже нет в _dirty, но еще нет в базе)
+        self._writing = {}
+        self._lock = threading.Lock()
+        self._conn = None
+        self._swept_at = 0.0
+        self._flusher = None
+        self._wake = asyncio.Event()
+
+    def _connect(self):
+        """Соединение открывается при первом обращении (и заново после close)"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS fsm ("
+                "key TEXT PRIMARY KEY, "
+                "state TEXT, "
+                "data TEXT NOT NULL, "
+                "updated_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS fsm_updated_at ON fsm (updated_at)")
+            self._conn.commit()
+        return self._conn
+
+    def _is_expired(self, updated_at, now):
+        return bool(self.ttl) and updated_at < now - self.ttl
+
+    def _load(self, key):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT state, data, updated_at FROM fsm WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        state, data, updated_at = row
+        return state, json.loads(data), updated_at
+
+    def _write(self, entries):
+        """
+        Одна транзакция на пачку: пустые записи удаляются, остальные заменяются.
+        Более старое изменение не затирает более новое, даже если пачки записались не по порядку
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "DELETE FROM fsm WHERE key = ? AND updated_at <= ?",
+                [(key, updated_at) for key, (state, data, updated_at) in entries if state is None and not data]
+            )
+            conn.executemany(
+                "INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                "updated_at = excluded.updated_at WHERE excluded.updated_at >= fsm.updated_at",
+                [
+                    (key, state, json.dumps(data, ensure_ascii=False), updated_at)
+                    for key, (state, data, updated_at) in entries
+                    if state is not None or data
+                ]
+            )
+            removed = 0
+            if self.ttl and now - self._swept_at >= config.FSM_SWEEP_INTERVAL:
+                removed = conn.execute("DELETE FROM fsm WHERE updated_at < ?", (now - self.ttl,)).rowcount
+                self._swept_at = now
+            conn.commit()
+        if removed:
+            logger.info(f"FSM storage: swept {removed} abandoned conversations")
+
+    async def _entry(self, key):
+        """(state, data, updated_at) из несохраненных записей, кэша или базы"""
+        entry = self._dirty.get(key) or self._writing.get(key)
+        if entry is None:
+            entry = self._cache.get(key)
+            if entry is None:
+                entry = await asyncio.to_thread(self._load, key)
+                if entry is None:
+                    return None
+                self._remember(key, entry)
+            else:
+                self._cache.move_to_end(key)
+        if self._is_expired(entry[2], time.time()):
+            return None
+        return entry
+
+    def _remember(self, key, entry):
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _put(self, key, state, data):
+        entry = (state, data, time.time())
+        self._remember(key, entry)
+        self._dirty[key] = entry
+        if len(self._dirty) >= self.flush_batch:
+            self._wake.set()
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while self._dirty:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Записывает накопленные изменения в базу"""
+        if not self._dirty:
+            return
+        entries = list(self._dirty.items())
+        self._writing, self._dirty = self._dirty, {}
+        try:
+            await asyncio.to_thread(self._write, entries)
+        except Exception as e:
+            logger.error(f"FSM storage flush failed: {e}")
+            # Вернем в очередь то, что не перезаписано новыми изменениями
+            for key, entry in entries:
+                self._dirty.setdefault(key, entry)
+        finally:
+            self._writing = {}
+
+    async def set_state(self, key, state=None):
+        key = storage_key(key)
+        state = state.state if isinstance(state, State) else state
+        entry = await self._entry(key)
+        await self._put(key, state, entry[1] if entry else {})
+
+    async def get_state(self, key):
+        entry = await self._entry(storage_key(key))
+        return entry[0] if entry else None
+
+    async def set_data(self, key, data):
+        key = storage_key(key)
+        entry = await self._entry(key)
+        await self._put(key, entry[0] if entry else None, copy.deepcopy(dict(data)))
+
+    async def get_data(self, key):
+        entry = await self._entry(storage_key(key))
+        return copy.deepcopy(entry[1]) if entry else {}
+
+    async def close(self):
+        """
+        Сохраняет изменения и закрывает базу. Можно вызывать повторно:
+        aiogram закрывает хранилище на shutdown, а бот - еще раз после дожидания начатых апдейтов
+        """
+        if self._flusher is not None and not self._flusher.done():
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def create_fsm_storage():
+    """Хранилище состояний диалогов согласно config.FSM_STORAGE"""
+    if config.FSM_STORAGE == "sqlite":
+        logger.info(f"Using SQLite FSM storage {config.FSM_DB_PATH}")
+        return SQLiteStorage()
+    return MemoryStorage()
@@ -0,0 +1,166 @@
+import asyncio
+import contextvars
+import itertools
+import logging
+import time
+import config
+from timings import timings
+
+logger = logging.getLogger(__name__)
+
+
+class JobLimitError(Exception):
+    """У пользователя уже слишком много задач в очереди"""
+
+
+class JobCancelled(Exception):
+    """Задача отменена (пользователь начал новый поиск)"""
+
+
+class _Job:
+    def __init__(self, seq, user_id, kind, cost, factory):
+        self.seq = seq
+        self.user_id = user_id
+        self.kind = kind
+        self.cost = cost
+        self.factory = factory
+        self.enqueued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+        self.task = None
+        # Задача выполняется в контексте того, кто ее поставил (трасса замеров и т.п.)
+        self.context = contextvars.copy_context()
+
+
+class JobScheduler:
+    """
+    Очередь задач поиска/апгрейда вместо общего семафора.
+
+    - одновременно выполняется не больше capacity задач;
+    - следующей берется самая "короткая" задача (cost), а среди равных -
+      задача пользователя, которого обслуживали давнее всех;
+    - чем дольше задача ждет, тем выше ее приоритет (aging), чтобы длинные
+      задачи не голодали;
+    - у одного пользователя не больше max_jobs_per_user задач сразу.
+    """
+
+    def __init__(self, capacity=None, max_jobs_per_user=None, aging_seconds=None):
+        self.capacity = capacity or config.SCHEDULER_CAPACITY
+        self.max_jobs_per_user = max_jobs_per_user or config.SCHEDULER_MAX_JOBS_PER_USER
+        self.aging_seconds = aging_seconds or config.SCHEDULER_AGING_SECONDS
+        self._pending = []
+        self._running = set()
+        self._seq = itertools.count()
+        # Номер запуска, когда пользователя обслуживали последний раз
+        self._served = itertools.count()
+        self._last_served = {}
+
+    @property
+    def queue_depth(self):
+        return len(self._pending)
+
+    @property
+    def running(self):
+        return len(self._running)
+
+    def is_busy(self):
+        return len(self._running) >= self.capacity
+
+    def _user_jobs(self, user_id):
+        return sum(1 for job in itertools.chain(self._pending, self._running) if job.user_id == user_id)
+
+    def _priority(self, job, now):
+        # Aging целыми шагами: задачи, ждущие примерно одинаково, получают равный приоритет,
+        # и очередность между ними решает то, кого обслуживали давнее
+        aged = int((now - job.enqueued_at) // self.aging_seconds)
+        return (
+            job.cost - aged,
+            self._last_served.get(job.user_id, -1),
+            job.seq
+        )
+
+    def _ordered_pending(self):
+        now = time.monotonic()
+        return sorted(self._pending, key=lambda job: self._priority(job, now))
+
+    def position(self, job):
+        """Позиция задачи в очереди (1 - следующая на запуск), 0 - уже выполняется"""
+        if job not in self._pending:
+            return 0
+        return self._ordered_pending().index(job) + 1
+
+    def _dispatch(self):
+        while self._pending and len(self._running) < self.capacity:
+            job = self._ordered_pending()[0]
+            self._pending.remove(job)
+            self._running.add(job)
+            self._last_served[job.user_id] = next(self._served)
+            job.task = asyncio.create_task(self._execute(job), context=job.context)
+
+    async def _execute(self, job):
+        wait = time.monotonic() - job.enqueued_at
+        timings.record("queue_wait", wait)
+        logger.info(f"Starting {job.kind} job for user {job.user_id} after {wait:.1f}s in queue")
+        try:
+            result = await job.factory()
+        except asyncio.CancelledError:
+            if not job.future.done():
+                job.future.set_exception(JobCancelled())
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._running.discard(job)
+            self._dispatch()
+
+    async def run(self, user_id, factory, kind="search", cost=1, on_queued=None):
+        """
+        Ставит задачу в очередь и ждет ее результата.
+        factory - функция без аргументов, возвращающая корутину.
+        on_queued(position) вызывается, если задача не стартовала сразу.
+        Бросает JobLimitError при превышении лимита и JobCancelled при отмене.
+        """
+        if self._user_jobs(user_id) >= self.max_jobs_per_user:
+            raise JobLimitError()
+
+        job = _Job(next(self._seq), user_id, kind, cost, factory)
+        self._pending.append(job)
+        self._dispatch()
+
+        if on_queued is not None and job in self._pending:
+            try:
+                await on_queued(self.position(job))
+            except Exception as e:
+                logger.error(f"Queue notification failed: {e}")
+
+        try:
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            # Отменили ожидающего (например, остановка бота) - отменяем и саму задачу
+            self._cancel_job(job)
+            raise
+
+    def _cancel_job(self, job):
+        if job in self._pending:
+            self._pending.remove(job)
+            if not job.future.done():
+                job.future.set_exception(JobCancelled())
+                # Исключение заберет тот, кто ждет в run(), если он еще есть
+                job.future.exception()
+        elif job.task is not None and not job.task.done():
+            job.task.cancel()
+
+    def cancel_user(self, user_id):
+        """Отменяет все задачи пользователя (и ожидающие, и выполняющиеся)"""
+        jobs = [job for job in itertools.chain(self._pending, self._running) if job.user_id == user_id]
+        for job in jobs:
+            self._cancel_job(job)
+        if jobs:
+            logger.info(f"Cancelled {len(jobs)} jobs for user {user_id}")
+        return len(jobs)
+
+
+# Общий планировщик браузерных задач
+scheduler = JobScheduler()
@@ -0,0 +1,122 @@
+import logging
+from aiohttp import web
+import config
+from browser_pool import browser_pool
+from job_scheduler import scheduler
+from search_cache import search_cache, upgrade_cache
+from timings import timings
+
+logger = logging.getLogger(__name__)
+
+# Описания счетчиков для страницы /metrics
+COUNTER_HELP = {
+    "aeroflot_searches_total": "Поиски билетов по исходу (status результата get_tickets)",
+    "aeroflot_upgrade_checks_total": "Проверки апгрейда по исходу (status результата check_upgrade)",
+}
+
+
+def result_outcome(result):
+    """Исход по результату парсера: его status, иначе error"""
+    if not isinstance(result, dict):
+        return "error"
+    return str(result.get("status") or "error")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{str(value).replace(chr(34), "")}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """
+    Метрики процесса в текстовом формате Prometheus.
+    Счетчики копятся здесь, остальное (очередь, браузеры, кэш, этапы) снимается в момент запроса.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self._runner = None
+
+    def inc(self, name, value=1, **labels):
+        series = self.counters.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + value
+
+    def _gauges(self):
+        gauges = [
+            ("aeroflot_queue_depth", "Задачи, ожидающие в очереди браузера", scheduler.queue_depth, ()),
+            ("aeroflot_jobs_running", "Выполняющиеся браузерные задачи", scheduler.running, ()),
+            ("aeroflot_active_browsers", "Запущенные браузеры в пуле", browser_pool.active_browsers, ()),
+            ("aeroflot_active_contexts", "Открытые контексты браузеров", browser_pool.active_contexts, ()),
+        ]
+        for cache in (search_cache, upgrade_cache):
+            labels = (("cache", cache.name),)
+            gauges.append(("aeroflot_cache_hit_ratio", "Доля запросов, обслуженных кэшем", cache.hit_rate, labels))
+        return gauges
+
+    def render(self):
+        lines = []
+        for name, series in sorted(self.counters.items()):
+            lines.append(f"# HELP {name} {COUNTER_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+        for kind in ("hits", "misses", "coalesced"):
+            name = f"aeroflot_cache_{kind}_total"
+            lines.append(f"# TYPE {name} counter")
+            for cache in (search_cache, upgrade_cache):
+                lines.append(f"{name}{_labels((('cache', cache.name),))} {getattr(cache, kind)}")
+
+        seen = set()
+        for name, help_text, value, labels in self._gauges():
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+        # Длительности этапов (очередь, навигация, модалки, отправка...) из timings
+        name = "aeroflot_stage_seconds"
+        lines.append(f"# HELP {name} Длительность этапов поиска и проверки апгрейда")
+        lines.append(f"# TYPE {name} histogram")
+        for stage, histogram in sorted(timings.histograms.items()):
+            for bound, count in histogram.cumulative():
+                lines.append(f"{name}_bucket{_labels((('stage', stage), ('le', _number(bound))))} {count}")
+            lines.append(f"{name}_sum{_labels((('stage', stage),))} {_number(histogram.sum)}")
+            lines.append(f"{name}_count{_labels((('stage', stage),))} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    async def _handle(self, request):
+        return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self, host=None, port=None):
+        """Поднимает HTTP-сервер с /metrics (нужен включенный замер этапов для гистограмм)"""
+        host = host or config.METRICS_HOST
+        port = port or config.METRICS_PORT
+        # Без замеров не будет гистограмм очереди и этапов
+        timings.enabled = True
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Metrics endpoint on http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# Общие метрики для всего процесса
+metrics = Metrics()
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import config
+from aeroflot_api import is_search_request
+
+logger = logging.getLogger(__name__)
+
+# Признаки того, что выдача отрисована: карточки рейсов или сообщение об их отсутствии
+RESULTS_READY_SELECTOR = (
+    ".flight-search, "
+    ":text('Билетов класса Бизнес нет в наличии'), "
+    ":text('Рейсы не найдены')"
+)
+NO_TICKETS_SELECTOR = ":text('Билетов класса Бизнес нет в наличии'), :text('Рейсы не найдены')"
+MODAL_SELECTOR = ".modal__frame"
+MODAL_PRICE_SELECTOR = ".modal__frame .tariff__table-price"
+
+# Назойливые модальные окна и куки, общие для обоих парсеров
+POPUP_SELECTORS = [
+    ".notification--choice-country .button",
+    "button:has-text('Да')",
+    ".cookie-block .button",
+    "button:has-text('Понятно')",
+    "button:has-text('Принять')",
+    ".modal__close",
+    ".notification__close"
+]
+
+
+def _timeout(timeout_ms):
+    return timeout_ms if timeout_ms is not None else config.READY_TIMEOUT_MS
+
+
+async def wait_for_selector(page, selector, state="visible", timeout_ms=None):
+    """Ждет селектор, но не бросает исключение по таймауту. Возвращает True/False"""
+    try:
+        await page.wait_for_selector(selector, state=state, timeout=_timeout(timeout_ms))
+        return True
+    except Exception as e:
+        logger.debug(f"Wait for {selector} ({state}) failed: {e}")
+        return False
+
+
+class SearchRequestWatcher:
+    """
+    Следит за XHR поиска на странице: пока ответ не получен, пустая выдача -
+    это еще не отрисованная выдача, а не отсутствие рейсов.
+    Подключать до клика "Найти", чтобы не пропустить быстрый ответ.
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.pending = 0
+        # Установлено, когда хотя бы один поиск завершился и новых не идет
+        self.finished = asyncio.Event()
+        self._handlers = (
+            ("request", self._on_start),
+            ("requestfinished", self._on_done),
+            ("requestfailed", self._on_done),
+        )
+        for event, handler in self._handlers:
+            page.on(event, handler)
+
+    def _on_start(self, request):
+        if is_search_request(request):
+            self.pending += 1
+            self.finished.clear()
+
+    def _on_done(self, request):
+        if is_search_request(request):
+            self.pending = max(0, self.pending - 1)
+            if not self.pending:
+                self.finished.set()
+
+    def close(self):
+        for event, handler in self._handlers:
+            try:
+                self.page.remove_listener(event, handler)
+            except Exception:
+                pass
+
+
+async def has_no_tickets(page):
+    """На странице сообщение об отсутствии билетов"""
+    try:
+        return await page.locator(NO_TICKETS_SELECTOR).count() > 0
+    except Exception:
+        return False
+
+
+async def _is_settled(settled):
+    if settled is None or isinstance(settled, bool):
+        return bool(settled)
+    return await settled()
+
+
+async def wait_for_stable_count(page, selector, timeout_ms=None, stable_ms=600, poll_ms=200, settled=None):
+    """
+    Ждет, пока количество элементов по селектору перестанет меняться.
+    Нужен для выдачи, которая дорисовывается порциями.
+    Ноль считается окончательным, только если settled (True или async-функция) это подтверждает,
+    иначе пустой список ждем до таймаута. Возвращает последнее увиденное количество.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + _timeout(timeout_ms) / 1000
+    last_count = -1
+    stable_since = loop.time()
+
+    while True:
+        count = await page.locator(selector).count()
+        now = loop.time()
+        if count != last_count:
+            last_count = count
+            stable_since = now
+        elif (now - stable_since) * 1000 >= stable_ms and (count > 0 or await _is_settled(settled)):
+            return count
+
+        if now >= deadline:
+            logger.debug(f"Count of {selector} did not stabilise, last value {count}")
+            return count
+        await asyncio.sleep(poll_ms / 1000)
+
+
+async def wait_for_results(page, timeout_ms=None, search=None):
+    """
+    Ждет появления выдачи (или сообщения 'нет билетов') и стабилизации списка карточек.
+    search (SearchRequestWatcher) - полученный ответ XHR поиска тоже считается сигналом готовности.
+    Возвращает количество карточек или None, если выдача так и не загрузилась (таймаут):
+    пустую выдачу без ответа поиска и без сообщения 'нет билетов' нельзя считать окончательной.
+    """
+    ready = asyncio.create_task(wait_for_selector(page, RESULTS_READY_SELECTOR, timeout_ms=timeout_ms))
+    waiters = {ready}
+    if search is not None:
+        waiters.add(asyncio.create_task(search.finished.wait()))
+    try:
+        await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+
+    search_done = search is not None and search.finished.is_set()
+    if not (ready.done() and not ready.cancelled() and ready.result()) and not search_done:
+        return None
+    # Сообщение "нет билетов" - выдача окончательна, ждать нечего
+    if await has_no_tickets(page):
+        return 0
+
+    async def settled():
+        return (search is not None and search.finished.is_set()) or await has_no_tickets(page)
+
+    count = await wait_for_stable_count(page, ".flight-search", timeout_ms=timeout_ms, settled=settled)
+    if not count and not await settled():
+        return None
+    return count
+
+
+async def wait_for_modal(page, timeout_ms=None):
+    """Ждет открытия модалки рейса с уже подгруженной таблицей тарифов"""
+    return await wait_for_selector(page, MODAL_PRICE_SELECTOR, state="attached", timeout_ms=timeout_ms)
+
+
+async def wait_for_modal_closed(page, timeout_ms=None):
+    return await wait_for_selector(page, MODAL_SELECTOR, state="hidden", timeout_ms=timeout_ms)
+
+
+async def wait_hidden(target, timeout_ms=None):
+    """Ждет скрытия элемента (ElementHandle или Locator) после клика по нему"""
+    try:
+        if hasattr(target, "wait_for_element_state"):
+            await target.wait_for_element_state("hidden", timeout=_timeout(timeout_ms))
+        else:
+            await target.wait_for(state="hidden", timeout=_timeout(timeout_ms))
+        return True
+    except Exception:
+        return False
+
+
+async def close_popups(page, selectors=POPUP_SELECTORS, timeout_ms=2000):
+    """
+    Закрывает видимые попапы по списку селекторов.
+    После клика ждем исчезновения элемента, а не фиксированную паузу.
+    Возвращает число закрытых попапов.
+    """
+    closed = 0
+    for selector in selectors:
+        try:
+            elements = await page.query_selector_all(selector)
+            for el in elements:
+                if await el.is_visible():
+                    logger.info(f"Closing popup: {selector}")
+                    await el.click(timeout=1000)
+                    await wait_hidden(el, timeout_ms=timeout_ms)
+                    closed += 1
+        except Exception:
+            pass
+    return closed
+
+
+async def has_visible_popup(page, selectors=POPUP_SELECTORS):
+    """Один запрос к странице: виден ли хотя бы один попап из списка"""
+    combined = ", ".join(f"{selector}:visible" for selector in selectors)
+    try:
+        return await page.locator(combined).count() > 0
+    except Exception as e:
+        logger.debug(f"Popup detection failed: {e}")
+        # Не смогли проверить - пусть отработает полный обход
+        return True
+
+
+async def close_popups_if_present(page, selectors=POPUP_SELECTORS, timeout_ms=2000):
+    """Дешевая проверка перед close_popups: обходим селекторы, только если попап виден"""
+    if not await has_visible_popup(page, selectors):
+        return 0
+    return await close_popups(page, selectors, timeout_ms)
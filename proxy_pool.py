@@ -0,0 +1,166 @@
+import logging
+import os
+import time
+from urllib.parse import urlsplit
+import config
+
+logger = logging.getLogger(__name__)
+
+# Исходы использования прокси, которые сообщают парсеры
+OUTCOME_OK = "ok"
+OUTCOME_TIMEOUT = "timeout"
+OUTCOME_BLOCKED = "blocked"
+OUTCOME_ERROR = "error"
+
+
+def load_proxy_urls():
+    """Список прокси из PROXY_URLS, файла PROXY_LIST_FILE и старого PROXY_URL"""
+    urls = []
+    if config.PROXY_URLS:
+        urls.extend(u.strip() for u in config.PROXY_URLS.split(","))
+    if config.PROXY_LIST_FILE and os.path.exists(config.PROXY_LIST_FILE):
+        with open(config.PROXY_LIST_FILE, encoding="utf-8") as f:
+            urls.extend(line.strip() for line in f if not line.strip().startswith("#"))
+    if config.PROXY_URL:
+        urls.append(config.PROXY_URL.strip())
+
+    valid = []
+    for url in urls:
+        if url and (url.startswith("http") or url.startswith("socks")) and url not in valid:
+            valid.append(url)
+    return valid
+
+
+def to_playwright_proxy(url):
+    """Преобразует URL прокси (с логином/паролем) в настройки Playwright"""
+    parts = urlsplit(url)
+    server = f"{parts.scheme}://{parts.hostname}"
+    if parts.port:
+        server += f":{parts.port}"
+    settings = {"server": server}
+    if parts.username:
+        settings["username"] = parts.username
+        settings["password"] = parts.password or ""
+    return settings
+
+
+class ProxyState:
+    """Здоровье одного прокси"""
+
+    def __init__(self, url):
+        self.url = url
+        self.uses = 0
+        self.active = 0
+        self.outcomes = {OUTCOME_OK: 0, OUTCOME_TIMEOUT: 0, OUTCOME_BLOCKED: 0, OUTCOME_ERROR: 0}
+        self.latency = None
+        self.consecutive_failures = 0
+        self.evicted_until = 0.0
+
+    @property
+    def label(self):
+        # Без логина и пароля - для логов и админской команды
+        parts = urlsplit(self.url)
+        return f"{parts.scheme}://{parts.hostname}:{parts.port}" if parts.port else f"{parts.scheme}://{parts.hostname}"
+
+    @property
+    def failure_rate(self):
+        total = sum(self.outcomes.values())
+        return (total - self.outcomes[OUTCOME_OK]) / total if total else 0.0
+
+    def is_healthy(self, now):
+        return self.evicted_until <= now
+
+    def score(self):
+        """Чем меньше, тем лучше: задержка с поправкой на долю неудач и текущую загрузку"""
+        latency = self.latency if self.latency is not None else config.PROXY_DEFAULT_LATENCY
+        return latency * (1 + 2 * self.failure_rate) * (1 + self.active)
+
+
+class ProxyLease:
+    """Выданный контексту прокси: парсер сообщает задержку и исход"""
+
+    def __init__(self, state):
+        self.state = state
+        self.latency = None
+        self.outcome = OUTCOME_OK
+
+    @property
+    def settings(self):
+        return to_playwright_proxy(self.state.url)
+
+
+class ProxyPool:
+    """
+    Набор прокси с оценкой здоровья.
+
+    Для каждого контекста выбирается самый быстрый здоровый прокси.
+    После PROXY_MAX_FAILURES неудач подряд (таймаут, страница блокировки, ошибка)
+    прокси исключается на PROXY_EVICT_SECONDS.
+    """
+
+    def __init__(self, urls=None):
+        urls = load_proxy_urls() if urls is None else urls
+        self._states = [ProxyState(url) for url in urls]
+        if self._states:
+            logger.info(f"Proxy pool loaded with {len(self._states)} proxies")
+
+    @property
+    def enabled(self):
+        return bool(self._states)
+
+    def acquire(self):
+        """Выдает прокси для нового контекста (или None, если прокси не настроены)"""
+        if not self._states:
+            return None
+        now = time.time()
+        healthy = [s for s in self._states if s.is_healthy(now)]
+        if healthy:
+            state = min(healthy, key=lambda s: s.score())
+        else:
+            # Все исключены - берем тот, что вернется раньше остальных
+            state = min(self._states, key=lambda s: s.evicted_until)
+            logger.warning(f"All proxies are evicted, using {state.label}")
+        state.uses += 1
+        state.active += 1
+        return ProxyLease(state)
+
+    def release(self, lease):
+        state = lease.state
+        state.active -= 1
+        state.outcomes[lease.outcome] += 1
+
+        if lease.latency is not None:
+            # Экспоненциальное сглаживание задержки
+            if state.latency is None:
+                state.latency = lease.latency
+            else:
+                state.latency = 0.7 * state.latency + 0.3 * lease.latency
+
+        if lease.outcome == OUTCOME_OK:
+            state.consecutive_failures = 0
+            return
+
+        state.consecutive_failures += 1
+        logger.warning(f"Proxy {state.label}: {lease.outcome} ({state.consecutive_failures} in a row)")
+        if state.consecutive_failures >= config.PROXY_MAX_FAILURES:
+            state.evicted_until = time.time() + config.PROXY_EVICT_SECONDS
+            state.consecutive_failures = 0
+            logger.warning(f"Proxy {state.label} evicted for {config.PROXY_EVICT_SECONDS}s")
+
+    def stats(self):
+        now = time.time()
+        result = []
+        for state in sorted(self._states, key=lambda s: s.score()):
+            result.append({
+                "proxy": state.label,
+                "uses": state.uses,
+                "active": state.active,
+                "latency": round(state.latency, 2) if state.latency is not None else None,
+                "outcomes": dict(state.outcomes),
+                "evicted_for": max(0, int(state.evicted_until - now)),
+            })
+        return result
+
+
+# Общий пул прокси для всего процесса
+proxy_pool = ProxyPool()
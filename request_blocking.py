@@ -0,0 +1,103 @@
+import logging
+from collections import Counter
+from urllib.parse import urlsplit
+import config
+
+logger = logging.getLogger(__name__)
+
+# Счетчики и трекеры, без которых выдача и страница PNR работают
+ANALYTICS_HOSTS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "googleadservices.com",
+    "mc.yandex.ru",
+    "yandex.ru/metrika",
+    "top-fwz1.mail.ru",
+    "ad.mail.ru",
+    "vk.com/rtrg",
+    "connect.facebook.net",
+    "criteo.com",
+    "criteo.net",
+    "adriver.ru",
+    "hotjar.com",
+    "flocktory.com",
+    "mindbox.ru",
+)
+
+
+class RequestStats:
+    """Статистика запросов одного контекста: что заблокировано и сколько скачано"""
+
+    def __init__(self):
+        self.blocked = Counter()
+        self.allowed = 0
+        self.loaded_bytes = 0
+
+    def on_response(self, response):
+        try:
+            self.loaded_bytes += int(response.headers.get("content-length", 0))
+        except (TypeError, ValueError):
+            pass
+
+    def summary(self):
+        blocked_total = sum(self.blocked.values())
+        details = ", ".join(f"{kind}={count}" for kind, count in self.blocked.most_common())
+        return (
+            f"blocked {blocked_total} requests ({details or 'none'}), "
+            f"allowed {self.allowed}, downloaded {self.loaded_bytes / 1024:.0f} KB"
+        )
+
+
+class RequestBlocker:
+    """
+    Политика маршрутизации запросов для контекстов парсеров.
+    Обрывает ненужные типы ресурсов (картинки, медиа, по желанию шрифты)
+    и запросы к счетчикам и рекламе.
+    """
+
+    def __init__(self, blocked_types=None, blocked_hosts=None):
+        self.blocked_types = set(blocked_types if blocked_types is not None else config.BLOCKED_RESOURCE_TYPES)
+        self.blocked_hosts = tuple(blocked_hosts if blocked_hosts is not None else ANALYTICS_HOSTS)
+        # "yandex.ru/metrika" -> ("yandex.ru", "/metrika"): домен и, если есть, префикс пути
+        self._rules = tuple(self._split_rule(host) for host in self.blocked_hosts)
+
+    @staticmethod
+    def _split_rule(host):
+        domain, slash, path = host.lower().partition("/")
+        return domain, slash + path
+
+    def _is_blocked_host(self, url):
+        """Домен совпадает целиком или это его поддомен: ad.mail.ru не задевает load.mail.ru"""
+        parts = urlsplit(url)
+        hostname = (parts.hostname or "").lower()
+        for domain, path in self._rules:
+            if hostname != domain and not hostname.endswith("." + domain):
+                continue
+            if not path or parts.path == path or parts.path.startswith(path.rstrip("/") + "/"):
+                return True
+        return False
+
+    def _block_reason(self, request):
+        if request.resource_type in self.blocked_types:
+            return request.resource_type
+        if self._is_blocked_host(request.url):
+            return "analytics"
+        return None
+
+    async def attach(self, context):
+        """Вешает политику на контекст и возвращает объект со статистикой"""
+        stats = RequestStats()
+
+        async def handle_route(route):
+            reason = self._block_reason(route.request)
+            if reason:
+                stats.blocked[reason] += 1
+                await route.abort()
+            else:
+                stats.allowed += 1
+                await route.continue_()
+
+        await context.route("**/*", handle_route)
+        context.on("response", stats.on_response)
+        return stats
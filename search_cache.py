@@ -0,0 +1,225 @@
+import asyncio
+import copy
+import hashlib
+import hmac
+import logging
+import config
+from cache_backends import create_backend
+
+logger = logging.getLogger(__name__)
+
+# Кэшируем только осмысленные ответы, ошибки и таймауты всегда перезапрашиваем
+CACHEABLE_STATUSES = ("success", "no_tickets", "not_found")
+
+
+def _pnr_key_secret():
+    secret = config.CACHE_KEY_SECRET or f"pnr-cache:{config.BOT_TOKEN or ''}"
+    return secret.encode("utf-8")
+
+
+class SearchCache:
+    """
+    TTL-кэш результатов парсеров поверх сменного хранилища (память или SQLite).
+
+    Одинаковые запросы, запущенные одновременно, объединяются:
+    браузер запускается один раз, остальные ждут его результата.
+    """
+
+    def __init__(self, backend, ttl, name="search"):
+        self.backend = backend
+        self.ttl = ttl
+        self.name = name
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(origin_code, destination_code, date_str, direct_only):
+        return f"{origin_code.upper()}|{destination_code.upper()}|{date_str}|{int(bool(direct_only))}"
+
+    @staticmethod
+    def make_pnr_key(pnr_code, last_name):
+        # PNR и фамилию не храним в открытом виде. Простой sha256 перебирается по словарю
+        # фамилий и 6-символьных кодов, поэтому ключ - HMAC с секретом, которого нет в базе
+        raw = f"{pnr_code.upper()}|{last_name.upper()}"
+        return hmac.new(_pnr_key_secret(), raw.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    async def get(self, key):
+        try:
+            value = await self.backend.get(key)
+        except Exception as e:
+            logger.error(f"Cache {self.name} read failed: {e}")
+            return None
+        return copy.deepcopy(value) if value is not None else None
+
+    async def set(self, key, result):
+        if result.get("status") not in CACHEABLE_STATUSES:
+            return
+        try:
+            await self.backend.set(key, copy.deepcopy(result), self.ttl)
+        except Exception as e:
+            logger.error(f"Cache {self.name} write failed: {e}")
+
+    async def clear(self):
+        await self.backend.clear()
+
+    async def _cached_or_joined(self, key):
+        """
+        Результат из кэша или уже идущего запроса с тем же ключом.
+        None - ни того, ни другого: запрос выполняет вызывающий
+        """
+        while True:
+            cached = await self.get(key)
+            if cached is not None:
+                self.hits += 1
+                logger.info(f"Cache {self.name} hit {key} ({self.hit_rate:.0%} hit rate)")
+                return cached
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+
+            self.coalesced += 1
+            logger.info(f"Cache {self.name}: {key} is already running, waiting for its result")
+            try:
+                result = await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # Отменили запрос-владелец, а не нас - выполняем поиск сами
+                if inflight.cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+            return copy.deepcopy(result)
+
+        self.misses += 1
+        logger.info(f"Cache {self.name} miss {key} ({self.hit_rate:.0%} hit rate)")
+        return None
+
+    def _start(self, key):
+        """Регистрирует запрос-владелец: одинаковые запросы будут ждать этот future"""
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        return future
+
+    @staticmethod
+    def _fail(future, error):
+        future.set_exception(error)
+        # Исключение уже доставлено ожидающим, не даем asyncio ругаться на него
+        future.exception()
+
+    async def get_or_run(self, key, factory):
+        """Возвращает результат из кэша, иначе выполняет factory() (один раз на ключ)"""
+        if not self.enabled:
+            return await factory()
+
+        result = await self._cached_or_joined(key)
+        if result is not None:
+            return result
+
+        future = self._start(key)
+        try:
+            result = await factory()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            self._fail(future, e)
+            raise
+        else:
+            await self.set(key, result)
+            future.set_result(result)
+            return copy.deepcopy(result)
+        finally:
+            self._inflight.pop(key, None)
+
+    async def stream_or_join(self, key, stream, replay):
+        """
+        Потоковый вариант get_or_run. stream() - асинхронный генератор событий,
+        последнее из которых {"type": "result", "result": ...}.
+        Первый запрос отдает события по ходу поиска, одинаковые запросы в это время
+        ждут его результат, а результат из кэша или чужого запроса отдается через replay(result)
+        """
+        if not self.enabled:
+            async for event in stream():
+                yield event
+            return
+
+        result = await self._cached_or_joined(key)
+        if result is not None:
+            for event in replay(result):
+                yield event
+            return
+
+        future = self._start(key)
+        events = stream()
+        try:
+            async for event in events:
+                if event["type"] == "result" and not future.done():
+                    await self.set(key, event["result"])
+                    future.set_result(event["result"])
+                yield event
+            if not future.done():
+                self._fail(future, RuntimeError("Search stream ended without a result"))
+        except Exception as e:
+            if not future.done():
+                self._fail(future, e)
+            raise
+        except BaseException:
+            # Отмена или закрытый потребителем генератор: ожидающие выполнят поиск сами
+            if not future.done():
+                future.cancel()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+            # Закрываем поиск сразу (освобождает страницу), а не при сборке мусора
+            await events.aclose()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses + self.coalesced
+        return (self.hits + self.coalesced) / total if total else 0.0
+
+    async def stats(self):
+        return {
+            "entries": await self.backend.count(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round(self.hit_rate, 3),
+        }
+
+
+# Общие кэши для всего процесса: выдача поиска и результаты проверки PNR
+search_cache = SearchCache(
+    create_backend("search_results", config.SEARCH_CACHE_MAX_ENTRIES, config.SEARCH_CACHE_MAX_MB * 1024 * 1024),
+    ttl=config.SEARCH_CACHE_TTL,
+    name="search"
+)
+upgrade_cache = SearchCache(
+    create_backend("pnr_results", config.SEARCH_CACHE_MAX_ENTRIES, config.SEARCH_CACHE_MAX_MB * 1024 * 1024),
+    ttl=config.UPGRADE_CACHE_TTL,
+    name="upgrade"
+)
+
+
+async def sweep_caches_forever(interval=None):
+    """Фоновая очистка просроченных записей во всех кэшах"""
+    interval = interval or config.CACHE_SWEEP_INTERVAL
+    while True:
+        await asyncio.sleep(interval)
+        for cache in (search_cache, upgrade_cache):
+            try:
+                removed = await cache.backend.sweep()
+                if removed:
+                    logger.info(f"Cache {cache.name}: swept {removed} expired entries")
+            except Exception as e:
+                logger.error(f"Cache {cache.name} sweep failed: {e}")
+
+
+async def close_caches():
+    for cache in (search_cache, upgrade_cache):
+        await cache.backend.close()
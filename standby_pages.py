@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+import config
+from browser_pool import browser_pool
+import storage_state
+
+logger = logging.getLogger(__name__)
+
+# Страница приложения поиска, которую держим открытой в дежурных страницах
+SEARCH_APP_URL = "https://www.aeroflot.ru/sb/app/ru-ru#/search"
+
+
+class StandbyPages:
+    """
+    Небольшой запас "прогретых" страниц: SPA уже загружено, попапы закрыты.
+
+    Поиску остается только сменить hash-маршрут вместо полного goto.
+    Страница используется один раз и выбрасывается, запас пополняется в фоне;
+    страницы старше max_age заменяются свежими.
+    """
+
+    def __init__(self, url=SEARCH_APP_URL, size=None, max_age=None, pool=browser_pool):
+        self.url = url
+        self.size = config.STANDBY_PAGES if size is None else size
+        self.max_age = max_age or config.STANDBY_MAX_AGE
+        self.pool = pool
+        self._ready = []
+        self._creating = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        # Фоновые закрытия устаревших страниц (ссылки держим, чтобы задачи не собрал GC)
+        self._closing = set()
+
+    @property
+    def ready_count(self):
+        return len(self._ready)
+
+    def start(self):
+        if self.size > 0 and self._task is None:
+            self._task = asyncio.create_task(self._maintain())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        ready, self._ready = self._ready, []
+        for handle in ready:
+            await self.pool.close_context(handle)
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+
+    async def _prepare(self, page):
+        """Загружает SPA и закрывает попапы, пока страница никому не нужна"""
+        started = time.monotonic()
+        response = await page.goto(self.url, wait_until="networkidle", timeout=60000)
+        self.pool.report_navigation(page.context, time.monotonic() - started, response)
+        await storage_state.close_popups(page)
+
+    async def _create(self):
+        self._creating += 1
+        handle = None
+        try:
+            handle = await self.pool.open_context()
+            handle.page = await handle.context.new_page()
+            await self._prepare(handle.page)
+            handle.created_at = time.monotonic()
+            self._ready.append(handle)
+            logger.info(f"Standby page ready ({len(self._ready)}/{self.size})")
+        except Exception as e:
+            logger.warning(f"Could not prepare standby page: {e}")
+            if handle is not None:
+                await self.pool.close_context(handle)
+        finally:
+            self._creating -= 1
+
+    async def _discard_stale(self):
+        now = time.monotonic()
+        for handle in list(self._ready):
+            if now - handle.created_at > self.max_age or handle.page.is_closed():
+                self._ready.remove(handle)
+                await self.pool.close_context(handle)
+
+    async def _maintain(self):
+        while True:
+            try:
+                await self._discard_stale()
+                missing = self.size - len(self._ready) - self._creating
+                if missing > 0:
+                    await asyncio.gather(*(self._create() for _ in range(missing)))
+            except Exception as e:
+                logger.error(f"Standby pages maintenance failed: {e}")
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=config.STANDBY_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def _take(self):
+        now = time.monotonic()
+        while self._ready:
+            handle = self._ready.pop()
+            if now - handle.created_at <= self.max_age and not handle.page.is_closed():
+                return handle
+            # Устаревшую страницу закроет фоновая задача
+            task = asyncio.create_task(self.pool.close_context(handle))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+        return None
+
+    @asynccontextmanager
+    async def page(self):
+        """
+        Выдает (page, warm): прогретую дежурную страницу, если она есть,
+        иначе новую пустую. После использования контекст закрывается.
+        """
+        handle = self._take()
+        warm = handle is not None
+        if handle is None:
+            handle = await self.pool.open_context()
+            try:
+                handle.page = await handle.context.new_page()
+            except BaseException:
+                await self.pool.close_context(handle)
+                raise
+        else:
+            logger.info("Using warm standby page")
+
+        try:
+            yield handle.page, warm
+        except Exception as e:
+            self.pool.report_error(handle.context, e)
+            raise
+        finally:
+            await self.pool.close_context(handle)
+            # Запас уменьшился - просим фоновую задачу его пополнить
+            self._wakeup.set()
+
+
+# Общий запас дежурных страниц для всего процесса
+standby_pages = StandbyPages()
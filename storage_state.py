@@ -0,0 +1,85 @@
+import asyncio
+import json
+import logging
+import os
+import config
+import page_waits
+
+logger = logging.getLogger(__name__)
+
+
+class StorageStateStore:
+    """
+    Куки и localStorage сайта (согласие с cookies, выбранная страна), сохраненные на диск.
+
+    Новые контексты создаются уже с этим состоянием, поэтому баннеры не появляются,
+    а закрытие попапов остается запасным вариантом на случай, если баннер все же показан.
+    """
+
+    def __init__(self, path=None):
+        self.path = config.STORAGE_STATE_PATH if path is None else path
+        self._state = None
+        self._loaded = False
+        self._lock = asyncio.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    @property
+    def state(self):
+        """Состояние для new_context(storage_state=...) или None"""
+        if self.enabled and not self._loaded:
+            self._loaded = True
+            self._state = self._read()
+        return self._state
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+            logger.info(f"Loaded storage state from {self.path}")
+            return state
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read storage state {self.path}: {e}")
+            return None
+
+    def _write(self, state):
+        # Пишем во временный файл и подменяем, чтобы не оставить половину JSON
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    async def save(self, context):
+        """Снимает состояние с контекста и сохраняет его для следующих контекстов"""
+        if not self.enabled:
+            return
+        async with self._lock:
+            try:
+                state = await context.storage_state()
+                await asyncio.to_thread(self._write, state)
+            except Exception as e:
+                logger.warning(f"Could not save storage state: {e}")
+                return
+            self._state = state
+            self._loaded = True
+            logger.info(f"Storage state saved to {self.path}")
+
+
+# Общее состояние для всех контекстов процесса
+storage_state = StorageStateStore()
+
+
+async def close_popups(page):
+    """
+    Закрывает попапы, только если они действительно видны.
+    Если пришлось закрывать баннеры (или состояния еще нет) - запоминаем куки,
+    чтобы следующие контексты обходились без них.
+    """
+    closed = await page_waits.close_popups_if_present(page)
+    if closed or (storage_state.enabled and storage_state.state is None):
+        await storage_state.save(page.context)
+    return closed
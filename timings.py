@@ -0,0 +1,161 @@
+import bisect
+import contextvars
+import json
+import logging
+import time
+import config
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм, сек: от клика по модалке до целого поиска
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120)
+
+# Трасса текущего запроса (наследуется задачами asyncio вместе с контекстом)
+_current_trace = contextvars.ContextVar("timings_trace", default=None)
+
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными корзинами"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # Последняя корзина - все, что больше верхней границы
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def cumulative(self):
+        """[(верхняя граница, сколько наблюдений не больше нее)], последняя граница - inf"""
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q):
+        """Оценка квантиля по корзинам (линейная интерполяция внутри корзины)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        lower = 0.0
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            if seen + count >= rank and count:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.buckets[-1]
+
+
+class _NoopSpan:
+    """Заглушка, когда замеры выключены: ничего не считает"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("registry", "name", "started")
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.record(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class Trace:
+    """Замеры этапов одного запроса (поиск, проверка PNR), по выходу пишутся в лог одной строкой"""
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.stages = {}
+        self._token = None
+
+    def add(self, stage, seconds):
+        count, total = self.stages.get(stage, (0, 0.0))
+        self.stages[stage] = (count + 1, total + seconds)
+
+    def summary(self, total):
+        stages = {}
+        for stage, (count, seconds) in self.stages.items():
+            stages[stage] = {"seconds": round(seconds, 3), "count": count} if count > 1 else round(seconds, 3)
+        return {"trace": self.name, **self.labels, "total": round(total, 3), "stages": stages}
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self._token = _current_trace.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_trace.reset(self._token)
+        total = time.perf_counter() - self.started
+        self.registry.record(self.name, total)
+        if config.TIMINGS_LOG:
+            logger.info(f"timings {json.dumps(self.summary(total), ensure_ascii=False)}")
+        return False
+
+
+class Timings:
+    """
+    Замеры этапов конвейера: span("этап") вокруг кода, record() для готовых длительностей.
+    Каждое значение идет в гистограмму этапа и в трассу текущего запроса.
+    Выключенные замеры (TIMINGS_ENABLED=False) стоят одну проверку флага.
+    """
+
+    def __init__(self, enabled=None):
+        self.enabled = config.TIMINGS_ENABLED if enabled is None else enabled
+        self.histograms = {}
+
+    def span(self, name):
+        return _Span(self, name) if self.enabled else NOOP
+
+    def trace(self, name, **labels):
+        return Trace(self, name, labels) if self.enabled else NOOP
+
+    def record(self, name, seconds):
+        if not self.enabled:
+            return
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, seconds)
+
+    def snapshot(self):
+        """{этап: {count, avg, p50, p95}} по всем гистограммам"""
+        result = {}
+        for name, histogram in sorted(self.histograms.items()):
+            result[name] = {
+                "count": histogram.count,
+                "avg": round(histogram.sum / histogram.count, 3) if histogram.count else None,
+                "p50": round(histogram.quantile(0.5), 3) if histogram.count else None,
+                "p95": round(histogram.quantile(0.95), 3) if histogram.count else None,
+            }
+        return result
+
+
+# Общие замеры для всего процесса
+timings = Timings()
@@ -0,0 +1,308 @@
+import asyncio
+import json
+import logging
+import math
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+import config
+from aeroflot_parser import AeroflotParser
+from job_scheduler import scheduler, JobCancelled
+
+logger = logging.getLogger(__name__)
+
+# Под этим "пользователем" задачи мониторинга стоят в общей очереди браузера
+WATCH_JOB_USER = "watchlist"
+
+# Дальше этого горизонта (дней до вылета) интервал опроса уже не растет
+WATCH_HORIZON_DAYS = 60
+
+
+class Watch:
+    """Подписка пользователя на маршрут и дату (или диапазон дат)"""
+
+    def __init__(self, id, user_id, origin, destination, date_from, date_to,
+                 direct_only=False, max_miles=None, created_at=None):
+        self.id = id
+        self.user_id = user_id
+        self.origin = origin
+        self.destination = destination
+        self.date_from = date_from
+        self.date_to = date_to
+        self.direct_only = bool(direct_only)
+        self.max_miles = max_miles
+        self.created_at = created_at or time.time()
+
+    def dates(self, today=None):
+        """Даты подписки (ДД.ММ.ГГГГ), которые еще не прошли"""
+        today = today or datetime.now().date()
+        start = max(datetime.strptime(self.date_from, "%d.%m.%Y").date(), today)
+        end = datetime.strptime(self.date_to, "%d.%m.%Y").date()
+        return [(start + timedelta(days=i)).strftime("%d.%m.%Y") for i in range((end - start).days + 1)]
+
+    def is_expired(self, today=None):
+        return not self.dates(today)
+
+    def query(self, date_str):
+        """Ключ поиска: одинаковые подписки разных пользователей ищутся один раз"""
+        return (self.origin, self.destination, date_str, self.direct_only)
+
+    def accepts(self, flight):
+        if self.max_miles is None:
+            return True
+        return bool(flight.get("miles")) and flight["miles"] <= self.max_miles
+
+
+class WatchStore:
+    """
+    Подписки и последние отправленные пользователю результаты в SQLite (WAL).
+    Запросы выполняются в отдельном потоке, чтобы не блокировать event loop.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.WATCH_DB_PATH
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS watches ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "user_id INTEGER NOT NULL, "
+                "origin TEXT NOT NULL, "
+                "destination TEXT NOT NULL, "
+                "date_from TEXT NOT NULL, "
+                "date_to TEXT NOT NULL, "
+                "direct_only INTEGER NOT NULL, "
+                "max_miles INTEGER, "
+                "created_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS watches_user_id ON watches (user_id)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS watch_snapshots ("
+                "watch_id INTEGER NOT NULL, "
+                "date TEXT NOT NULL, "
+                "flights TEXT NOT NULL, "
+                "updated_at REAL NOT NULL, "
+                "PRIMARY KEY (watch_id, date))"
+            )
+            self._conn.commit()
+
+    def _execute(self, sql, params=(), fetch=False):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            if fetch:
+                result = cursor.fetchall()
+            elif sql.lstrip().upper().startswith("INSERT"):
+                result = cursor.lastrowid
+            else:
+                result = cursor.rowcount
+            self._conn.commit()
+            return result
+
+    @staticmethod
+    def _to_watch(row):
+        return Watch(*row)
+
+    async def add(self, watch):
+        watch.id = await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO watches (user_id, origin, destination, date_from, date_to, direct_only, max_miles, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (watch.user_id, watch.origin, watch.destination, watch.date_from, watch.date_to,
+             int(watch.direct_only), watch.max_miles, watch.created_at)
+        )
+        return watch
+
+    async def remove(self, watch_id, user_id=None):
+        """Удаляет подписку (только свою, если указан user_id). Возвращает True, если удалили"""
+        sql = "DELETE FROM watches WHERE id = ?"
+        params = (watch_id,)
+        if user_id is not None:
+            sql += " AND user_id = ?"
+            params = (watch_id, user_id)
+        removed = await asyncio.to_thread(self._execute, sql, params)
+        if removed:
+            await asyncio.to_thread(self._execute, "DELETE FROM watch_snapshots WHERE watch_id = ?", (watch_id,))
+        return bool(removed)
+
+    async def for_user(self, user_id):
+        rows = await asyncio.to_thread(
+            self._execute, "SELECT * FROM watches WHERE user_id = ? ORDER BY id", (user_id,), True
+        )
+        return [self._to_watch(row) for row in rows]
+
+    async def all(self):
+        rows = await asyncio.to_thread(self._execute, "SELECT * FROM watches ORDER BY id", (), True)
+        return [self._to_watch(row) for row in rows]
+
+    async def get_snapshot(self, watch_id, date_str):
+        rows = await asyncio.to_thread(
+            self._execute,
+            "SELECT flights FROM watch_snapshots WHERE watch_id = ? AND date = ?",
+            (watch_id, date_str),
+            True
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    async def set_snapshot(self, watch_id, date_str, flights):
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT OR REPLACE INTO watch_snapshots (watch_id, date, flights, updated_at) VALUES (?, ?, ?, ?)",
+            (watch_id, date_str, json.dumps(flights, ensure_ascii=False), time.time())
+        )
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def poll_interval(date_str, subscribers, today=None):
+    """
+    Интервал опроса запроса, сек.
+    Ближе к вылету места меняются чаще - опрашиваем чаще; популярные запросы тоже.
+    """
+    today = today or datetime.now().date()
+    days_left = (datetime.strptime(date_str, "%d.%m.%Y").date() - today).days
+    horizon = min(max(days_left, 0), WATCH_HORIZON_DAYS) / WATCH_HORIZON_DAYS
+    base = config.WATCH_MIN_INTERVAL + (config.WATCH_MAX_INTERVAL - config.WATCH_MIN_INTERVAL) * horizon
+    return max(config.WATCH_MIN_INTERVAL, base / math.sqrt(max(subscribers, 1)))
+
+
+def flights_snapshot(result, direct_only):
+    """Рейсы из результата get_tickets в виде {ключ рейса: рейс}"""
+    if result.get("status") != "success":
+        return {}
+    flights = result.get("flights", {})
+    snapshot = {}
+    groups = ("direct",) if direct_only else ("direct", "transfers")
+    for group in groups:
+        for flight in flights.get(group, []):
+            key = f"{flight['time']}|{flight['flight_number']}"
+            snapshot[key] = dict(flight, transfer=(group == "transfers"))
+    return snapshot
+
+
+def diff_snapshots(previous, current, accepts=None):
+    """
+    Изменения между двумя снимками (полными, без фильтра по цене) с точки зрения подписки:
+    новые рейсы, пропавшие из выдачи, изменившие цену и ставшие дороже лимита max_miles.
+    Рейс, подешевевший до лимита, считается изменением цены, а не новым местом.
+    """
+    previous = previous or {}
+    accepts = accepts or (lambda flight: True)
+    was = {k for k, f in previous.items() if accepts(f)}
+    now = {k for k, f in current.items() if accepts(f)}
+    return {
+        "appeared": [current[k] for k in current if k in now and k not in previous],
+        "disappeared": [previous[k] for k in previous if k in was and k not in current],
+        "over_budget": [(previous[k], current[k]) for k in previous if k in was and k in current and k not in now],
+        "changed": [
+            (previous[k], current[k]) for k in current
+            if k in now and k in previous and (k not in was or previous[k].get("miles") != current[k].get("miles"))
+        ],
+    }
+
+
+def has_changes(changes):
+    return any(changes.values())
+
+
+class WatchMonitor:
+    """
+    Фоновый опрос подписок.
+
+    Подписки группируются по (откуда, куда, дата, только прямые): каждый такой запрос
+    ищется один раз за интервал, сколько бы пользователей на него ни подписалось.
+    Результат сравнивается с последним отправленным каждому подписчику,
+    и notify(watch, date, changes) вызывается только при изменениях.
+    """
+
+    def __init__(self, store, notify, parser=None):
+        self.store = store
+        self.notify = notify
+        self.parser = parser or AeroflotParser()
+        self._next_due = {}
+
+    async def run_forever(self, tick=None):
+        tick = tick or config.WATCH_TICK_SECONDS
+        while True:
+            try:
+                await self.poll_due()
+            except Exception as e:
+                logger.error(f"Watchlist poll failed: {e}")
+            await asyncio.sleep(tick)
+
+    async def _group_queries(self):
+        """{запрос: [подписки]} для всех активных подписок; прошедшие подписки удаляются"""
+        today = datetime.now().date()
+        groups = {}
+        for watch in await self.store.all():
+            if watch.is_expired(today):
+                logger.info(f"Watch {watch.id} of user {watch.user_id} expired")
+                await self.store.remove(watch.id)
+                continue
+            for date_str in watch.dates(today):
+                groups.setdefault(watch.query(date_str), []).append(watch)
+        return groups
+
+    async def poll_due(self):
+        groups = await self._group_queries()
+        now = time.monotonic()
+
+        # Забываем сроки запросов, на которые больше никто не подписан
+        for query in list(self._next_due):
+            if query not in groups:
+                del self._next_due[query]
+
+        due = [query for query in groups if self._next_due.get(query, 0) <= now]
+        if not due:
+            return
+
+        logger.info(f"Watchlist: polling {len(due)} of {len(groups)} queries")
+        for direct_only in (False, True):
+            routes = [query[:3] for query in due if query[3] == direct_only]
+            if not routes:
+                continue
+            try:
+                # Мониторинг встает в общую очередь и уступает ручным поискам
+                results = await scheduler.run(
+                    WATCH_JOB_USER,
+                    lambda: self.parser.get_tickets_batch(routes, direct_only=direct_only),
+                    kind="watchlist",
+                    cost=2 * len(routes)
+                )
+            except JobCancelled:
+                return
+
+            for route, result in results.items():
+                query = (*route, direct_only)
+                subscribers = groups[query]
+                self._next_due[query] = time.monotonic() + poll_interval(route[2], len(subscribers))
+                if result.get("status") not in ("success", "no_tickets"):
+                    logger.warning(f"Watchlist search {query} failed: {result.get('error')}")
+                    continue
+                await self._process_result(route[2], subscribers, flights_snapshot(result, direct_only))
+
+    async def _process_result(self, date_str, watches, snapshot):
+        for watch in watches:
+            previous = await self.store.get_snapshot(watch.id, date_str)
+            # Снимок храним целиком: так рейс дороже лимита отличается от пропавшего
+            await self.store.set_snapshot(watch.id, date_str, snapshot)
+            if previous is None:
+                # Первый опрос - точка отсчета, а не "появились" все текущие рейсы
+                logger.info(f"Watch {watch.id} {date_str}: baseline of {len(snapshot)} flights")
+                continue
+            changes = diff_snapshots(previous, snapshot, watch.accepts)
+            if not has_changes(changes):
+                continue
+            try:
+                await self.notify(watch, date_str, changes)
+            except Exception as e:
+                logger.error(f"Watch {watch.id} notification failed: {e}")
+
+
+# Общее хранилище подписок для всего процесса
+watch_store = WatchStore()
@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+import logging
+import signal
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class InflightUpdates(BaseMiddleware):
+    """
+    Считает апдейты, которые сейчас обрабатываются (поиск может идти минуту).
+    При остановке бот ждет их через drain(), а не обрывает на середине.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, handler, event, data):
+        self.count += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.count -= 1
+            if not self.count:
+                self._idle.set()
+
+    async def drain(self, timeout):
+        """Ждет завершения начатых апдейтов не дольше timeout сек. True - все завершились"""
+        if not self.count:
+            return True
+        logger.info(f"Waiting for {self.count} in-flight updates (up to {timeout}s)")
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Shutdown drain timed out, {self.count} updates still running")
+            return False
+        return True
+
+
+def make_session():
+    """Сессия бота: по умолчанию api.telegram.org, TELEGRAM_API_URL - свой сервер (локальный Bot API, заглушка)"""
+    if not config.TELEGRAM_API_URL:
+        return None
+    return AiohttpSession(api=TelegramAPIServer.from_base(config.TELEGRAM_API_URL))
+
+
+def webhook_secret():
+    """
+    Секрет для заголовка X-Telegram-Bot-Api-Secret-Token.
+    Если не задан, выводится из токена: одинаковый у всех экземпляров за балансировщиком
+    """
+    if config.WEBHOOK_SECRET:
+        return config.WEBHOOK_SECRET
+    return hashlib.sha256(f"webhook:{config.BOT_TOKEN}".encode()).hexdigest()
+
+
+def _stop_event():
+    """Событие остановки по SIGTERM/SIGINT (в polling это делает сам aiogram)"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: остается KeyboardInterrupt
+            pass
+    return stop
+
+
+async def run_webhook(bot, dp, inflight):
+    """
+    Принимает апдейты через вебхук до сигнала остановки.
+    Порядок остановки: закрыть порт (новые апдейты пойдут другим экземплярам
+    или Telegram повторит их позже), дождаться начатых поисков, затем shutdown диспетчера.
+    Вебхук при остановке не удаляется: его используют и другие экземпляры.
+    """
+    secret = webhook_secret()
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=config.WEBHOOK_PATH)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Webhook server on http://{config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}")
+
+    stop = _stop_event()
+    await dp.emit_startup(bot=bot, **dp.workflow_data)
+    try:
+        if config.WEBHOOK_URL:
+            await bot.set_webhook(
+                url=config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH,
+                secret_token=secret,
+                allowed_updates=dp.resolve_used_update_types(),
+                drop_pending_updates=config.WEBHOOK_DROP_PENDING,
+            )
+            logger.info(f"Webhook set to {config.WEBHOOK_URL}")
+        else:
+            logger.warning("WEBHOOK_URL is empty, webhook is expected to be set externally")
+        await stop.wait()
+    finally:
+        logger.info("Stopping webhook server")
+        await site.stop()
+        await inflight.drain(config.SHUTDOWN_DRAIN_TIMEOUT)
+        await dp.emit_shutdown(bot=bot, **dp.workflow_data)
+        # Заодно закрывает сессию бота (обработчик вебхука подписан на shutdown приложения)
+        await runner.cleanup()